@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Rotas de administração do SaaS
+Registradas em app.py com VisaoSobDemanda: este módulo só é importado na
+primeira requisição ao painel, e não na inicialização de cada worker
+"""
+
+import os
+from datetime import datetime
+
+from flask import current_app, jsonify, redirect, render_template, request, session, url_for
+
+from app import Barbearia, Profissional, Servico, User, _em_todos_shards, cache_fragmentos, db, enfileirar
+from roteamento import somente_leitura
+
+
+@somente_leitura
+def admin_dashboard():
+    """Dashboard de administração do SaaS"""
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    
+    total_users = User.query.filter(User.excluido_em.is_(None)).count()
+    usuarios_recentes = User.query.filter(User.excluido_em.is_(None)).order_by(User.created_at.desc()).limit(10).all()
+    
+    # Com sharding cada contagem é feita em todos os shards e somada; o resultado fica
+    # alguns segundos em cache (uma versão global seria uma linha disputada por todas as escritas)
+    contagens = cache_fragmentos.obter_ou_calcular(('admin', 'contagens'), lambda: _em_todos_shards(lambda: (
+        Barbearia.query.count(),
+        Profissional.query.count(),
+        Servico.query.count(),
+        Barbearia.query.join(User).filter(User.ativo == True).count(),
+        Barbearia.query.join(User).filter(User.ativo == False).count()
+    )), ttl=current_app.config['CACHE_ADMIN_TTL'])
+    (total_barbearias, total_profissionais, total_servicos,
+     barbearias_ativas, barbearias_bloqueadas) = (sum(valores) for valores in zip(*contagens))
+    
+    return render_template('admin_dashboard.html',
+                         total_users=total_users,
+                         total_barbearias=total_barbearias,
+                         total_profissionais=total_profissionais,
+                         total_servicos=total_servicos,
+                         usuarios_recentes=usuarios_recentes,
+                         barbearias_ativas=barbearias_ativas,
+                         barbearias_bloqueadas=barbearias_bloqueadas)
+
+
+def admin_metricas_pool():
+    """Métricas do pool de conexões deste processo (espera por conexão e esgotamentos)"""
+    if not session.get('admin'):
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    pools = {}
+    for bind, engine in db.engines.items():
+        nome = bind or 'principal'
+        situacao = getattr(engine.pool, 'situacao', None)
+        pools[nome] = situacao() if situacao else {'pool': type(engine.pool).__name__}
+    return jsonify({'success': True, 'pid': os.getpid(), 'pools': pools})
+
+
+def admin_cadastrar_usuario():
+    """Cadastra um novo usuário no sistema"""
+    if not session.get('admin'):
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    try:
+        data = request.get_json()
+        
+        # Validações
+        if not data.get('nome') or not data.get('email') or not data.get('senha'):
+            return jsonify({'success': False, 'message': 'Nome, email e senha são obrigatórios'})
+        
+        # Verifica se o email já existe
+        if User.query.filter_by(email=data['email']).first():
+            return jsonify({'success': False, 'message': 'Este email já está cadastrado no sistema'})
+        
+        # Cria o usuário
+        user = User(
+            nome=data['nome'],
+            email=data['email'],
+            telefone=data.get('telefone'),
+            tipo=data.get('tipo', 'cliente'),
+            ativo=data.get('ativo', True)
+        )
+        user.set_password(data['senha'])
+        
+        db.session.add(user)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True, 
+            'message': f'Usuário {user.nome} cadastrado com sucesso!',
+            'user': {
+                'id': user.id,
+                'nome': user.nome,
+                'email': user.email,
+                'tipo': user.tipo,
+                'ativo': user.ativo
+            }
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Erro ao cadastrar usuário: {str(e)}'})
+
+
+@somente_leitura
+def admin_usuarios():
+    """Gerenciamento de usuários"""
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    
+    usuarios = User.query.filter(User.excluido_em.is_(None)).order_by(User.created_at.desc()).all()
+    return render_template('admin_usuarios.html', usuarios=usuarios)
+
+
+def admin_toggle_user_status(user_id):
+    """Ativa/desativa usuário"""
+    if not session.get('admin'):
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    user = User.query.get_or_404(user_id)
+    if user.excluido_em is not None:
+        return jsonify({'success': False, 'message': 'Esta conta está sendo excluída'})
+    user.ativo = not user.ativo
+    
+    if user.ativo:
+        status_msg = 'ativada'
+    else:
+        status_msg = 'bloqueada'
+    
+    db.session.commit()
+    
+    return jsonify({
+        'success': True, 
+        'message': f'Conta {status_msg} com sucesso!',
+        'ativo': user.ativo
+    })
+
+
+def admin_delete_user(user_id):
+    """
+    Deleta usuário e todas suas barbearias
+    A conta é bloqueada na hora e os dados são apagados em lotes pelo worker
+    """
+    if not session.get('admin'):
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    user = User.query.get_or_404(user_id)
+    if user.excluido_em is None:
+        user.ativo = False
+        user.excluido_em = datetime.utcnow()
+        enfileirar('excluir-usuario', user_id=user.id)
+        db.session.commit()
+    
+    return jsonify({'success': True, 'message': 'Usuário deletado com sucesso!'})
+
+
+@somente_leitura
+def admin_barbearias():
+    """Gerenciamento de barbearias"""
+    if not session.get('admin'):
+        return redirect(url_for('login'))
+    
+    barbearias = sorted(
+        (barbearia
+         for lista in _em_todos_shards(lambda: Barbearia.query.join(User).all())
+         for barbearia in lista),
+        key=lambda barbearia: barbearia.created_at, reverse=True
+    )
+    return render_template('admin_barbearias.html', barbearias=barbearias)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Estruturas de apoio à agenda dos profissionais
+Índice de intervalos ocupados, expansão de séries recorrentes
+encadeamento de vários serviços em uma mesma visita e ordenação
+dos horários livres pelo aproveitamento da agenda
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from dateutil.rrule import rrulestr
+
+# Limite de ocorrências de uma série, para regras sem COUNT/UNTIL
+MAX_OCORRENCIAS_SERIE = 52
+
+
+class IndiceIntervalos:
+    """
+    Intervalos ocupados de um profissional, ordenados pelo início
+    Como a agenda de um profissional não tem sobreposições, basta olhar o
+    intervalo imediatamente anterior ao fim do candidato: O(log n) por consulta
+    """
+
+    def __init__(self, intervalos=()):
+        self._intervalos = sorted(intervalos)
+        self._inicios = [inicio for inicio, fim in self._intervalos]
+
+    def __len__(self):
+        return len(self._intervalos)
+
+    def __iter__(self):
+        return iter(self._intervalos)
+
+    def conflita(self, inicio, fim):
+        """True se [inicio, fim) sobrepõe algum intervalo ocupado"""
+        posicao = bisect_left(self._inicios, fim)
+        return posicao > 0 and self._intervalos[posicao - 1][1] > inicio
+
+    def adicionar(self, inicio, fim):
+        """Marca [inicio, fim) como ocupado"""
+        posicao = bisect_left(self._inicios, inicio)
+        self._inicios.insert(posicao, inicio)
+        self._intervalos.insert(posicao, (inicio, fim))
+
+    def lacuna(self, instante, limite_inicio, limite_fim):
+        """
+        Período livre que contém 'instante', recortado por [limite_inicio, limite_fim)
+        Retorna (inicio, fim) ou None se o instante estiver ocupado
+        """
+        posicao = bisect_right(self._inicios, instante)
+        if posicao > 0 and self._intervalos[posicao - 1][1] > instante:
+            return None
+
+        inicio = self._intervalos[posicao - 1][1] if posicao > 0 else limite_inicio
+        fim = self._inicios[posicao] if posicao < len(self._inicios) else limite_fim
+        inicio, fim = max(inicio, limite_inicio), min(fim, limite_fim)
+        return (inicio, fim) if inicio < fim else None
+
+
+def expandir_serie(regra, inicio, limite=MAX_OCORRENCIAS_SERIE):
+    """
+    Expande uma regra no formato RRULE (ex.: 'FREQ=WEEKLY;INTERVAL=2;COUNT=6')
+    a partir de 'inicio', devolvendo no máximo 'limite' datas
+    """
+    ocorrencias = []
+    for data_hora in rrulestr(regra, dtstart=inicio):
+        ocorrencias.append(data_hora)
+        if len(ocorrencias) >= limite:
+            break
+    return ocorrencias
+
+
+def planejar_itinerario(duracoes, candidatos, indices, janela, passo, a_partir_de=None):
+    """
+    Encontra o itinerário mais cedo para vários serviços em sequência,
+    cada um começando exatamente quando o anterior termina
+
+    duracoes   -- duração em minutos de cada serviço, na ordem desejada
+    candidatos -- para cada serviço, a lista de profissionais que podem atendê-lo
+    indices    -- dicionário profissional_id -> IndiceIntervalos do dia
+    janela     -- (inicio, fim) do expediente
+    passo      -- timedelta entre os inícios testados
+
+    Retorna a lista [(profissional_id, inicio, fim), ...] ou None
+    """
+    if len(candidatos) != len(duracoes):
+        raise ValueError('É preciso uma lista de candidatos para cada serviço')
+
+    total = timedelta(minutes=sum(duracoes))
+    inicio = janela[0]
+    if a_partir_de is not None and a_partir_de > inicio:
+        # Alinha ao passo da agenda a partir da abertura
+        passos = -(-(a_partir_de - janela[0]) // passo)
+        inicio = janela[0] + passos * passo
+
+    while inicio + total <= janela[1]:
+        itinerario = _encadear(duracoes, candidatos, indices, inicio, None)
+        if itinerario is not None:
+            return itinerario
+        inicio += passo
+    return None
+
+
+def _encadear(duracoes, candidatos, indices, inicio, anterior):
+    """Busca em profundidade; prefere manter o mesmo profissional do serviço anterior"""
+    if not duracoes:
+        return []
+
+    fim = inicio + timedelta(minutes=duracoes[0])
+    opcoes = sorted(candidatos[0], key=lambda profissional_id: profissional_id != anterior)
+    for profissional_id in opcoes:
+        if indices[profissional_id].conflita(inicio, fim):
+            continue
+        resto = _encadear(duracoes[1:], candidatos[1:], indices, fim, profissional_id)
+        if resto is not None:
+            return [(profissional_id, inicio, fim)] + resto
+    return None
+
+
+def ordenar_por_encaixe(inicios, duracao, indice, janela, menor_duracao):
+    """
+    Ordena os inícios livres pelo aproveitamento da agenda
+    Uma sobra antes ou depois do atendimento que seja menor que o serviço mais
+    curto da barbearia não pode mais ser vendida e conta como desperdício
+
+    Retorna a lista [(inicio, minutos_desperdicados), ...] do melhor para o pior
+    """
+    ranking = []
+    for inicio in inicios:
+        fim = inicio + timedelta(minutes=duracao)
+        lacuna = indice.lacuna(inicio, janela[0], janela[1])
+        if lacuna is None:
+            continue
+
+        sobras = [(inicio - lacuna[0]).total_seconds() // 60, (lacuna[1] - fim).total_seconds() // 60]
+        desperdicio = sum(sobra for sobra in sobras if 0 < sobra < menor_duracao)
+        fragmentos = sum(1 for sobra in sobras if sobra > 0)
+        ranking.append(((desperdicio, fragmentos, inicio), int(desperdicio)))
+
+    ranking.sort()
+    return [(chave[2], desperdicio) for chave, desperdicio in ranking]
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Agenda ao vivo por Server-Sent Events
+Uma única thread por processo segue a outbox (eventos_saida) e publica cada
+evento em um canal em memória; cada navegador conectado tem só uma fila nesse
+canal, então mil recepções abertas custam uma consulta por intervalo, e não
+mil requisições a /agenda
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# topicos: ex. ('barbearia:1', 'profissional:3'); dados já no formato enviado ao navegador
+EventoAgenda = namedtuple('EventoAgenda', 'id tipo topicos dados')
+
+
+class Assinatura:
+    """Fila de um cliente conectado a um tópico"""
+
+    def __init__(self, topico, tamanho):
+        self.topico = topico
+        self.fila = queue.Queue(tamanho)
+        # Cliente lento demais: o stream é encerrado e ele reconecta com Last-Event-ID
+        self.atrasada = False
+
+
+class CanalAoVivo:
+    """
+    Pub/sub em memória por tópico
+    Guarda os últimos eventos para reenviar o que o cliente perdeu ao reconectar
+    """
+
+    def __init__(self, historico=500, fila_por_cliente=100):
+        self.fila_por_cliente = fila_por_cliente
+        self._historico = deque(maxlen=historico)
+        self._assinaturas = {}
+        self._trava = threading.Lock()
+
+    def publicar(self, evento):
+        with self._trava:
+            self._historico.append(evento)
+            destinos = [assinatura for topico in evento.topicos for assinatura in self._assinaturas.get(topico, ())]
+        for assinatura in destinos:
+            try:
+                assinatura.fila.put_nowait(evento)
+            except queue.Full:
+                assinatura.atrasada = True
+
+    def assinar(self, topico, ultimo_id=None):
+        """Nova assinatura; com ultimo_id já recebe os eventos guardados depois dele"""
+        assinatura = Assinatura(topico, self.fila_por_cliente)
+        with self._trava:
+            self._assinaturas.setdefault(topico, set()).add(assinatura)
+            if ultimo_id is not None:
+                # Um id menor pode ser publicado depois de um maior (commit atrasado):
+                # reenvia pela ordem de publicação a partir do último recebido
+                ids = [evento.id for evento in self._historico]
+                posicao = ids.index(ultimo_id) + 1 if ultimo_id in ids else None
+                for indice, evento in enumerate(self._historico):
+                    perdido = indice >= posicao if posicao is not None else evento.id > ultimo_id
+                    if perdido and topico in evento.topicos:
+                        try:
+                            assinatura.fila.put_nowait(evento)
+                        except queue.Full:
+                            break
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._trava:
+            assinaturas = self._assinaturas.get(assinatura.topico)
+            if assinaturas is not None:
+                assinaturas.discard(assinatura)
+                if not assinaturas:
+                    del self._assinaturas[assinatura.topico]
+
+    def conectados(self):
+        with self._trava:
+            return sum(len(assinaturas) for assinaturas in self._assinaturas.values())
+
+
+class PosicaoOutbox:
+    """
+    Posição de leitura da outbox de um banco
+    O id é reservado no INSERT mas só fica visível no COMMIT, então um id menor pode
+    aparecer depois de um maior. Os ids pulados viram lacunas, procuradas de novo a
+    cada leitura por até 'espera' segundos (transação desfeita nunca aparece)
+    """
+
+    def __init__(self, ultimo, espera=30.0, max_lacunas=100):
+        self.ultimo = ultimo
+        self.espera = espera
+        self.max_lacunas = max_lacunas
+        self._lacunas = {}
+
+    def avancar(self, ids):
+        """Registra os ids lidos depois de 'ultimo', em ordem crescente, e os pulados entre eles"""
+        agora = time.monotonic()
+        for id_ in ids:
+            for faltando in range(max(self.ultimo + 1, id_ - self.max_lacunas), id_):
+                self._lacunas[faltando] = agora
+            self.ultimo = id_
+
+    def preencher(self, ids):
+        """Lacunas que apareceram"""
+        for id_ in ids:
+            self._lacunas.pop(id_, None)
+
+    def lacunas(self):
+        """Ids pulados ainda dentro da espera, em ordem"""
+        limite = time.monotonic() - self.espera
+        self._lacunas = {id_: desde for id_, desde in self._lacunas.items() if desde > limite}
+        return sorted(self._lacunas)
+
+
+class SeguidorOutbox:
+    """
+    Thread única que lê os eventos novos e os publica no canal
+
+    ler(ultimos) -- eventos depois das posições em 'ultimos' (dict banco -> PosicaoOutbox,
+                    atualizado pela própria função): lista de EventoAgenda
+    """
+
+    def __init__(self, canal, ler, intervalo=1.0):
+        self.canal = canal
+        self.ler = ler
+        self.intervalo = intervalo
+        self.ultimos = {}
+        self._thread = None
+        self._trava = threading.Lock()
+
+    def iniciar(self):
+        """Sobe a thread na primeira conexão; chamadas seguintes não fazem nada"""
+        with self._trava:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._laco, name='agenda-ao-vivo', daemon=True)
+                self._thread.start()
+
+    def _laco(self):
+        while True:
+            try:
+                for evento in self.ler(self.ultimos):
+                    self.canal.publicar(evento)
+            except Exception:
+                logger.exception('Falha ao ler eventos da agenda')
+            time.sleep(self.intervalo)
+
+
+def formatar(evento):
+    """Evento no formato text/event-stream"""
+    return f'id: {evento.id}\nevent: {evento.tipo}\ndata: {json.dumps(evento.dados, default=str)}\n\n'
+
+
+def transmitir(canal, topico, ultimo_id=None, batimento=15, duracao=300):
+    """
+    Gerador do corpo da resposta SSE
+    Envia um comentário a cada 'batimento' segundos para manter proxies abertos e
+    encerra depois de 'duracao' segundos; o EventSource reconecta sozinho
+    """
+    assinatura = canal.assinar(topico, ultimo_id)
+    fim = time.monotonic() + duracao
+    try:
+        yield 'retry: 3000\n\n'
+        while not assinatura.atrasada:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                return
+            try:
+                yield formatar(assinatura.fila.get(timeout=min(batimento, restante)))
+            except queue.Empty:
+                yield ': batimento\n\n'
+    finally:
+        canal.cancelar(assinatura)
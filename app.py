@@ -4,13 +4,47 @@ Barbearia App - Sistema de Agendamentos SaaS
 Backend principal da aplicação
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session, g, make_response, send_file
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
+from jinja2 import FileSystemBytecodeCache
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from werkzeug.utils import import_string
+from sqlalchemy import DDL, and_, case, delete, event, exists, func, insert, or_, select, text, tuple_, update, inspect as inspecionar
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from blinker import Namespace
+from contextlib import contextmanager
+from functools import cache, cached_property, wraps
+from datetime import datetime, date, time, timedelta
+import gzip
+import hashlib
+import json
 import os
+import secrets
+import signal
+import sys
+import threading
+import click
 from dotenv import load_dotenv
+from config import config
+from metricas_pool import opcoes_engine
+from roteamento import SessaoRoteada, binds_replicas, somente_leitura
+from shards import (PREFIXO_SHARD, AnelShards, binds_shards, copiar_tenant, dono_do_id, em_shard,
+                    espelhar_linhas, id_global, inserir_ou_atualizar, remover_tenant)
+from horarios import HorarioSemanal, CacheHorarios
+from agenda import IndiceIntervalos, expandir_serie, planejar_itinerario, ordenar_por_encaixe
+from lista_espera import FilasEspera, PedidoEspera
+from arquivo import arquivar_em_lotes, ddl_visao, tabela_visao
+from exclusao import apagar_em_lotes
+from tarefas import FilaTarefas, Trabalhador
+from lembretes import AgendadorLembretes, EnviadorArquivo, EnviadorSMTP, Mensagem
+from outbox import Retransmissor, gravar_evento
+from webhooks import Entrega, EntregadorWebhooks, espera as espera_webhook
+from ao_vivo import CanalAoVivo, EventoAgenda, PosicaoOutbox, SeguidorOutbox, transmitir
+from fragmentos import CacheFragmentos, ExtensaoFragmentos
+from ativos import ManifestoAtivos
 
 # Carrega configurações do ambiente
 load_dotenv()
@@ -18,19 +52,148 @@ load_dotenv()
 # Inicializa a aplicação Flask
 app = Flask(__name__)
 
-# Configurações da aplicação
+# Com python app.py este módulo é __main__; visões carregadas sob demanda (admin.py) importam "app"
+sys.modules.setdefault('app', sys.modules[__name__])
+
+# Configurações da aplicação (FLASK_CONFIG escolhe a classe em config.py)
+app.config.from_object(config[os.getenv('FLASK_CONFIG', 'default')])
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'sua-chave-secreta-aqui-mude-em-producao')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///barbearia.db')
+if not app.config.get('SQLALCHEMY_DATABASE_URI'):
+    # A classe de configuração decide (TestingConfig usa SQLite em memória); DATABASE_URL só preenche o que faltar
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///barbearia.db')
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
+    # Provedores como Heroku/Render ainda entregam o esquema antigo
+    app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://', 1)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(app.config)
+app.config['SQLALCHEMY_BINDS'] = dict(
+    binds_replicas(app.config['SQLALCHEMY_REPLICAS'], lambda url: opcoes_engine(app.config, url)),
+    **binds_shards(app.config['SQLALCHEMY_SHARDS'], lambda url: opcoes_engine(app.config, url))
+)
+app.config['INTERVALO_AGENDA_MINUTOS'] = int(os.getenv('INTERVALO_AGENDA_MINUTOS', app.config['INTERVALO_AGENDA_MINUTOS']))
+app.config['CACHE_HORARIOS_TTL'] = int(os.getenv('CACHE_HORARIOS_TTL', app.config['CACHE_HORARIOS_TTL']))
+app.config['OFERTA_LISTA_ESPERA_MINUTOS'] = int(os.getenv('OFERTA_LISTA_ESPERA_MINUTOS', app.config['OFERTA_LISTA_ESPERA_MINUTOS']))
+app.config['TAREFAS_TEMPO_LIMITE'] = int(os.getenv('TAREFAS_TEMPO_LIMITE', app.config['TAREFAS_TEMPO_LIMITE']))
+app.config['WEBHOOKS_LIMITE_POR_ENDPOINT'] = int(os.getenv('WEBHOOKS_LIMITE_POR_ENDPOINT', app.config['WEBHOOKS_LIMITE_POR_ENDPOINT']))
 
-# Inicializa extensões
-db = SQLAlchemy(app)
+# Inicializa extensões (a sessão envia leituras de páginas somente leitura às réplicas)
+db = SQLAlchemy(app, session_options={'class_': SessaoRoteada})
+# Alterações de esquema ficam em migrations/ (flask --app app db upgrade)
+migrate = Migrate(app, db, directory=os.path.join(app.root_path, 'migrations'))
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Templates compilados ficam em disco: depois de um deploy ou reinício cada processo
+# só carrega o bytecode (o Jinja confere o conteúdo do arquivo e recompila o que mudou)
+if app.config['JINJA_CACHE_BYTECODE']:
+    pasta_cache_templates = os.path.join(app.instance_path, app.config['JINJA_CACHE_PASTA'])
+    os.makedirs(pasta_cache_templates, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(pasta_cache_templates)
+
+# Tag {% cache %} para blocos caros dos templates (ver fragmentos.py)
+cache_fragmentos = CacheFragmentos(tamanho=app.config['CACHE_FRAGMENTOS_TAMANHO'], ttl=app.config['CACHE_FRAGMENTOS_TTL'])
+app.jinja_env.add_extension(ExtensaoFragmentos)
+app.jinja_env.cache_fragmentos = cache_fragmentos
+
+def precompilar_templates():
+    """Compila todos os templates de uma vez (cache em memória e em disco); retorna quantos"""
+    nomes = app.jinja_env.list_templates(extensions=['html'])
+    for nome in nomes:
+        app.jinja_env.get_template(nome)
+    return len(nomes)
+
+def _resumir_templates():
+    """Resumo do conteúdo de todos os templates: muda a cada deploy que altera alguma página"""
+    resumo = hashlib.sha256()
+    for nome in sorted(app.jinja_env.list_templates()):
+        codigo = app.jinja_env.loader.get_source(app.jinja_env, nome)[0]
+        resumo.update(f'{nome}\0{codigo}\0'.encode())
+    return resumo.hexdigest()[:12]
+
+versao_templates = _resumir_templates()
+
+@app.cli.command('precompilar-templates')
+def precompilar_templates_cli():
+    """Grava o bytecode de todos os templates (rode no deploy, antes de subir os workers)"""
+    click.echo(f'{precompilar_templates()} templates compilados')
+
+# ===== ARQUIVOS ESTÁTICOS E COMPRESSÃO =====
+
+# O service worker mantém a URL fixa (/sw.js) e recebe a lista de arquivos versionados
+SERVICE_WORKER = 'js/sw.js'
+ativos = ManifestoAtivos(app.static_folder, os.path.join(app.instance_path, app.config['ATIVOS_PASTA']),
+                         ignorar=[SERVICE_WORKER])
+TIPOS_COMPRESSIVEIS = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript'}
+
+@app.url_defaults
+def _versionar_estaticos(endpoint, valores):
+    """url_for('static', filename='css/style.css') aponta para o nome com hash"""
+    if endpoint == 'static' and app.config['ATIVOS_VERSIONADOS'] and 'filename' in valores:
+        valores['filename'] = ativos.url(valores['filename'])
+
+def servir_estatico(filename):
+    """Nomes versionados: cache imutável e a variante .br/.gz aceita pelo navegador"""
+    escolhido = ativos.escolher(filename, request.accept_encodings)
+    if escolhido is None:
+        # Nome original (links antigos, desenvolvimento): comportamento padrão do Flask
+        return app.send_static_file(filename)
+    
+    ativo, caminho, codificacao = escolhido
+    resposta = send_file(caminho, mimetype=ativo.mimetype, conditional=True)
+    if codificacao:
+        resposta.headers['Content-Encoding'] = codificacao
+    if ativo.variantes:
+        resposta.vary.add('Accept-Encoding')
+    resposta.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resposta
+
+app.view_functions['static'] = servir_estatico
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker na raiz (controla o site todo) com os arquivos versionados para o precache"""
+    with open(os.path.join(app.static_folder, SERVICE_WORKER), encoding='utf-8') as arquivo:
+        codigo = arquivo.read()
+    precache = [url_for('static', filename=nome) for nome in ativos.versionados]
+    corpo = f'self.ATIVOS = {json.dumps({"versao": ativos.versao, "arquivos": precache})};\n{codigo}'
+    
+    resposta = Response(corpo, mimetype='application/javascript')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.set_etag(hashlib.sha1(corpo.encode()).hexdigest())
+    return resposta.make_conditional(request)
+
+@app.after_request
+def _comprimir_resposta(resposta):
+    """gzip das respostas geradas (HTML/JSON); arquivos e streams (SSE) passam direto"""
+    if (not app.config['COMPRESSAO_DINAMICA'] or resposta.status_code != 200 or resposta.direct_passthrough
+            or resposta.is_streamed or 'Content-Encoding' in resposta.headers
+            or resposta.mimetype not in TIPOS_COMPRESSIVEIS or 'gzip' not in request.accept_encodings):
+        return resposta
+    
+    corpo = resposta.get_data()
+    if len(corpo) < app.config['COMPRESSAO_MINIMO']:
+        return resposta
+    resposta.set_data(gzip.compress(corpo, compresslevel=app.config['COMPRESSAO_NIVEL']))
+    resposta.headers['Content-Encoding'] = 'gzip'
+    resposta.vary.add('Accept-Encoding')
+    etag, fraca = resposta.get_etag()
+    if etag and not fraca:
+        # Os bytes comprimidos não são os mesmos do original: a ETag passa a ser fraca
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+# Sinais de eventos da agenda (outros módulos podem se inscrever)
+sinais = Namespace()
+agendamento_cancelado = sinais.signal('agendamento-cancelado')
+vaga_oferecida = sinais.signal('vaga-oferecida')
+agendamentos_encerrados = sinais.signal('agendamentos-encerrados')
+
 # ===== MODELOS DO BANCO DE DADOS =====
 
+# IDs das tabelas de tenant; com sharding levam o dono nos bits altos (ver shards.py)
+IdTenant = db.BigInteger().with_variant(db.Integer, 'sqlite')
+
 class User(UserMixin, db.Model):
     """
     Modelo para usuários do sistema (clientes que possuem barbearias)
@@ -46,6 +209,7 @@ class User(UserMixin, db.Model):
     ativo = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    excluido_em = db.Column(db.DateTime)
     
     # Relacionamento com barbearias
     barbearias = db.relationship('Barbearia', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -67,7 +231,7 @@ class Barbearia(db.Model):
     """
     __tablename__ = 'barbearias'
     
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(IdTenant, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     endereco = db.Column(db.Text)
     telefone = db.Column(db.String(20))
@@ -84,17 +248,40 @@ class Barbearia(db.Model):
     # Relacionamentos
     profissionais = db.relationship('Profissional', backref='barbearia', lazy=True, cascade='all, delete-orphan')
     servicos = db.relationship('Servico', backref='barbearia', lazy=True, cascade='all, delete-orphan')
+    excecoes_horario = db.relationship('ExcecaoHorario', backref='barbearia', lazy=True, cascade='all, delete-orphan')
+    webhooks = db.relationship('Webhook', backref='barbearia', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Barbearia {self.nome}>'
 
+class ExcecaoHorario(db.Model):
+    """
+    Modelo para exceções no horário de funcionamento (feriados e horários especiais)
+    """
+    __tablename__ = 'excecoes_horario'
+    __table_args__ = (db.UniqueConstraint('barbearia_id', 'data', name='uq_excecao_barbearia_data'),)
+    
+    id = db.Column(IdTenant, primary_key=True)
+    data = db.Column(db.Date, nullable=False)
+    fechado = db.Column(db.Boolean, default=True)
+    horario_abertura = db.Column(db.Time)
+    horario_fechamento = db.Column(db.Time)
+    descricao = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Chave estrangeira para a barbearia
+    barbearia_id = db.Column(IdTenant, db.ForeignKey('barbearias.id'), nullable=False)
+    
+    def __repr__(self):
+        return f'<ExcecaoHorario {self.barbearia_id} - {self.data}>'
+
 class Profissional(db.Model):
     """
     Modelo para profissionais que trabalham nas barbearias
     """
     __tablename__ = 'profissionais'
     
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(IdTenant, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     especialidade = db.Column(db.String(100))
     telefone = db.Column(db.String(20))
@@ -103,7 +290,7 @@ class Profissional(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Chave estrangeira para a barbearia
-    barbearia_id = db.Column(db.Integer, db.ForeignKey('barbearias.id'), nullable=False)
+    barbearia_id = db.Column(IdTenant, db.ForeignKey('barbearias.id'), nullable=False)
     
     # Relacionamentos
     agendamentos = db.relationship('Agendamento', backref='profissional', lazy=True, cascade='all, delete-orphan')
@@ -117,7 +304,7 @@ class Servico(db.Model):
     """
     __tablename__ = 'servicos'
     
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(IdTenant, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.Text)
     preco = db.Column(db.Numeric(10, 2), nullable=False)
@@ -126,7 +313,7 @@ class Servico(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Chave estrangeira para a barbearia
-    barbearia_id = db.Column(db.Integer, db.ForeignKey('barbearias.id'), nullable=False)
+    barbearia_id = db.Column(IdTenant, db.ForeignKey('barbearias.id'), nullable=False)
     
     # Relacionamentos
     agendamentos = db.relationship('Agendamento', backref='servico', lazy=True, cascade='all, delete-orphan')
@@ -139,30 +326,1421 @@ class Agendamento(db.Model):
     Modelo para agendamentos de serviços
     """
     __tablename__ = 'agendamentos'
+    __table_args__ = (db.Index('ix_agendamentos_profissional_periodo', 'profissional_id', 'data_hora', 'data_hora_fim'),)
     
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(IdTenant, primary_key=True)
     data_hora = db.Column(db.DateTime, nullable=False)
+    data_hora_fim = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.String(20), default='confirmado')
     observacoes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Chaves estrangeiras
     cliente_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    profissional_id = db.Column(db.Integer, db.ForeignKey('profissionais.id'), nullable=False)
-    servico_id = db.Column(db.Integer, db.ForeignKey('servicos.id'), nullable=False)
+    profissional_id = db.Column(IdTenant, db.ForeignKey('profissionais.id'), nullable=False)
+    servico_id = db.Column(IdTenant, db.ForeignKey('servicos.id'), nullable=False)
+    serie_id = db.Column(IdTenant, db.ForeignKey('series_agendamento.id'))
     
     # Relacionamento com cliente
     cliente = db.relationship('User', backref='agendamentos')
     
     def __repr__(self):
         return f'<Agendamento {self.id} - {self.data_hora}>'
+    
+    @classmethod
+    def existe_conflito(cls, profissional_id, inicio, fim, ignorar_id=None):
+        """
+        Verifica se o profissional tem agendamento ativo sobrepondo [inicio, fim)
+        Usa apenas comparação de intervalos, atendida pelo índice do período
+        """
+        consulta = db.session.query(cls.id).filter(
+            cls.profissional_id == profissional_id,
+            cls.status != 'cancelado',
+            cls.data_hora < fim,
+            cls.data_hora_fim > inicio
+        )
+        if ignorar_id is not None:
+            consulta = consulta.filter(cls.id != ignorar_id)
+        return consulta.first() is not None
+    
+    def verificar_conflito(self):
+        """
+        Verifica se há conflito de horário com outros agendamentos
+        Retorna True se houver conflito, False caso contrário
+        """
+        fim = self.data_hora_fim or self.data_hora + timedelta(minutes=self.servico.duracao)
+        return Agendamento.existe_conflito(self.profissional_id, self.data_hora, fim, self.id)
+
+class SerieAgendamento(db.Model):
+    """
+    Modelo para séries de agendamentos recorrentes (ex.: a cada duas semanas)
+    """
+    __tablename__ = 'series_agendamento'
+    
+    id = db.Column(IdTenant, primary_key=True)
+    regra = db.Column(db.String(255), nullable=False)
+    data_inicio = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Chaves estrangeiras
+    cliente_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    profissional_id = db.Column(IdTenant, db.ForeignKey('profissionais.id'), nullable=False)
+    servico_id = db.Column(IdTenant, db.ForeignKey('servicos.id'), nullable=False)
+    
+    # Relacionamentos
+    agendamentos = db.relationship('Agendamento', backref='serie', lazy=True)
+    
+    def __repr__(self):
+        return f'<SerieAgendamento {self.id} - {self.regra}>'
+
+class ListaEspera(db.Model):
+    """
+    Modelo para clientes aguardando vaga com um profissional em um dia
+    """
+    __tablename__ = 'lista_espera'
+    __table_args__ = (db.Index('ix_lista_espera_profissional_data', 'profissional_id', 'data', 'status'),)
+    
+    id = db.Column(IdTenant, primary_key=True)
+    data = db.Column(db.Date, nullable=False)
+    janela_inicio = db.Column(db.Time, nullable=False)
+    janela_fim = db.Column(db.Time, nullable=False)
+    status = db.Column(db.String(20), default='aguardando')
+    oferta_inicio = db.Column(db.DateTime)
+    oferta_expira_em = db.Column(db.DateTime)
+    # Agendamento cujo cancelamento liberou a vaga oferecida (sem chave estrangeira: ele pode ser arquivado)
+    oferta_origem_id = db.Column(IdTenant, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Chaves estrangeiras
+    cliente_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    profissional_id = db.Column(IdTenant, db.ForeignKey('profissionais.id'), nullable=False)
+    servico_id = db.Column(IdTenant, db.ForeignKey('servicos.id'), nullable=False)
+    
+    # Relacionamentos
+    profissional = db.relationship('Profissional')
+    servico = db.relationship('Servico')
+    
+    def __repr__(self):
+        return f'<ListaEspera {self.id} - {self.data}>'
+
+# Eventos da outbox repassados aos webhooks das barbearias
+TIPOS_EVENTO_WEBHOOK = ('agendamento-criado', 'agendamento-cancelado', 'agendamentos-encerrados')
+
+class Webhook(db.Model):
+    """
+    Modelo para endpoints HTTP do dono que recebem os eventos de agendamento da barbearia
+    """
+    __tablename__ = 'webhooks'
+    
+    id = db.Column(IdTenant, primary_key=True)
+    url = db.Column(db.String(500), nullable=False)
+    segredo = db.Column(db.String(64), nullable=False)
+    eventos = db.Column(db.String(200), nullable=False, default=','.join(TIPOS_EVENTO_WEBHOOK))
+    ativo = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Chaves estrangeiras
+    barbearia_id = db.Column(IdTenant, db.ForeignKey('barbearias.id'), nullable=False)
+    
+    # Relacionamentos
+    entregas = db.relationship('EntregaWebhook', backref='webhook', lazy=True, cascade='all, delete-orphan')
+    
+    def assina(self, tipo):
+        return tipo in self.eventos.split(',')
+    
+    def __repr__(self):
+        return f'<Webhook {self.id} - {self.url}>'
+
+class EntregaWebhook(db.Model):
+    """
+    Modelo para a entrega de um evento a um webhook, enviada por flask webhooks
+    """
+    __tablename__ = 'entregas_webhook'
+    __table_args__ = (
+        db.UniqueConstraint('webhook_id', 'evento_id', name='uq_entregas_webhook_evento'),
+        db.Index('ix_entregas_webhook_pendentes', 'status', 'proxima_tentativa_em'),
+    )
+    
+    id = db.Column(IdTenant, primary_key=True)
+    evento_id = db.Column(db.Integer, nullable=False)
+    tipo = db.Column(db.String(50), nullable=False)
+    dados = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pendente')  # pendente, entregue, falhou
+    tentativas = db.Column(db.Integer, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime, default=datetime.utcnow)
+    erro = db.Column(db.Text)
+    entregue_em = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Chaves estrangeiras
+    webhook_id = db.Column(IdTenant, db.ForeignKey('webhooks.id', ondelete='CASCADE'), nullable=False)
+    
+    def __repr__(self):
+        return f'<EntregaWebhook {self.id} - {self.tipo} ({self.status})>'
+
+class Lembrete(db.Model):
+    """
+    Modelo para lembretes de agendamento (ex.: 24h e 1h antes), enviados por flask lembretes
+    """
+    __tablename__ = 'lembretes'
+    __table_args__ = (db.Index('ix_lembretes_pendentes', 'enviado_em', 'enviar_em'),)
+    
+    agendamento_id = db.Column(IdTenant, db.ForeignKey('agendamentos.id', ondelete='CASCADE'), primary_key=True)
+    antecedencia = db.Column(db.Integer, primary_key=True)
+    enviar_em = db.Column(db.DateTime, nullable=False)
+    enviado_em = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Lembrete {self.agendamento_id} - {self.antecedencia}min>'
+
+class EventoSaida(db.Model):
+    """
+    Modelo para a outbox: eventos de agendamento gravados na mesma transação
+    e publicados depois pelo retransmissor (flask outbox)
+    """
+    __tablename__ = 'eventos_saida'
+    __table_args__ = (db.Index('ix_eventos_saida_pendentes', 'publicado_em', 'id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    agregado_id = db.Column(db.BigInteger)
+    dados = db.Column(db.Text, nullable=False)
+    tentativas = db.Column(db.Integer, default=0)
+    erro = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    publicado_em = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<EventoSaida {self.id} - {self.tipo}>'
+
+class AgendamentoArquivado(db.Model):
+    """
+    Modelo para agendamentos antigos (realizados ou cancelados) retirados da tabela quente
+    Sem chaves estrangeiras, para o histórico sobreviver à exclusão de profissionais e serviços
+    """
+    __tablename__ = 'agendamentos_arquivo'
+    __table_args__ = (db.Index('ix_agendamentos_arquivo_profissional_data', 'profissional_id', 'data_hora'),)
+    
+    id = db.Column(IdTenant, primary_key=True)
+    data_hora = db.Column(db.DateTime, nullable=False)
+    data_hora_fim = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20))
+    observacoes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    arquivado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    cliente_id = db.Column(db.Integer, nullable=False)
+    profissional_id = db.Column(IdTenant, nullable=False)
+    servico_id = db.Column(IdTenant, nullable=False)
+    serie_id = db.Column(IdTenant)
+    
+    def __repr__(self):
+        return f'<AgendamentoArquivado {self.id} - {self.data_hora}>'
+
+class Tarefa(db.Model):
+    """
+    Modelo para tarefas em segundo plano executadas pelos workers (flask worker)
+    """
+    __tablename__ = 'tarefas'
+    __table_args__ = (db.Index('ix_tarefas_status_executar_em', 'status', 'executar_em'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    argumentos = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), default='pendente')
+    tentativas = db.Column(db.Integer, default=0)
+    executar_em = db.Column(db.DateTime, default=datetime.utcnow)
+    trabalhador = db.Column(db.String(100))
+    iniciada_em = db.Column(db.DateTime)
+    concluida_em = db.Column(db.DateTime)
+    erro = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Tarefa {self.id} - {self.tipo} ({self.status})>'
+
+class TenantShard(db.Model):
+    """
+    Modelo para o diretório de shards: em qual shard ficam os dados de cada dono
+    """
+    __tablename__ = 'tenant_shards'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    shard = db.Column(db.String(50), nullable=False)
+    fixo = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<TenantShard {self.user_id} - {self.shard}>'
+
+class ContadorIds(db.Model):
+    """
+    Modelo para a sequência local de IDs de cada dono por tabela (fica no shard do dono)
+    """
+    __tablename__ = 'contadores_ids'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    tabela = db.Column(db.String(50), primary_key=True)
+    ultimo = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ContadorIds {self.user_id} - {self.tabela}>'
+
+class VersaoDados(db.Model):
+    """
+    Modelo para a versão dos dados de cada dono por escopo (fica no shard do dono)
+    Incrementada a cada escrita; chave dos fragmentos de template em cache
+    """
+    __tablename__ = 'versoes_dados'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    escopo = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<VersaoDados {self.user_id} - {self.escopo}: {self.versao}>'
 
 # ===== CONFIGURAÇÃO DO LOGIN MANAGER =====
 
 @login_manager.user_loader
 def load_user(user_id):
     """Carrega usuário para o Flask-Login"""
-    return User.query.get(int(user_id))
+    user = User.query.get(int(user_id))
+    # Contas em exclusão perdem a sessão imediatamente
+    return user if user is not None and user.excluido_em is None else None
+
+@event.listens_for(Agendamento, 'before_insert')
+@event.listens_for(Agendamento, 'before_update')
+def _calcular_fim_agendamento(mapper, connection, target):
+    """
+    Mantém data_hora_fim = data_hora + duração do serviço
+    Quem já carregou o serviço informa data_hora_fim junto (séries e lotes não
+    pagam uma consulta por linha); só sem ela a duração é lida do banco
+    """
+    estado = inspecionar(target)
+    if target.data_hora_fim is not None and (estado.attrs.data_hora_fim.history.has_changes() or not (
+            estado.attrs.data_hora.history.has_changes() or estado.attrs.servico_id.history.has_changes())):
+        return
+    
+    duracao = connection.execute(select(Servico.duracao).where(Servico.id == target.servico_id)).scalar()
+    if duracao is not None:
+        target.data_hora_fim = target.data_hora + timedelta(minutes=duracao)
+
+# No PostgreSQL o próprio banco impede dois agendamentos ativos sobrepostos
+# para o mesmo profissional (restrição de exclusão com índice GiST)
+RESTRICAO_SOBREPOSICAO = 'agendamentos_sem_sobreposicao'
+
+for comando in (
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    "ALTER TABLE agendamentos ADD COLUMN periodo tstzrange GENERATED ALWAYS AS "
+    "(tstzrange(data_hora AT TIME ZONE 'UTC', data_hora_fim AT TIME ZONE 'UTC', '[)')) STORED",
+    f"ALTER TABLE agendamentos ADD CONSTRAINT {RESTRICAO_SOBREPOSICAO} "
+    "EXCLUDE USING gist (profissional_id WITH =, periodo WITH &&) WHERE (status <> 'cancelado')",
+):
+    event.listen(Agendamento.__table__, 'after_create', DDL(comando).execute_if(dialect='postgresql'))
+
+# Visão agendamentos_historico = agendamentos + agendamentos_arquivo (para relatórios)
+criar_visao_historico, remover_visao_historico = ddl_visao(Agendamento.__table__, AgendamentoArquivado.__table__)
+event.listen(db.metadata, 'after_create', criar_visao_historico)
+event.listen(db.metadata, 'before_drop', remover_visao_historico)
+historico_agendamentos = tabela_visao(Agendamento.__table__, AgendamentoArquivado.__table__)
+
+def _violou_sobreposicao(erro):
+    """True se o IntegrityError veio da restrição de exclusão (SQLSTATE 23P01)"""
+    return getattr(erro.orig, 'pgcode', None) == '23P01' or RESTRICAO_SOBREPOSICAO in str(erro.orig)
+
+def _gravar_agendamentos():
+    """
+    Confirma a transação com novos agendamentos
+    Retorna None em caso de sucesso ou a mensagem se o banco recusou por sobreposição
+    """
+    try:
+        db.session.commit()
+    except IntegrityError as erro:
+        db.session.rollback()
+        if _violou_sobreposicao(erro):
+            return 'Horário já ocupado'
+        raise
+    return None
+
+# ===== PARTICIONAMENTO POR DONO (SHARDS) =====
+
+# Modelos cujos registros pertencem a um dono, em ordem de dependência (pais antes dos filhos)
+MODELOS_TENANT = [Barbearia, ExcecaoHorario, Profissional, Servico, SerieAgendamento, Agendamento, ListaEspera,
+                  Webhook, EntregaWebhook, AgendamentoArquivado]
+for modelo in MODELOS_TENANT + [Lembrete, EventoSaida, ContadorIds, VersaoDados]:
+    # A sessão envia estas tabelas para o shard em g.shard (ver roteamento.py)
+    modelo.__table__.info['tenant'] = True
+
+# Parâmetros de rota com IDs de tenant (o dono vem nos bits altos do ID)
+PARAMETROS_TENANT = ('barbearia_id', 'profissional_id', 'agendamento_id', 'espera_id', 'excecao_id', 'webhook_id')
+
+anel_shards = AnelShards(sorted(
+    nome for nome in app.config['SQLALCHEMY_BINDS'] if nome.startswith(PREFIXO_SHARD)
+)) if app.config['SQLALCHEMY_SHARDS'] else None
+
+def _engines_shards():
+    return [engine for nome, engine in sorted(db.engines.items(), key=lambda item: item[0] or '')
+            if nome and nome.startswith(PREFIXO_SHARD)]
+
+def _em_todos_shards(consulta):
+    """
+    Executa a consulta em cada shard e devolve a lista de resultados
+    Sem sharding, executa uma única vez no banco principal
+    """
+    nomes = sorted(nome for nome in db.engines if nome and nome.startswith(PREFIXO_SHARD)) or [None]
+    resultados = []
+    for nome in nomes:
+        with em_shard(nome):
+            resultados.append(consulta())
+    return resultados
+
+def shard_do_dono(dono_id):
+    """
+    Shard onde ficam os dados do dono, conforme o diretório tenant_shards
+    Donos ainda sem posição recebem a do anel, gravada junto com a transação atual
+    """
+    posicao = db.session.get(TenantShard, dono_id) or next(
+        (novo for novo in db.session.new if isinstance(novo, TenantShard) and novo.user_id == dono_id), None)
+    if posicao is not None:
+        return posicao.shard
+    
+    shard = anel_shards.shard_de(dono_id)
+    if db.session.get(User, dono_id) is not None:
+        db.session.add(TenantShard(user_id=dono_id, shard=shard))
+    return shard
+
+def usar_tenant(dono_id):
+    """Aponta as tabelas de tenant para o shard do dono durante a requisição"""
+    if anel_shards is not None:
+        g.shard = shard_do_dono(dono_id)
+
+@app.url_value_preprocessor
+def _tenant_pela_url(endpoint, valores):
+    if anel_shards is None or not valores:
+        return
+    
+    if 'user_id' in valores:
+        usar_tenant(valores['user_id'])
+        return
+    for parametro in PARAMETROS_TENANT:
+        if parametro in valores:
+            usar_tenant(dono_do_id(valores[parametro]))
+            return
+
+@app.before_request
+def _tenant_padrao():
+    """Sem ID na URL, usa o profissional/serviço do corpo JSON ou o usuário logado"""
+    if anel_shards is None or g.get('shard'):
+        return
+    
+    dados = request.get_json(silent=True)
+    if isinstance(dados, dict):
+        registro_id = dados.get('profissional_id') or dados.get('servico_id') or (dados.get('servico_ids') or [None])[0]
+        try:
+            usar_tenant(dono_do_id(registro_id))
+            return
+        except (TypeError, ValueError):
+            pass
+    
+    if current_user.is_authenticated:
+        usar_tenant(current_user.id)
+
+def _dono_do_registro(registro):
+    if isinstance(registro, Barbearia):
+        return registro.user_id or registro.user.id
+    if isinstance(registro, (ExcecaoHorario, Profissional, Servico, Webhook)):
+        return dono_do_id(registro.barbearia_id or registro.barbearia.id)
+    if isinstance(registro, EntregaWebhook):
+        return dono_do_id(registro.webhook_id or registro.webhook.id)
+    return dono_do_id(registro.profissional_id or registro.profissional.id)
+
+def _reservar_ids(sessao, dono_id, tabela, quantidade):
+    """Reserva 'quantidade' números da sequência local do dono (contador no próprio shard)"""
+    contadores = ContadorIds.__table__
+    conexao = sessao.connection(bind_arguments={'mapper': ContadorIds})
+    filtro = (contadores.c.user_id == dono_id) & (contadores.c.tabela == tabela)
+    
+    resultado = conexao.execute(update(contadores).where(filtro).values(ultimo=contadores.c.ultimo + quantidade))
+    if resultado.rowcount == 0:
+        conexao.execute(insert(contadores).values(user_id=dono_id, tabela=tabela, ultimo=quantidade))
+    ultimo = conexao.execute(select(contadores.c.ultimo).where(filtro)).scalar()
+    return range(ultimo - quantidade + 1, ultimo + 1)
+
+@event.listens_for(SessaoRoteada, 'before_flush')
+def _atribuir_ids_tenant(sessao, contexto_flush, instancias):
+    """Com sharding, escolhe o shard pelo dono dos registros novos e gera IDs com o dono embutido"""
+    if anel_shards is None:
+        return
+    
+    novos = [registro for registro in sessao.new
+             if registro.__table__.info.get('tenant') and registro.id is None]
+    for modelo in MODELOS_TENANT:
+        por_dono = {}
+        for registro in novos:
+            if type(registro) is modelo:
+                por_dono.setdefault(_dono_do_registro(registro), []).append(registro)
+        
+        for dono_id, registros in por_dono.items():
+            shard = shard_do_dono(dono_id)
+            if g.get('shard') not in (None, shard):
+                raise ValueError('Uma transação não pode gravar dados de donos em shards diferentes')
+            g.shard = shard
+            for registro, local in zip(registros, _reservar_ids(sessao, dono_id, modelo.__tablename__, len(registros))):
+                registro.id = id_global(dono_id, local)
+
+@event.listens_for(User, 'after_insert')
+def _posicionar_usuario(mapper, connection, target):
+    """Registra no diretório o shard do novo usuário (caso ele venha a ter barbearias)"""
+    if anel_shards is not None:
+        connection.execute(insert(TenantShard.__table__).values(
+            user_id=target.id, shard=anel_shards.shard_de(target.id), fixo=False, updated_at=datetime.utcnow()))
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _espelhar_usuario(mapper, connection, target):
+    """
+    Cada shard guarda uma cópia de users (chave estrangeira de barbearias e agendamentos)
+    A cópia é gravada na mesma sessão, antes dos registros de tenant que dependem dela
+    """
+    if anel_shards is None:
+        return
+    
+    usuarios = User.__table__
+    linha = connection.execute(select(usuarios).where(usuarios.c.id == target.id)).mappings().one()
+    sessao = object_session(target)
+    for engine in _engines_shards():
+        # Atualiza no lugar: apagar e inserir de novo violaria as chaves estrangeiras do shard
+        inserir_ou_atualizar(sessao.connection(bind_arguments={'bind': engine}), usuarios, [dict(linha)])
+
+@event.listens_for(User, 'after_delete')
+def _remover_usuario_espelhado(mapper, connection, target):
+    if anel_shards is None:
+        return
+    
+    sessao = object_session(target)
+    for engine in _engines_shards():
+        sessao.connection(bind_arguments={'bind': engine}).execute(
+            User.__table__.delete().where(User.__table__.c.id == target.id))
+
+@app.cli.command('rebalancear-shards')
+@click.option('--executar', is_flag=True, help='Move os dados; sem esta opção só lista as mudanças')
+@click.option('--usuario', type=int, help='Considera somente este dono')
+@click.option('--destino', help='Shard para onde mover --usuario (o dono fica fixo nele)')
+def rebalancear_shards(executar, usuario, destino):
+    """
+    Move cada dono para o shard indicado pelo anel de hash consistente
+    Com --usuario/--destino isola um dono muito movimentado em outro shard
+    Rode com o dono sem gravações em andamento (ex.: fora do expediente)
+    """
+    if anel_shards is None:
+        raise click.ClickException('Sharding desativado: defina DATABASE_SHARD_URLS')
+    if destino and (not usuario or destino not in db.engines or not destino.startswith(PREFIXO_SHARD)):
+        raise click.ClickException('--destino exige --usuario e o nome de um shard configurado')
+    
+    if executar:
+        # Um shard recém-incluído ainda não tem a cópia dos usuários
+        espelhar_linhas(db.engine, _engines_shards(), User.__table__)
+    
+    tabelas = [modelo.__table__ for modelo in MODELOS_TENANT + [Lembrete, ContadorIds, VersaoDados]]
+    consulta = User.query.filter_by(id=usuario) if usuario else User.query
+    for user in consulta.order_by(User.id).all():
+        posicao = db.session.get(TenantShard, user.id)
+        if posicao is None:
+            # Dono sem posição registrada: os dados dele estão onde o anel aponta hoje
+            posicao = TenantShard(user_id=user.id, shard=anel_shards.shard_de(user.id), fixo=False)
+            db.session.add(posicao)
+        
+        if destino:
+            alvo = destino
+        elif posicao.fixo:
+            continue
+        else:
+            alvo = anel_shards.shard_de(user.id)
+        if alvo == posicao.shard:
+            continue
+        
+        click.echo(f'Usuário {user.id} ({user.nome}): {posicao.shard} -> {alvo}')
+        if executar:
+            origem = posicao.shard
+            copiar_tenant(db.engines[origem], db.engines[alvo], tabelas, user.id)
+            posicao.shard = alvo
+            posicao.fixo = bool(destino)
+            db.session.commit()
+            remover_tenant(db.engines[origem], tabelas, user.id)
+    
+    if executar:
+        db.session.commit()
+    else:
+        db.session.rollback()
+        click.echo('Nada foi movido (use --executar para aplicar)')
+
+# ===== ARQUIVAMENTO DO HISTÓRICO =====
+
+@app.cli.command('arquivar-agendamentos')
+@click.option('--dias', type=int, help='Idade mínima em dias (padrão: ARQUIVAR_APOS_DIAS)')
+@click.option('--lote', type=int, help='Linhas por transação (padrão: ARQUIVO_LOTE)')
+@click.option('--pausa', type=float, default=0.0, help='Segundos de espera entre lotes')
+def arquivar_agendamentos(dias, lote, pausa):
+    """
+    Move agendamentos realizados/cancelados antigos para agendamentos_arquivo
+    Pensado para rodar periodicamente (cron) com o sistema no ar
+    """
+    dias = dias or app.config['ARQUIVAR_APOS_DIAS']
+    limite = datetime.combine(date.today() - timedelta(days=dias), datetime.min.time())
+    agendamentos = Agendamento.__table__
+    filtro = agendamentos.c.status.in_(('realizado', 'cancelado')) & (agendamentos.c.data_hora_fim < limite)
+    
+    for engine in _engines_shards() or [db.engine]:
+        total = arquivar_em_lotes(engine, agendamentos, AgendamentoArquivado.__table__, filtro,
+                                  lote=lote or app.config['ARQUIVO_LOTE'], pausa=pausa,
+                                  valores_extras={'arquivado_em': datetime.utcnow()})
+        click.echo(f'{engine.url.database}: {total} agendamentos arquivados')
+
+# ===== TAREFAS EM SEGUNDO PLANO =====
+
+fila_tarefas = FilaTarefas(Tarefa.__table__,
+                           backoff_base=app.config['TAREFAS_BACKOFF_SEGUNDOS'],
+                           backoff_maximo=app.config['TAREFAS_BACKOFF_MAXIMO'],
+                           tempo_limite=app.config['TAREFAS_TEMPO_LIMITE'])
+
+def enfileirar(tipo, atraso=0, **argumentos):
+    """
+    Adiciona uma tarefa à sessão atual; ela só é gravada no commit de quem chamou,
+    junto com as alterações que a originaram
+    """
+    tarefa = Tarefa(**fila_tarefas.valores(tipo, argumentos, atraso))
+    db.session.add(tarefa)
+    return tarefa
+
+@app.cli.command('worker')
+@click.option('--threads', type=int, default=lambda: int(os.getenv('WORKER_THREADS', 2)), help='Tarefas executadas ao mesmo tempo')
+@click.option('--uma-vez', is_flag=True, help='Executa as tarefas prontas e sai (para uso com cron)')
+def worker(threads, uma_vez):
+    """Processa a fila de tarefas; rode quantos processos forem necessários"""
+    trabalhador = Trabalhador(fila_tarefas, db.engine, app.app_context,
+                              threads=threads, intervalo=app.config['TAREFAS_INTERVALO'],
+                              intervalo_recuperacao=app.config['TAREFAS_INTERVALO_RECUPERACAO'])
+    if uma_vez:
+        click.echo(f'{trabalhador.processar_pendentes()} tarefas executadas')
+        return
+    
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: parar.set())
+    click.echo(f'Worker {trabalhador.nome} com {threads} threads (tipos: {", ".join(sorted(fila_tarefas.tipos))})')
+    try:
+        trabalhador.executar(parar)
+    except KeyboardInterrupt:
+        parar.set()
+
+# ===== LEMBRETES DE AGENDAMENTO =====
+
+@event.listens_for(Agendamento, 'after_insert')
+def _programar_lembretes(mapper, connection, target):
+    """Cria os lembretes do agendamento"""
+    lembretes = Lembrete.__table__
+    agora = datetime.now()
+    linhas = [
+        {'agendamento_id': target.id, 'antecedencia': minutos,
+         'enviar_em': target.data_hora - timedelta(minutes=minutos)}
+        for minutos in app.config['LEMBRETES_ANTECEDENCIAS']
+        if target.data_hora - timedelta(minutes=minutos) > agora
+    ]
+    if linhas:
+        connection.execute(insert(lembretes), linhas)
+
+@event.listens_for(Agendamento, 'after_update')
+def _reprogramar_lembretes(mapper, connection, target):
+    """Refaz os lembretes se o horário mudar"""
+    if inspecionar(target).attrs.data_hora.history.has_changes():
+        lembretes = Lembrete.__table__
+        connection.execute(delete(lembretes).where(lembretes.c.agendamento_id == target.id))
+        _programar_lembretes(mapper, connection, target)
+
+def _bancos_tenant():
+    """(nome da bind, engine) de cada banco com dados de tenant"""
+    return [(nome, engine) for nome, engine in sorted(db.engines.items(), key=lambda item: item[0] or '')
+            if nome and nome.startswith(PREFIXO_SHARD)] or [(None, db.engine)]
+
+def _carregar_lembretes(ate):
+    """
+    Lembretes pendentes com envio antes de 'ate', de todos os shards
+    Lembretes de agendamentos cancelados ou já passados são descartados antes
+    """
+    lembretes = Lembrete.__table__
+    pendentes = (lembretes.c.enviado_em.is_(None), lembretes.c.enviar_em < ate)
+    agora = datetime.now()
+    consulta = select(
+        Lembrete.agendamento_id, Lembrete.antecedencia, Lembrete.enviar_em, Agendamento.data_hora,
+        User.email, User.nome, Servico.nome.label('servico'), Barbearia.nome.label('barbearia')
+    ).join_from(Lembrete, Agendamento, Agendamento.id == Lembrete.agendamento_id
+    ).join(User, User.id == Agendamento.cliente_id
+    ).join(Servico, Servico.id == Agendamento.servico_id
+    ).join(Profissional, Profissional.id == Agendamento.profissional_id
+    ).join(Barbearia, Barbearia.id == Profissional.barbearia_id
+    ).where(*pendentes)
+    
+    itens = []
+    for nome, engine in _bancos_tenant():
+        with engine.begin() as conexao:
+            conexao.execute(update(lembretes).where(*pendentes, ~exists().where(
+                Agendamento.id == lembretes.c.agendamento_id,
+                Agendamento.status == 'confirmado',
+                Agendamento.data_hora > agora
+            )).values(enviado_em=agora))
+            for linha in conexao.execute(consulta):
+                itens.append((linha.enviar_em, Mensagem(
+                    chave=(nome, linha.agendamento_id, linha.antecedencia),
+                    destinatario=linha.email,
+                    assunto=f'Lembrete: {linha.servico} em {linha.data_hora:%d/%m às %H:%M}',
+                    corpo=(f'Olá, {linha.nome}! Você tem {linha.servico} agendado na {linha.barbearia} '
+                           f'em {linha.data_hora:%d/%m/%Y} às {linha.data_hora:%H:%M}.')
+                )))
+    return itens
+
+def _marcar_lembretes_enviados(chaves):
+    """Marca os lembretes enviados com um UPDATE por banco"""
+    por_banco = {}
+    for nome, agendamento_id, antecedencia in chaves:
+        por_banco.setdefault(nome, []).append((agendamento_id, antecedencia))
+    
+    lembretes = Lembrete.__table__
+    for nome, pares in por_banco.items():
+        with db.engines[nome].begin() as conexao:
+            conexao.execute(update(lembretes).where(
+                tuple_(lembretes.c.agendamento_id, lembretes.c.antecedencia).in_(pares)
+            ).values(enviado_em=datetime.now()))
+
+def _enviador_lembretes():
+    if app.config['LEMBRETES_ENVIADOR'] == 'smtp':
+        return EnviadorSMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], app.config['MAIL_REMETENTE'],
+                            app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'], app.config['MAIL_USE_TLS'])
+    os.makedirs(app.instance_path, exist_ok=True)
+    return EnviadorArquivo(os.path.join(app.instance_path, app.config['LEMBRETES_ARQUIVO']))
+
+@app.cli.command('lembretes')
+@click.option('--uma-vez', is_flag=True, help='Envia os lembretes vencidos e sai (para uso com cron)')
+def enviar_lembretes(uma_vez):
+    """Envia os lembretes de agendamento em lotes conforme vencem"""
+    agendador = AgendadorLembretes(_carregar_lembretes, _marcar_lembretes_enviados, _enviador_lembretes(),
+                                   janela=timedelta(seconds=app.config['LEMBRETES_JANELA_SEGUNDOS']),
+                                   lote=app.config['LEMBRETES_LOTE'])
+    if uma_vez:
+        agendador.ciclo()
+        return
+    
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: parar.set())
+    try:
+        agendador.executar(parar)
+    except KeyboardInterrupt:
+        parar.set()
+
+# ===== OUTBOX DE EVENTOS =====
+
+@contextmanager
+def _contexto_evento(nome):
+    """Assinantes rodam no shard onde o evento foi gravado, com uma sessão nova a cada evento"""
+    with em_shard(nome):
+        try:
+            yield
+        finally:
+            db.session.remove()
+
+retransmissor = Retransmissor(EventoSaida.__table__, _bancos_tenant,
+                              contexto=_contexto_evento,
+                              lote=app.config['OUTBOX_LOTE'],
+                              max_tentativas=app.config['OUTBOX_MAX_TENTATIVAS'])
+
+@event.listens_for(Agendamento, 'after_insert')
+def _evento_agendamento_criado(mapper, connection, target):
+    gravar_evento(connection, EventoSaida.__table__, 'agendamento-criado', target.id,
+                  profissional_id=target.profissional_id, servico_id=target.servico_id,
+                  cliente_id=target.cliente_id, data_hora=target.data_hora, data_hora_fim=target.data_hora_fim)
+
+@event.listens_for(Agendamento, 'after_update')
+def _evento_agendamento_cancelado(mapper, connection, target):
+    if target.status == 'cancelado' and inspecionar(target).attrs.status.history.has_changes():
+        gravar_evento(connection, EventoSaida.__table__, 'agendamento-cancelado', target.id,
+                      profissional_id=target.profissional_id, cliente_id=target.cliente_id,
+                      data_hora=target.data_hora)
+
+@retransmissor.assinar('agendamento-cancelado')
+def _publicar_cancelamento(evento):
+    """Avisa os assinantes do sinal e oferece a vaga liberada para a lista de espera"""
+    agendamento = db.session.get(Agendamento, evento.agregado_id)
+    if agendamento is not None:
+        agendamento_cancelado.send(app, agendamento=agendamento)
+    _oferecer_vaga(evento.dados['profissional_id'], datetime.fromisoformat(evento.dados['data_hora']),
+                   origem_id=evento.agregado_id)
+
+@event.listens_for(ListaEspera, 'after_insert')
+@event.listens_for(ListaEspera, 'after_update')
+@event.listens_for(ListaEspera, 'after_delete')
+def _evento_lista_espera(mapper, connection, target):
+    """As filas em memória do retransmissor acompanham a lista de espera por estes eventos"""
+    estado = inspecionar(target)
+    if estado.persistent and not estado.deleted and not any(
+            estado.attrs[campo].history.has_changes() for campo in ('status', 'janela_inicio', 'janela_fim', 'servico_id')):
+        return
+    
+    duracao = connection.execute(select(Servico.duracao).where(Servico.id == target.servico_id)).scalar()
+    gravar_evento(connection, EventoSaida.__table__, 'lista-espera-alterada', target.id,
+                  profissional_id=target.profissional_id, data=target.data, duracao=duracao,
+                  status='removido' if estado.deleted else target.status,
+                  janela_inicio=target.janela_inicio, janela_fim=target.janela_fim,
+                  oferta_inicio=target.oferta_inicio, oferta_origem_id=target.oferta_origem_id)
+
+@retransmissor.assinar('lista-espera-alterada')
+def _atualizar_fila_espera(evento):
+    """Atualiza a fila do profissional/dia; uma oferta que expirou volta a ser oferecida"""
+    dados = evento.dados
+    dia = date.fromisoformat(dados['data'])
+    pedido = None
+    if dados['status'] == 'aguardando':
+        pedido = PedidoEspera(evento.agregado_id, dados['duracao'],
+                              datetime.combine(dia, time.fromisoformat(dados['janela_inicio'])),
+                              datetime.combine(dia, time.fromisoformat(dados['janela_fim'])))
+    filas_espera.aplicar(evento.id, dados['profissional_id'], dia, evento.agregado_id, pedido)
+    
+    if dados['status'] == 'expirado' and dados['oferta_inicio']:
+        _oferecer_vaga(dados['profissional_id'], datetime.fromisoformat(dados['oferta_inicio']),
+                       origem_id=dados['oferta_origem_id'])
+
+@retransmissor.periodica(app.config['LISTA_ESPERA_INTERVALO_EXPIRACAO'])
+def _expirar_ofertas():
+    """
+    Marca como expiradas as ofertas da lista de espera que passaram do prazo sem resposta
+    O evento de cada uma passa por _atualizar_fila_espera, que oferece a vaga ao próximo
+    """
+    agora = datetime.now()
+    for nome, _ in _bancos_tenant():
+        with _contexto_evento(nome):
+            for espera in ListaEspera.query.filter(ListaEspera.status == 'oferecido',
+                                                   ListaEspera.oferta_expira_em < agora).all():
+                espera.status = 'expirado'
+            db.session.commit()
+
+@retransmissor.assinar('agendamentos-encerrados')
+def _publicar_encerramento(evento):
+    dados = dict(evento.dados, dia=date.fromisoformat(evento.dados['dia']))
+    agendamentos_encerrados.send(app, **dados)
+
+@app.cli.command('outbox')
+@click.option('--uma-vez', is_flag=True, help='Publica os eventos pendentes e sai')
+def publicar_eventos(uma_vez):
+    """Retransmissor da outbox: publica os eventos de agendamento em lotes"""
+    if uma_vez:
+        retransmissor.rodar_periodicas(todas=True)
+        total = 0
+        while True:
+            publicados = retransmissor.drenar()
+            total += publicados
+            if not publicados:
+                break
+        click.echo(f'{total} eventos publicados')
+        return
+    
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: parar.set())
+    try:
+        retransmissor.executar(parar, app.config['OUTBOX_INTERVALO'])
+    except KeyboardInterrupt:
+        parar.set()
+
+# ===== WEBHOOKS DAS BARBEARIAS =====
+
+def _enfileirar_webhooks(evento):
+    """
+    Cria uma entrega por webhook ativo da barbearia que assina o tipo do evento
+    Pode rodar de novo para o mesmo evento (outbox): entregas já criadas são ignoradas
+    """
+    barbearia_id = evento.dados.get('barbearia_id')
+    if barbearia_id is None:
+        profissional = db.session.get(Profissional, evento.dados['profissional_id'])
+        if profissional is None:
+            return
+        barbearia_id = profissional.barbearia_id
+    
+    webhooks = [webhook for webhook in Webhook.query.filter_by(barbearia_id=barbearia_id, ativo=True)
+                if webhook.assina(evento.tipo)]
+    if not webhooks:
+        return
+    
+    criadas = set(db.session.execute(
+        select(EntregaWebhook.webhook_id).where(EntregaWebhook.evento_id == evento.id)
+    ).scalars())
+    dados = json.dumps(dict(evento.dados, agendamento_id=evento.agregado_id, barbearia_id=barbearia_id), default=str)
+    for webhook in webhooks:
+        if webhook.id not in criadas:
+            db.session.add(EntregaWebhook(webhook_id=webhook.id, evento_id=evento.id, tipo=evento.tipo, dados=dados))
+    db.session.commit()
+
+for tipo in TIPOS_EVENTO_WEBHOOK:
+    retransmissor.assinar(tipo)(_enfileirar_webhooks)
+
+def _carregar_entregas():
+    """Entregas prontas para envio de todos os bancos, com a URL e o segredo do webhook"""
+    consulta = select(
+        EntregaWebhook.id, EntregaWebhook.webhook_id, Webhook.url, Webhook.segredo, EntregaWebhook.evento_id,
+        EntregaWebhook.tipo, EntregaWebhook.dados, EntregaWebhook.tentativas
+    ).join(Webhook, Webhook.id == EntregaWebhook.webhook_id).where(
+        EntregaWebhook.status == 'pendente',
+        EntregaWebhook.proxima_tentativa_em <= datetime.utcnow(),
+        Webhook.ativo.is_(True)
+    ).order_by(EntregaWebhook.id).limit(app.config['WEBHOOKS_CARGA'])
+    
+    entregas = []
+    for nome, engine in _bancos_tenant():
+        with engine.connect() as conexao:
+            entregas += [
+                Entrega(linha.id, nome, linha.webhook_id, linha.url, linha.segredo, linha.evento_id,
+                        linha.tipo, json.loads(linha.dados), linha.tentativas)
+                for linha in conexao.execute(consulta)
+            ]
+    return entregas
+
+def _registrar_entregas(resultados):
+    """Grava os resultados: um UPDATE por banco para as entregues e um por falha"""
+    por_banco = {}
+    for entrega, erro in resultados:
+        por_banco.setdefault(entrega.banco, []).append((entrega, erro))
+    
+    entregas = EntregaWebhook.__table__
+    agora = datetime.utcnow()
+    for nome, itens in por_banco.items():
+        with db.engines[nome].begin() as conexao:
+            entregues = [entrega.id for entrega, erro in itens if erro is None]
+            if entregues:
+                conexao.execute(update(entregas).where(entregas.c.id.in_(entregues)).values(
+                    status='entregue', entregue_em=agora, erro=None, tentativas=entregas.c.tentativas + 1))
+            
+            for entrega, erro in itens:
+                if erro is None:
+                    continue
+                valores = {'tentativas': entrega.tentativas + 1, 'erro': erro[:500]}
+                if valores['tentativas'] >= app.config['WEBHOOKS_MAX_TENTATIVAS']:
+                    valores['status'] = 'falhou'
+                else:
+                    valores['proxima_tentativa_em'] = agora + timedelta(seconds=espera_webhook(
+                        valores['tentativas'], app.config['WEBHOOKS_BACKOFF_SEGUNDOS'], app.config['WEBHOOKS_BACKOFF_MAXIMO']))
+                conexao.execute(update(entregas).where(entregas.c.id == entrega.id).values(**valores))
+
+@app.cli.command('webhooks')
+@click.option('--uma-vez', is_flag=True, help='Tenta as entregas prontas e sai')
+def entregar_webhooks(uma_vez):
+    """Entrega os eventos aos webhooks das barbearias, em lotes por endpoint"""
+    entregador = EntregadorWebhooks(_carregar_entregas, _registrar_entregas,
+                                    limite_por_endpoint=app.config['WEBHOOKS_LIMITE_POR_ENDPOINT'],
+                                    lote_por_endpoint=app.config['WEBHOOKS_LOTE_POR_ENDPOINT'],
+                                    tempo_limite=app.config['WEBHOOKS_TEMPO_LIMITE'])
+    if uma_vez:
+        total = 0
+        try:
+            while True:
+                tentadas = entregador.processar()
+                total += tentadas
+                if not tentadas:
+                    break
+        finally:
+            entregador.fechar()
+        click.echo(f'{total} entregas tentadas')
+        return
+    
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: parar.set())
+    try:
+        entregador.executar(parar, app.config['WEBHOOKS_INTERVALO'])
+    except KeyboardInterrupt:
+        parar.set()
+
+# ===== AGENDA AO VIVO =====
+
+TIPOS_EVENTO_AGENDA = ('agendamento-criado', 'agendamento-cancelado', 'agendamentos-encerrados')
+
+def _dados_evento_agenda(tipo, agregado_id, dados):
+    """Somente o necessário para redesenhar a agenda (sem dados do cliente)"""
+    if tipo == 'agendamentos-encerrados':
+        return {'tipo': tipo, 'barbearia_id': dados['barbearia_id'], 'dia': dados['dia'],
+                'realizados': dados['realizados'], 'faltas': dados['faltas']}
+    return {'tipo': tipo, 'agendamento_id': agregado_id, 'profissional_id': dados['profissional_id'],
+            'data_hora': dados['data_hora'], 'data_hora_fim': dados.get('data_hora_fim')}
+
+def _ler_eventos_agenda(ultimos):
+    """
+    Eventos de agenda gravados na outbox de cada banco depois da última leitura
+    Começa do fim da tabela: quem conecta vê só o que acontecer daí em diante
+    Lê todos os tipos depois da posição para que um id pulado seja mesmo uma lacuna
+    (transação ainda aberta) e não um evento de outro tipo
+    """
+    eventos = EventoSaida.__table__
+    colunas = (eventos.c.id, eventos.c.tipo, eventos.c.agregado_id, eventos.c.dados)
+    novos = []
+    with app.app_context():
+        for nome, engine in _bancos_tenant():
+            with engine.connect() as conexao:
+                if nome not in ultimos:
+                    ultimos[nome] = PosicaoOutbox(conexao.execute(select(func.max(eventos.c.id))).scalar() or 0,
+                                                  espera=app.config['AGENDA_AO_VIVO_ESPERA_LACUNAS'],
+                                                  max_lacunas=app.config['OUTBOX_LOTE'])
+                    continue
+                posicao = ultimos[nome]
+                
+                lacunas = posicao.lacunas()
+                atrasadas = conexao.execute(select(*colunas).where(eventos.c.id.in_(lacunas))
+                                            .order_by(eventos.c.id)).all() if lacunas else []
+                posicao.preencher(linha.id for linha in atrasadas)
+                recentes = conexao.execute(select(*colunas).where(eventos.c.id > posicao.ultimo)
+                                           .order_by(eventos.c.id).limit(app.config['OUTBOX_LOTE'])).all()
+                posicao.avancar(linha.id for linha in recentes)
+                
+                linhas = [linha for linha in atrasadas + recentes if linha.tipo in TIPOS_EVENTO_AGENDA]
+                if not linhas:
+                    continue
+                
+                dados = [(linha, json.loads(linha.dados)) for linha in linhas]
+                ids_profissionais = {valores['profissional_id'] for linha, valores in dados if 'profissional_id' in valores}
+                barbearias = dict(conexao.execute(select(Profissional.id, Profissional.barbearia_id).where(
+                    Profissional.id.in_(ids_profissionais))).all()) if ids_profissionais else {}
+                
+                for linha, valores in dados:
+                    if 'profissional_id' in valores:
+                        topicos = (f'profissional:{valores["profissional_id"]}',
+                                   f'barbearia:{barbearias.get(valores["profissional_id"])}')
+                    else:
+                        topicos = (f'barbearia:{valores["barbearia_id"]}',)
+                    novos.append(EventoAgenda(linha.id, linha.tipo, topicos,
+                                              _dados_evento_agenda(linha.tipo, linha.agregado_id, valores)))
+    return novos
+
+canal_agenda = CanalAoVivo(historico=app.config['AGENDA_AO_VIVO_HISTORICO'])
+seguidor_agenda = SeguidorOutbox(canal_agenda, _ler_eventos_agenda, app.config['AGENDA_AO_VIVO_INTERVALO'])
+
+def _transmitir_agenda(topico):
+    """Resposta text/event-stream com os eventos do tópico"""
+    seguidor_agenda.iniciar()
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    # O stream pode ficar aberto por minutos: devolve a conexão do banco ao pool antes
+    db.session.remove()
+    return Response(transmitir(canal_agenda, topico, ultimo_id,
+                               batimento=app.config['AGENDA_AO_VIVO_BATIMENTO'],
+                               duracao=app.config['AGENDA_AO_VIVO_DURACAO']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ===== EXCLUSÃO DE CONTAS =====
+
+@fila_tarefas.tarefa('excluir-usuario', limite=2)
+def _excluir_dados_usuario(user_id):
+    """
+    Cascata da exclusão de uma conta, em lotes e dos filhos para os pais
+    Pode ser repetida: se o processo cair no meio, continua de onde parou
+    """
+    lote = app.config['EXCLUSAO_LOTE']
+    engines = _engines_shards() or [db.engine]
+    engine_dono = db.engines[shard_do_dono(user_id)] if anel_shards is not None else db.engine
+    db.session.rollback()
+    
+    barbearias = select(Barbearia.id).where(Barbearia.user_id == user_id)
+    profissionais = select(Profissional.id).where(Profissional.barbearia_id.in_(barbearias))
+    servicos = select(Servico.id).where(Servico.barbearia_id.in_(barbearias))
+    with engine_dono.connect() as conexao:
+        ids_barbearias = conexao.execute(barbearias).scalars().all()
+    
+    etapas = []
+    for engine in engines:
+        # Agendamentos e pedidos feitos como cliente podem estar em qualquer shard
+        for modelo in (ListaEspera, Agendamento, SerieAgendamento, AgendamentoArquivado):
+            etapas.append((engine, modelo, modelo.cliente_id == user_id))
+    for modelo in (ListaEspera, Agendamento, SerieAgendamento, AgendamentoArquivado):
+        etapas.append((engine_dono, modelo,
+                       modelo.profissional_id.in_(profissionais) | modelo.servico_id.in_(servicos)))
+    webhooks = select(Webhook.id).where(Webhook.barbearia_id.in_(barbearias))
+    etapas += [
+        (engine_dono, EntregaWebhook, EntregaWebhook.webhook_id.in_(webhooks)),
+        (engine_dono, Webhook, Webhook.barbearia_id.in_(barbearias)),
+        (engine_dono, ExcecaoHorario, ExcecaoHorario.barbearia_id.in_(barbearias)),
+        (engine_dono, Servico, Servico.barbearia_id.in_(barbearias)),
+        (engine_dono, Profissional, Profissional.barbearia_id.in_(barbearias)),
+        (engine_dono, Barbearia, Barbearia.user_id == user_id),
+    ]
+    
+    for engine, modelo, filtro in etapas:
+        apagar_em_lotes(engine, modelo.__table__, filtro, lote)
+    for barbearia_id in ids_barbearias:
+        horarios_cache.invalidar(barbearia_id)
+    
+    with engine_dono.begin() as conexao:
+        conexao.execute(delete(ContadorIds.__table__).where(ContadorIds.user_id == user_id))
+        conexao.execute(delete(VersaoDados.__table__).where(VersaoDados.user_id == user_id))
+    with db.engine.begin() as conexao:
+        conexao.execute(delete(TenantShard.__table__).where(TenantShard.user_id == user_id))
+        conexao.execute(delete(User.__table__).where(User.id == user_id))
+    for engine in _engines_shards():
+        with engine.begin() as conexao:
+            conexao.execute(delete(User.__table__).where(User.id == user_id))
+    app.logger.info('Dados do usuário %s excluídos', user_id)
+
+@app.cli.command('concluir-exclusoes')
+def concluir_exclusoes():
+    """Conclui exclusões de contas interrompidas (ex.: servidor reiniciado durante a cascata)"""
+    for user_id in [user.id for user in User.query.filter(User.excluido_em.isnot(None))]:
+        _excluir_dados_usuario(user_id)
+        click.echo(f'Usuário {user_id} excluído')
+
+# ===== CALENDÁRIO DE FUNCIONAMENTO =====
+
+def _carregar_horario(barbearia_id):
+    """Lê a barbearia e suas exceções futuras e monta a agenda semanal"""
+    barbearia = db.session.get(Barbearia, barbearia_id)
+    if barbearia is None:
+        return None
+    
+    excecoes = ExcecaoHorario.query.filter(
+        ExcecaoHorario.barbearia_id == barbearia_id,
+        ExcecaoHorario.data >= date.today() - timedelta(days=1)
+    ).all()
+    return HorarioSemanal.da_barbearia(barbearia, excecoes)
+
+horarios_cache = CacheHorarios(_carregar_horario, ttl=app.config['CACHE_HORARIOS_TTL'])
+
+@event.listens_for(Barbearia, 'after_update')
+@event.listens_for(Barbearia, 'after_delete')
+def _invalidar_horario_barbearia(mapper, connection, target):
+    horarios_cache.invalidar(target.id)
+
+@event.listens_for(ExcecaoHorario, 'after_insert')
+@event.listens_for(ExcecaoHorario, 'after_update')
+@event.listens_for(ExcecaoHorario, 'after_delete')
+def _invalidar_horario_excecao(mapper, connection, target):
+    horarios_cache.invalidar(target.barbearia_id)
+
+# ===== VERSÃO DOS DADOS DE CADA DONO =====
+
+# Escopo da versão incrementada pelas escritas em cada modelo: 'cadastro' muda com
+# barbearias, profissionais e serviços; 'agenda' com agendamentos e exceções de horário
+ESCOPOS_VERSAO = {Barbearia: 'cadastro', Profissional: 'cadastro', Servico: 'cadastro',
+                  ExcecaoHorario: 'agenda', Agendamento: 'agenda'}
+
+def versoes_dados(dono, *escopos):
+    """
+    Versões dos dados do dono nos escopos, em uma única consulta (0 onde nunca houve escrita)
+    dono é o ID do usuário ou uma subconsulta escalar que o encontra
+    """
+    linhas = dict(db.session.execute(select(VersaoDados.escopo, VersaoDados.versao).where(
+        VersaoDados.user_id == dono, VersaoDados.escopo.in_(escopos))).all())
+    return tuple(linhas.get(escopo, 0) for escopo in escopos)
+
+def versao_dados(dono_id, escopo='cadastro'):
+    """Versão atual dos dados do dono; entra na chave dos caches"""
+    return versoes_dados(dono_id, escopo)[0]
+
+def dono_da_barbearia(barbearia_id):
+    return select(Barbearia.user_id).where(Barbearia.id == barbearia_id).scalar_subquery()
+
+def dono_do_profissional(profissional_id):
+    return select(Barbearia.user_id).join(Profissional).where(Profissional.id == profissional_id).scalar_subquery()
+
+def _incrementar_versao(conexao, dono_id, escopo):
+    versoes = VersaoDados.__table__
+    filtro = (versoes.c.user_id == dono_id) & (versoes.c.escopo == escopo)
+    resultado = conexao.execute(update(versoes).where(filtro).values(versao=versoes.c.versao + 1))
+    if resultado.rowcount == 0:
+        conexao.execute(insert(versoes).values(user_id=dono_id, escopo=escopo, versao=1))
+
+@event.listens_for(SessaoRoteada, 'after_flush')
+def _versionar_escritas(sessao, contexto_flush):
+    """Incrementa, na mesma transação, a versão de cada dono que teve dados alterados"""
+    alterados = [registro for registro in [*sessao.new, *sessao.deleted, *sessao.dirty]
+                 if type(registro) in ESCOPOS_VERSAO and (registro not in sessao.dirty or sessao.is_modified(registro))]
+    if not alterados:
+        return
+    
+    conexao = sessao.connection(bind_arguments={'mapper': VersaoDados})
+    donos = {}
+    escopos_por_dono = {}
+    for registro in alterados:
+        if isinstance(registro, Barbearia):
+            dono_id = registro.user_id
+        elif anel_shards is not None:
+            dono_id = _dono_do_registro(registro)
+        else:
+            # Sem sharding o ID não carrega o dono: vem da barbearia (que pode ter sido apagada junto)
+            if isinstance(registro, Agendamento):
+                chave, consulta = ('profissional', registro.profissional_id), dono_do_profissional(registro.profissional_id)
+            else:
+                chave, consulta = ('barbearia', registro.barbearia_id), dono_da_barbearia(registro.barbearia_id)
+            if chave not in donos:
+                donos[chave] = conexao.execute(select(consulta)).scalar()
+            dono_id = donos[chave]
+        if dono_id is not None:
+            escopos_por_dono.setdefault(dono_id, set()).add(ESCOPOS_VERSAO[type(registro)])
+    
+    for dono_id, escopos in sorted(escopos_por_dono.items()):
+        for escopo in sorted(escopos):
+            _incrementar_versao(conexao, dono_id, escopo)
+
+def condicional(versoes, por_usuario=False):
+    """
+    GET condicional com ETag forte calculada das versões dos dados, e não do corpo
+    versoes(**argumentos_da_rota) devolve uma tupla que muda sempre que a resposta
+    mudaria (fica em g.versoes_dados para a visão). Se o navegador já tem essa
+    versão, responde 304 sem executar a visão (nem suas consultas e templates).
+    A versão dos templates e dos arquivos estáticos também entra na ETag
+    """
+    def decorador(visao):
+        @wraps(visao)
+        def condicional_visao(*args, **kwargs):
+            g.versoes_dados = versoes(**kwargs)
+            if session.get('_flashes'):
+                # Mensagens pendentes só aparecem em uma página renderizada
+                return visao(*args, **kwargs)
+            
+            # Páginas logadas também mostram o nome do usuário (base.html)
+            usuario = (current_user.id, current_user.nome) if por_usuario else None
+            # Um deploy muda o HTML (templates) e os nomes com hash dos estáticos: a ETag antiga não vale mais
+            deploy = (_resumir_templates() if app.jinja_env.auto_reload else versao_templates, ativos.versao)
+            etag = hashlib.sha1(repr((request.full_path, usuario, deploy, g.versoes_dados)).encode()).hexdigest()
+            # Comparação fraca: a resposta comprimida volta com W/"..."
+            if request.if_none_match.contains_weak(etag):
+                resposta = app.response_class(status=304)
+            else:
+                resposta = make_response(visao(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+            resposta.set_etag(etag)
+            resposta.headers['Cache-Control'] = 'private, no-cache' if por_usuario else 'no-cache'
+            if por_usuario:
+                resposta.vary.add('Cookie')
+            return resposta
+        return condicional_visao
+    return decorador
+
+# ===== FUNÇÕES AUXILIARES DE AGENDAMENTO =====
+
+def _ler_data_hora(valor):
+    """Converte a data/hora ISO enviada pelo front-end (sem fuso horário)"""
+    try:
+        return datetime.fromisoformat(valor).replace(tzinfo=None, second=0, microsecond=0)
+    except (TypeError, ValueError):
+        return None
+
+def _indices_ocupacao(profissional_ids, primeiro_dia, ultimo_dia, ignorar_id=None):
+    """
+    Carrega em uma única consulta os agendamentos ativos dos profissionais
+    entre primeiro_dia e ultimo_dia (inclusive) e monta um índice por profissional
+    """
+    inicio = datetime.combine(primeiro_dia, datetime.min.time())
+    fim = datetime.combine(ultimo_dia, datetime.min.time()) + timedelta(days=1)
+    consulta = db.session.query(
+        Agendamento.id, Agendamento.profissional_id, Agendamento.data_hora, Agendamento.data_hora_fim
+    ).filter(
+        Agendamento.profissional_id.in_(profissional_ids),
+        Agendamento.status != 'cancelado',
+        Agendamento.data_hora < fim,
+        Agendamento.data_hora_fim > inicio
+    )
+    
+    intervalos = {profissional_id: [] for profissional_id in profissional_ids}
+    for agendamento_id, profissional_id, data_hora, data_hora_fim in consulta:
+        if agendamento_id != ignorar_id:
+            intervalos[profissional_id].append((data_hora, data_hora_fim))
+    return {profissional_id: IndiceIntervalos(itens) for profissional_id, itens in intervalos.items()}
+
+def _indice_ocupacao(profissional_id, primeiro_dia, ultimo_dia, ignorar_id=None):
+    """Índice de intervalos ocupados de um único profissional"""
+    return _indices_ocupacao([profissional_id], primeiro_dia, ultimo_dia, ignorar_id)[profissional_id]
+
+def _motivo_indisponivel(servico, inicio, horario, indice):
+    """Confere um horário contra o calendário e o índice já carregados"""
+    if inicio < datetime.now():
+        return 'Não é possível agendar no passado'
+    if horario is None or not horario.comporta(inicio, servico.duracao):
+        return 'Horário fora do funcionamento da barbearia'
+    if indice.conflita(inicio, inicio + timedelta(minutes=servico.duracao)):
+        return 'Horário já ocupado'
+    return None
+
+def _validar_profissional_servico(profissional, servico):
+    """Verifica se o profissional atende e se o serviço é da mesma barbearia"""
+    if not profissional.ativo:
+        return 'Profissional indisponível'
+    if servico.barbearia_id != profissional.barbearia_id or not servico.ativo:
+        return 'Serviço não oferecido por este profissional'
+    return None
+
+def _validar_agendamento(profissional, servico, inicio, ignorar_id=None):
+    """
+    Valida um horário para o profissional/serviço
+    Retorna None se estiver disponível ou a mensagem explicando o motivo
+    """
+    erro = _validar_profissional_servico(profissional, servico)
+    if erro:
+        return erro
+    
+    if inicio < datetime.now():
+        return 'Não é possível agendar no passado'
+    
+    horario = horarios_cache.obter(profissional.barbearia_id)
+    if horario is None or not horario.comporta(inicio, servico.duracao):
+        return 'Horário fora do funcionamento da barbearia'
+    
+    fim = inicio + timedelta(minutes=servico.duracao)
+    if Agendamento.existe_conflito(profissional.id, inicio, fim, ignorar_id):
+        return 'Horário já ocupado'
+    return None
+
+def _horarios_livres(profissional, servico, dia, ordenar_por_encaixe_agenda=False, versao_horario=None):
+    """
+    Lista os inícios livres do dia para o serviço, no passo configurado
+    Com ordenar_por_encaixe_agenda=True devolve [(inicio, desperdicio), ...]
+    ordenados pelos horários que menos fragmentam a agenda
+    """
+    horario = horarios_cache.obter(profissional.barbearia_id, versao=versao_horario)
+    janela = horario.expediente(dia) if horario else None
+    if janela is None:
+        return []
+    
+    passo = timedelta(minutes=app.config['INTERVALO_AGENDA_MINUTOS'])
+    duracao = timedelta(minutes=servico.duracao)
+    indice = _indice_ocupacao(profissional.id, dia, dia)
+    agora = datetime.now()
+    
+    livres = []
+    inicio = janela[0]
+    while inicio + duracao <= janela[1]:
+        if inicio >= agora and not indice.conflita(inicio, inicio + duracao):
+            livres.append(inicio)
+        inicio += passo
+    
+    if not ordenar_por_encaixe_agenda:
+        return livres
+    
+    menor_duracao = db.session.query(func.min(Servico.duracao)).filter(
+        Servico.barbearia_id == profissional.barbearia_id,
+        Servico.ativo == True
+    ).scalar() or servico.duracao
+    return ordenar_por_encaixe(livres, servico.duracao, indice, janela, menor_duracao)
+
+def _carregar_fila_espera(profissional_id, dia):
+    """Pedidos aguardando vaga com o profissional no dia e o último evento da outbox já refletido neles"""
+    marca = db.session.query(func.max(EventoSaida.id)).scalar() or 0
+    pedidos = db.session.query(ListaEspera, Servico.duracao).join(Servico).filter(
+        ListaEspera.profissional_id == profissional_id,
+        ListaEspera.data == dia,
+        ListaEspera.status == 'aguardando'
+    )
+    return [PedidoEspera(espera.id, duracao,
+                         datetime.combine(dia, espera.janela_inicio),
+                         datetime.combine(dia, espera.janela_fim))
+            for espera, duracao in pedidos], marca
+
+# Filas da lista de espera em memória (usadas pelo retransmissor da outbox)
+filas_espera = FilasEspera(_carregar_fila_espera)
+
+def _oferecer_vaga(profissional_id, inicio, origem_id=None):
+    """
+    Oferece o período livre que contém 'inicio' ao cliente da lista de espera
+    que melhor se encaixa nele. Retorna a entrada da lista ou None
+    
+    origem_id é o agendamento cancelado que liberou a vaga: um evento entregue
+    de novo não gera uma segunda oferta enquanto a primeira estiver de pé
+    """
+    if origem_id is not None and db.session.query(exists().where(
+            ListaEspera.oferta_origem_id == origem_id,
+            or_(ListaEspera.status == 'atendido',
+                and_(ListaEspera.status == 'oferecido', ListaEspera.oferta_expira_em > datetime.now())))).scalar():
+        return None
+    
+    profissional = db.session.get(Profissional, profissional_id)
+    horario = horarios_cache.obter(profissional.barbearia_id) if profissional else None
+    janela = horario.expediente(inicio) if horario else None
+    if janela is None:
+        return None
+    
+    dia = inicio.date()
+    indice = _indice_ocupacao(profissional_id, dia, dia)
+    # Vagas já oferecidas e ainda válidas contam como ocupadas
+    ofertas = db.session.query(ListaEspera.oferta_inicio, Servico.duracao).join(Servico).filter(
+        ListaEspera.profissional_id == profissional_id,
+        ListaEspera.data == dia,
+        ListaEspera.status == 'oferecido',
+        ListaEspera.oferta_expira_em > datetime.now()
+    )
+    for oferta_inicio, duracao in ofertas:
+        indice.adicionar(oferta_inicio, oferta_inicio + timedelta(minutes=duracao))
+    vaga = indice.lacuna(inicio, max(janela[0], datetime.now()), janela[1])
+    if vaga is None:
+        return None
+    
+    fila = filas_espera.fila(profissional_id, dia)
+    encaixe = fila.encaixar(*vaga)
+    if encaixe is None:
+        return None
+    
+    pedido, inicio_oferecido = encaixe
+    espera = db.session.get(ListaEspera, pedido.id)
+    espera.status = 'oferecido'
+    espera.oferta_inicio = inicio_oferecido
+    espera.oferta_origem_id = origem_id
+    espera.oferta_expira_em = datetime.now() + timedelta(minutes=app.config['OFERTA_LISTA_ESPERA_MINUTOS'])
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        fila.adicionar(pedido)
+        raise
+    
+    vaga_oferecida.send(app, espera=espera)
+    return espera
+
+def _fechar_dia(barbearia_id, dia, faltas=()):
+    """
+    Encerra os agendamentos confirmados da barbearia no dia com um único UPDATE:
+    os IDs em 'faltas' viram 'cancelado' (não compareceu) e os demais 'realizado'
+    Grava um único evento com as listas de IDs. Retorna (realizados, faltas)
+    """
+    faltas = [int(agendamento_id) for agendamento_id in faltas]
+    inicio = datetime.combine(dia, datetime.min.time())
+    comando = update(Agendamento).where(
+        Agendamento.profissional_id.in_(select(Profissional.id).where(Profissional.barbearia_id == barbearia_id)),
+        Agendamento.status == 'confirmado',
+        Agendamento.data_hora >= inicio,
+        Agendamento.data_hora < inicio + timedelta(days=1)
+    ).values(
+        status=case((Agendamento.id.in_(faltas), 'cancelado'), else_='realizado') if faltas else 'realizado'
+    ).returning(Agendamento.id, Agendamento.status).execution_options(synchronize_session=False)
+    
+    alterados = db.session.execute(comando).all()
+    realizados = [agendamento_id for agendamento_id, status in alterados if status == 'realizado']
+    ausentes = [agendamento_id for agendamento_id, status in alterados if status == 'cancelado']
+    if alterados:
+        conexao = db.session.connection(bind_arguments={'mapper': Agendamento})
+        gravar_evento(conexao, EventoSaida.__table__, 'agendamentos-encerrados', barbearia_id,
+                      barbearia_id=barbearia_id, dia=dia, realizados=realizados, faltas=ausentes)
+        # O UPDATE em massa não passa pelo after_flush: as faltas liberam horários
+        _incrementar_versao(conexao, conexao.execute(select(dono_da_barbearia(barbearia_id))).scalar(), 'agenda')
+    db.session.commit()
+    return realizados, ausentes
+
+@app.cli.command('fechar-dia')
+@click.option('--data', 'dia', type=click.DateTime(formats=['%Y-%m-%d']), help='Dia a encerrar (padrão: hoje)')
+@click.option('--barbearia', 'barbearia_id', type=int, help='Somente esta barbearia')
+def fechar_dia(dia, barbearia_id):
+    """Marca como realizados os agendamentos confirmados do dia (fechamento do caixa)"""
+    dia = dia.date() if dia else date.today()
+    if barbearia_id:
+        usar_tenant(dono_do_id(barbearia_id))
+        resultados = [[(barbearia_id, _fechar_dia(barbearia_id, dia))]]
+    else:
+        resultados = _em_todos_shards(lambda: [
+            (barbearia.id, _fechar_dia(barbearia.id, dia))
+            for barbearia in Barbearia.query.filter_by(ativo=True).all()
+        ])
+    
+    for lista in resultados:
+        for barbearia_id, (realizados, faltas) in lista:
+            click.echo(f'Barbearia {barbearia_id}: {len(realizados)} realizados')
 
 # ===== ROTAS DA APLICAÇÃO =====
 
@@ -206,143 +1784,66 @@ def logout():
 
 @app.route('/dashboard')
 @login_required
+@somente_leitura
+@condicional(lambda: versoes_dados(current_user.id, 'cadastro'), por_usuario=True)
 def dashboard():
     """Dashboard principal do usuário"""
-    barbearias = Barbearia.query.filter_by(user_id=current_user.id).all()
-    total_profissionais = Profissional.query.join(Barbearia).filter(Barbearia.user_id == current_user.id).count()
-    total_servicos = Servico.query.join(Barbearia).filter(Barbearia.user_id == current_user.id).count()
+    @cache
+    def resumo():
+        """Consultas dos blocos do dashboard; só rodam quando algum fragmento não está em cache"""
+        barbearias = Barbearia.query.filter_by(user_id=current_user.id).all()
+        profissionais = dict(db.session.query(Profissional.barbearia_id, func.count(Profissional.id))
+                             .join(Barbearia).filter(Barbearia.user_id == current_user.id)
+                             .group_by(Profissional.barbearia_id).all())
+        servicos = dict(db.session.query(Servico.barbearia_id, func.count(Servico.id))
+                        .join(Barbearia).filter(Barbearia.user_id == current_user.id)
+                        .group_by(Servico.barbearia_id).all())
+        return {
+            'barbearias': barbearias,
+            'profissionais': profissionais,
+            'servicos': servicos,
+            'total_profissionais': sum(profissionais.values()),
+            'total_servicos': sum(servicos.values()),
+        }
     
-    return render_template('dashboard.html', 
-                         barbearias=barbearias,
-                         total_profissionais=total_profissionais,
-                         total_servicos=total_servicos)
+    return render_template('dashboard.html', versao=g.versoes_dados[0], resumo=resumo)
 
 # ===== ROTAS DE ADMINISTRAÇÃO =====
 
-@app.route('/admin')
-def admin_dashboard():
-    """Dashboard de administração do SaaS"""
-    if not session.get('admin'):
-        return redirect(url_for('login'))
-    
-    total_users = User.query.count()
-    total_barbearias = Barbearia.query.count()
-    total_profissionais = Profissional.query.count()
-    total_servicos = Servico.query.count()
-    usuarios_recentes = User.query.order_by(User.created_at.desc()).limit(10).all()
-    barbearias_ativas = Barbearia.query.join(User).filter(User.ativo == True).count()
-    barbearias_bloqueadas = Barbearia.query.join(User).filter(User.ativo == False).count()
-    
-    return render_template('admin_dashboard.html',
-                         total_users=total_users,
-                         total_barbearias=total_barbearias,
-                         total_profissionais=total_profissionais,
-                         total_servicos=total_servicos,
-                         usuarios_recentes=usuarios_recentes,
-                         barbearias_ativas=barbearias_ativas,
-                         barbearias_bloqueadas=barbearias_bloqueadas)
-
-@app.route('/admin/cadastrar-usuario', methods=['POST'])
-def admin_cadastrar_usuario():
-    """Cadastra um novo usuário no sistema"""
-    if not session.get('admin'):
-        return jsonify({'success': False, 'message': 'Acesso negado'})
-    
-    try:
-        data = request.get_json()
-        
-        # Validações
-        if not data.get('nome') or not data.get('email') or not data.get('senha'):
-            return jsonify({'success': False, 'message': 'Nome, email e senha são obrigatórios'})
-        
-        # Verifica se o email já existe
-        if User.query.filter_by(email=data['email']).first():
-            return jsonify({'success': False, 'message': 'Este email já está cadastrado no sistema'})
-        
-        # Cria o usuário
-        user = User(
-            nome=data['nome'],
-            email=data['email'],
-            telefone=data.get('telefone'),
-            tipo=data.get('tipo', 'cliente'),
-            ativo=data.get('ativo', True)
-        )
-        user.set_password(data['senha'])
-        
-        db.session.add(user)
-        db.session.commit()
-        
-        return jsonify({
-            'success': True, 
-            'message': f'Usuário {user.nome} cadastrado com sucesso!',
-            'user': {
-                'id': user.id,
-                'nome': user.nome,
-                'email': user.email,
-                'tipo': user.tipo,
-                'ativo': user.ativo
-            }
-        })
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'message': f'Erro ao cadastrar usuário: {str(e)}'})
-
-@app.route('/admin/usuarios')
-def admin_usuarios():
-    """Gerenciamento de usuários"""
-    if not session.get('admin'):
-        return redirect(url_for('login'))
-    
-    usuarios = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin_usuarios.html', usuarios=usuarios)
-
-@app.route('/admin/usuarios/<int:user_id>/toggle-status', methods=['POST'])
-def admin_toggle_user_status(user_id):
-    """Ativa/desativa usuário"""
-    if not session.get('admin'):
-        return jsonify({'success': False, 'message': 'Acesso negado'})
-    
-    user = User.query.get_or_404(user_id)
-    user.ativo = not user.ativo
+class VisaoSobDemanda:
+    """
+    Visão importada só na primeira chamada (padrão "lazy loading" da documentação do Flask)
+    A regra de URL é registrada já, mas o módulo da visão fica fora da inicialização
+    """
     
-    if user.ativo:
-        status_msg = 'ativada'
-    else:
-        status_msg = 'bloqueada'
+    def __init__(self, caminho):
+        self.__module__, self.__name__ = caminho.rsplit('.', 1)
+        self.caminho = caminho
     
-    db.session.commit()
+    @cached_property
+    def visao(self):
+        return import_string(self.caminho)
     
-    return jsonify({
-        'success': True, 
-        'message': f'Conta {status_msg} com sucesso!',
-        'ativo': user.ativo
-    })
+    def __call__(self, *args, **kwargs):
+        return self.visao(*args, **kwargs)
 
-@app.route('/admin/usuarios/<int:user_id>/delete', methods=['POST'])
-def admin_delete_user(user_id):
-    """Deleta usuário e todas suas barbearias"""
-    if not session.get('admin'):
-        return jsonify({'success': False, 'message': 'Acesso negado'})
-    
-    user = User.query.get_or_404(user_id)
-    db.session.delete(user)
-    db.session.commit()
-    
-    return jsonify({'success': True, 'message': 'Usuário deletado com sucesso!'})
-
-@app.route('/admin/barbearias')
-def admin_barbearias():
-    """Gerenciamento de barbearias"""
-    if not session.get('admin'):
-        return redirect(url_for('login'))
-    
-    barbearias = Barbearia.query.join(User).order_by(Barbearia.created_at.desc()).all()
-    return render_template('admin_barbearias.html', barbearias=barbearias)
+# Painel do administrador (admin.py): pouco acessado, carregado sob demanda
+for regra, endpoint, metodos in (
+    ('/admin', 'admin_dashboard', ['GET']),
+    ('/admin/metricas/pool', 'admin_metricas_pool', ['GET']),
+    ('/admin/cadastrar-usuario', 'admin_cadastrar_usuario', ['POST']),
+    ('/admin/usuarios', 'admin_usuarios', ['GET']),
+    ('/admin/usuarios/<int:user_id>/toggle-status', 'admin_toggle_user_status', ['POST']),
+    ('/admin/usuarios/<int:user_id>/delete', 'admin_delete_user', ['POST']),
+    ('/admin/barbearias', 'admin_barbearias', ['GET']),
+):
+    app.add_url_rule(regra, endpoint, VisaoSobDemanda(f'admin.{endpoint}'), methods=metodos)
 
 # ===== OUTRAS ROTAS =====
 
 @app.route('/minhas-barbearias')
 @login_required
+@condicional(lambda: versoes_dados(current_user.id, 'cadastro'), por_usuario=True)
 def minhas_barbearias():
     """Lista todas as barbearias do usuário logado"""
     barbearias = Barbearia.query.filter_by(user_id=current_user.id).all()
@@ -381,27 +1882,544 @@ def gerenciar_servicos(barbearia_id):
     return render_template('gerenciar_servicos.html', barbearia=barbearia, servicos=servicos)
 
 @app.route('/profissional/<int:profissional_id>/agenda')
+@somente_leitura
+@condicional(lambda profissional_id: versoes_dados(dono_do_profissional(profissional_id), 'cadastro'))
 def agenda_profissional(profissional_id):
     """Visualizar agenda disponível de um profissional"""
     profissional = Profissional.query.get_or_404(profissional_id)
     return render_template('agenda_profissional.html', profissional=profissional)
 
+@app.route('/profissional/<int:profissional_id>/agenda/eventos')
+def agenda_profissional_eventos(profissional_id):
+    """Stream SSE com os agendamentos criados e cancelados do profissional"""
+    Profissional.query.get_or_404(profissional_id)
+    return _transmitir_agenda(f'profissional:{profissional_id}')
+
+@app.route('/barbearia/<int:barbearia_id>/agenda/eventos')
+@login_required
+def agenda_barbearia_eventos(barbearia_id):
+    """Stream SSE com os eventos de agenda de todos os profissionais da barbearia (recepção)"""
+    barbearia = Barbearia.query.get_or_404(barbearia_id)
+    if barbearia.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    return _transmitir_agenda(f'barbearia:{barbearia_id}')
+
+@app.route('/barbearia/<int:barbearia_id>/horarios')
+@condicional(lambda barbearia_id: versoes_dados(dono_da_barbearia(barbearia_id), 'cadastro', 'agenda') + (date.today(),))
+def horarios_barbearia(barbearia_id):
+    """API com o calendário de funcionamento da barbearia"""
+    # Recarrega o calendário em cache se outro processo alterou a barbearia ou as exceções
+    horario = horarios_cache.obter(barbearia_id, versao=g.versoes_dados[:2])
+    if horario is None:
+        return jsonify({'success': False, 'message': 'Barbearia não encontrada'}), 404
+    
+    dias = min(request.args.get('dias', 30, type=int), 90)
+    return jsonify(horario.para_dict(dias=dias))
+
+@app.route('/barbearia/<int:barbearia_id>/excecoes', methods=['POST'])
+@login_required
+def cadastrar_excecao_horario(barbearia_id):
+    """Cadastra feriado ou horário especial para uma data"""
+    barbearia = Barbearia.query.get_or_404(barbearia_id)
+    if barbearia.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    try:
+        data = request.get_json()
+        dia = date.fromisoformat(data.get('data', ''))
+        fechado = data.get('fechado', True)
+        abertura = None if fechado else datetime.strptime(data['horario_abertura'], '%H:%M').time()
+        fechamento = None if fechado else datetime.strptime(data['horario_fechamento'], '%H:%M').time()
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Informe a data e os horários no formato correto'})
+    
+    excecao = ExcecaoHorario.query.filter_by(barbearia_id=barbearia_id, data=dia).first()
+    if excecao is None:
+        excecao = ExcecaoHorario(barbearia_id=barbearia_id, data=dia)
+        db.session.add(excecao)
+    excecao.fechado = fechado
+    excecao.horario_abertura = abertura
+    excecao.horario_fechamento = fechamento
+    excecao.descricao = data.get('descricao')
+    db.session.commit()
+    
+    return jsonify({'success': True, 'message': 'Exceção de horário salva com sucesso!', 'id': excecao.id})
+
+@app.route('/barbearia/<int:barbearia_id>/excecoes/<int:excecao_id>/delete', methods=['POST'])
+@login_required
+def remover_excecao_horario(barbearia_id, excecao_id):
+    """Remove uma exceção de horário"""
+    excecao = ExcecaoHorario.query.filter_by(id=excecao_id, barbearia_id=barbearia_id).first_or_404()
+    if excecao.barbearia.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    db.session.delete(excecao)
+    db.session.commit()
+    return jsonify({'success': True, 'message': 'Exceção de horário removida com sucesso!'})
+
+@app.route('/barbearia/<int:barbearia_id>/webhooks', methods=['GET', 'POST'])
+@login_required
+def webhooks_barbearia(barbearia_id):
+    """Lista ou cadastra webhooks que recebem os eventos de agendamento da barbearia"""
+    barbearia = Barbearia.query.get_or_404(barbearia_id)
+    if barbearia.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    if request.method == 'GET':
+        return jsonify({'success': True, 'webhooks': [{
+            'id': webhook.id,
+            'url': webhook.url,
+            'eventos': webhook.eventos.split(','),
+            'ativo': webhook.ativo
+        } for webhook in Webhook.query.filter_by(barbearia_id=barbearia_id).order_by(Webhook.id)]})
+    
+    data = request.get_json() or {}
+    url = (data.get('url') or '').strip()
+    eventos = data.get('eventos') or list(TIPOS_EVENTO_WEBHOOK)
+    if not url.startswith(('http://', 'https://')):
+        return jsonify({'success': False, 'message': 'Informe uma URL http:// ou https://'})
+    if not isinstance(eventos, list) or not set(eventos) <= set(TIPOS_EVENTO_WEBHOOK):
+        return jsonify({'success': False, 'message': f'Eventos válidos: {", ".join(TIPOS_EVENTO_WEBHOOK)}'})
+    
+    webhook = Webhook(barbearia_id=barbearia_id, url=url, eventos=','.join(eventos), segredo=secrets.token_hex(32))
+    db.session.add(webhook)
+    db.session.commit()
+    
+    # O segredo só é mostrado agora; serve para conferir o cabeçalho X-Barbearia-Assinatura
+    return jsonify({'success': True, 'message': 'Webhook cadastrado com sucesso!',
+                    'id': webhook.id, 'segredo': webhook.segredo})
+
+@app.route('/barbearia/<int:barbearia_id>/webhooks/<int:webhook_id>/delete', methods=['POST'])
+@login_required
+def remover_webhook(barbearia_id, webhook_id):
+    """Remove um webhook e as entregas ainda pendentes dele"""
+    webhook = Webhook.query.filter_by(id=webhook_id, barbearia_id=barbearia_id).first_or_404()
+    if webhook.barbearia.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    
+    # Histórico de entregas apagado direto no banco, sem carregar na sessão
+    EntregaWebhook.query.filter_by(webhook_id=webhook_id).delete()
+    db.session.delete(webhook)
+    db.session.commit()
+    return jsonify({'success': True, 'message': 'Webhook removido com sucesso!'})
+
+def _versoes_horarios_disponiveis(profissional_id):
+    """Versões da barbearia e da agenda; para hoje, também o minuto (horários passados saem da lista)"""
+    agora = datetime.now()
+    dia = request.args.get('data', '')
+    return versoes_dados(dono_do_profissional(profissional_id), 'cadastro', 'agenda') + (
+        agora.strftime('%Y-%m-%d %H:%M') if dia <= agora.date().isoformat() else None,)
+
+@app.route('/profissional/<int:profissional_id>/horarios-disponiveis')
+@condicional(_versoes_horarios_disponiveis)
+def horarios_disponiveis(profissional_id):
+    """
+    API com os horários livres de um profissional em uma data
+    ?ordenar=encaixe ordena pelos horários que deixam menos sobras inúteis na agenda
+    """
+    profissional = Profissional.query.get_or_404(profissional_id)
+    servico = db.session.get(Servico, request.args.get('servico_id', type=int) or 0)
+    try:
+        dia = date.fromisoformat(request.args.get('data', ''))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Data inválida'}), 400
+    if servico is None or servico.barbearia_id != profissional.barbearia_id:
+        return jsonify({'success': False, 'message': 'Serviço inválido'}), 400
+    
+    if request.args.get('ordenar') == 'encaixe':
+        # Horários que melhor se encaixam entre os agendamentos existentes primeiro
+        ranking = _horarios_livres(profissional, servico, dia, ordenar_por_encaixe_agenda=True,
+                                   versao_horario=g.versoes_dados[:2])
+        return jsonify({
+            'success': True,
+            'horarios': [inicio.strftime('%H:%M') for inicio, desperdicio in ranking],
+            'desperdicio': {inicio.strftime('%H:%M'): desperdicio for inicio, desperdicio in ranking}
+        })
+    
+    livres = _horarios_livres(profissional, servico, dia, versao_horario=g.versoes_dados[:2])
+    return jsonify({'success': True, 'horarios': [inicio.strftime('%H:%M') for inicio in livres]})
+
+@app.route('/profissional/<int:profissional_id>/historico')
+@login_required
+@somente_leitura
+def historico_profissional(profissional_id):
+    """
+    Relatório de agendamentos do profissional entre ?inicio e ?fim (datas ISO)
+    Lê a visão agendamentos_historico, que inclui os agendamentos já arquivados
+    """
+    profissional = Profissional.query.get_or_404(profissional_id)
+    if profissional.barbearia.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    try:
+        inicio = date.fromisoformat(request.args.get('inicio', ''))
+        fim = date.fromisoformat(request.args.get('fim', ''))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Período inválido'}), 400
+    
+    historico = historico_agendamentos.c
+    consulta = select(historico.id, historico.data_hora, historico.status, historico.servico_id).where(
+        historico.profissional_id == profissional_id,
+        historico.data_hora >= datetime.combine(inicio, datetime.min.time()),
+        historico.data_hora < datetime.combine(fim, datetime.min.time()) + timedelta(days=1)
+    ).order_by(historico.data_hora)
+    # mapper=Agendamento leva a consulta ao mesmo banco (réplica ou shard) dos agendamentos
+    linhas = db.session.execute(consulta, bind_arguments={'mapper': Agendamento}).all()
+    
+    totais = {}
+    for linha in linhas:
+        totais[linha.status] = totais.get(linha.status, 0) + 1
+    return jsonify({
+        'success': True,
+        'totais': totais,
+        'agendamentos': [{
+            'id': linha.id,
+            'data_hora': linha.data_hora.isoformat(),
+            'status': linha.status,
+            'servico_id': linha.servico_id
+        } for linha in linhas]
+    })
+
 @app.route('/agendar', methods=['POST'])
 def agendar():
     """API para fazer agendamento de serviço"""
-    data = request.get_json()
-    return jsonify({'success': True, 'message': 'Agendamento realizado com sucesso!'})
+    if not current_user.is_authenticated:
+        return jsonify({'success': False, 'message': 'Faça login para agendar'}), 401
+    
+    data = request.get_json() or {}
+    profissional = db.session.get(Profissional, data.get('profissional_id') or 0)
+    servico = db.session.get(Servico, data.get('servico_id') or 0)
+    inicio = _ler_data_hora(data.get('data_hora'))
+    if profissional is None or servico is None or inicio is None:
+        return jsonify({'success': False, 'message': 'Profissional, serviço e data/hora são obrigatórios'})
+    
+    erro = _validar_agendamento(profissional, servico, inicio)
+    if erro:
+        return jsonify({'success': False, 'message': erro})
+    
+    agendamento = Agendamento(
+        data_hora=inicio,
+        data_hora_fim=inicio + timedelta(minutes=servico.duracao),
+        observacoes=data.get('observacoes'),
+        cliente_id=current_user.id,
+        profissional_id=profissional.id,
+        servico_id=servico.id
+    )
+    db.session.add(agendamento)
+    erro = _gravar_agendamentos()
+    if erro:
+        return jsonify({'success': False, 'message': erro})
+    
+    return jsonify({'success': True, 'message': 'Agendamento realizado com sucesso!', 'id': agendamento.id})
+
+@app.route('/agendar-serie', methods=['POST'])
+def agendar_serie():
+    """
+    API para agendamentos recorrentes (ex.: mesmo barbeiro a cada duas semanas)
+    Todas as ocorrências são validadas de uma vez e gravadas em uma única transação
+    """
+    if not current_user.is_authenticated:
+        return jsonify({'success': False, 'message': 'Faça login para agendar'}), 401
+    
+    data = request.get_json() or {}
+    profissional = db.session.get(Profissional, data.get('profissional_id') or 0)
+    servico = db.session.get(Servico, data.get('servico_id') or 0)
+    inicio = _ler_data_hora(data.get('data_hora'))
+    if profissional is None or servico is None or inicio is None:
+        return jsonify({'success': False, 'message': 'Profissional, serviço e data/hora são obrigatórios'})
+    
+    erro = _validar_profissional_servico(profissional, servico)
+    if erro:
+        return jsonify({'success': False, 'message': erro})
+    
+    try:
+        regra = data.get('regra') or 'FREQ=WEEKLY;INTERVAL={};COUNT={}'.format(
+            int(data.get('intervalo_semanas', 2)), int(data.get('ocorrencias', 6)))
+        ocorrencias = expandir_serie(regra, inicio)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Regra de recorrência inválida'})
+    if not ocorrencias:
+        return jsonify({'success': False, 'message': 'A regra de recorrência não gera nenhuma data'})
+    
+    # Uma consulta para o período inteiro da série em vez de uma por ocorrência
+    horario = horarios_cache.obter(profissional.barbearia_id)
+    indice = _indice_ocupacao(profissional.id, ocorrencias[0].date(), ocorrencias[-1].date())
+    
+    livres, conflitos = [], []
+    for data_hora in ocorrencias:
+        motivo = _motivo_indisponivel(servico, data_hora, horario, indice)
+        if motivo:
+            conflitos.append({'data_hora': data_hora.isoformat(), 'motivo': motivo})
+        else:
+            livres.append(data_hora)
+            indice.adicionar(data_hora, data_hora + timedelta(minutes=servico.duracao))
+    
+    if conflitos and not data.get('ignorar_conflitos'):
+        return jsonify({
+            'success': False,
+            'message': 'Algumas datas da série não estão disponíveis',
+            'conflitos': conflitos
+        })
+    if not livres:
+        return jsonify({'success': False, 'message': 'Nenhuma data da série está disponível', 'conflitos': conflitos})
+    
+    serie = SerieAgendamento(
+        regra=regra,
+        data_inicio=inicio,
+        cliente_id=current_user.id,
+        profissional_id=profissional.id,
+        servico_id=servico.id
+    )
+    db.session.add(serie)
+    db.session.add_all([
+        Agendamento(
+            data_hora=data_hora,
+            data_hora_fim=data_hora + timedelta(minutes=servico.duracao),
+            observacoes=data.get('observacoes'),
+            cliente_id=current_user.id,
+            profissional_id=profissional.id,
+            servico_id=servico.id,
+            serie=serie
+        )
+        for data_hora in livres
+    ])
+    erro = _gravar_agendamentos()
+    if erro:
+        return jsonify({'success': False, 'message': erro})
+    
+    return jsonify({
+        'success': True,
+        'message': f'{len(livres)} agendamentos realizados com sucesso!',
+        'serie_id': serie.id,
+        'agendados': [data_hora.isoformat() for data_hora in livres],
+        'conflitos': conflitos
+    })
+
+def _lista_de_ids(valores, opcional=False):
+    """True se 'valores' é uma lista de IDs inteiros (com opcional=True também aceita null)"""
+    return isinstance(valores, list) and all(
+        (isinstance(valor, int) and not isinstance(valor, bool)) or (opcional and valor is None)
+        for valor in valores)
+
+@app.route('/agendar-servicos', methods=['POST'])
+def agendar_servicos():
+    """
+    API para vários serviços na mesma visita (ex.: corte + barba), em sequência
+    e possivelmente com profissionais diferentes. Com reservar=false apenas
+    sugere o itinerário; caso contrário grava todas as partes em uma transação
+    """
+    data = request.get_json() or {}
+    servico_ids = data.get('servico_ids')
+    if not servico_ids or not _lista_de_ids(servico_ids):
+        return jsonify({'success': False, 'message': 'servico_ids deve ser uma lista de IDs de serviço'}), 400
+    # Um profissional por serviço; null (ou a lista ausente) aceita qualquer um da barbearia
+    preferidos = data.get('profissional_ids') or [None] * len(servico_ids)
+    if not _lista_de_ids(preferidos, opcional=True) or len(preferidos) != len(servico_ids):
+        return jsonify({'success': False, 'message': 'profissional_ids deve ter um profissional (ou null) para cada serviço'}), 400
+    
+    servicos = [db.session.get(Servico, servico_id) for servico_id in servico_ids]
+    if None in servicos:
+        return jsonify({'success': False, 'message': 'Informe os serviços desejados'})
+    
+    barbearia_id = servicos[0].barbearia_id
+    if any(servico.barbearia_id != barbearia_id or not servico.ativo for servico in servicos):
+        return jsonify({'success': False, 'message': 'Os serviços devem ser da mesma barbearia'})
+    
+    try:
+        dia = date.fromisoformat(data.get('data', ''))
+        a_partir_de = datetime.combine(dia, datetime.strptime(data.get('a_partir_de', '00:00'), '%H:%M').time())
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Data inválida'})
+    
+    reservar = data.get('reservar', True)
+    if not isinstance(reservar, bool):
+        return jsonify({'success': False, 'message': 'reservar deve ser true ou false'}), 400
+    if reservar and not current_user.is_authenticated:
+        return jsonify({'success': False, 'message': 'Faça login para agendar'}), 401
+    
+    horario = horarios_cache.obter(barbearia_id)
+    janela = horario.expediente(dia) if horario else None
+    if janela is None:
+        return jsonify({'success': False, 'message': 'A barbearia não abre nesta data'})
+    
+    # Profissionais aceitos por serviço: o escolhido pelo cliente ou qualquer um da barbearia
+    ativos = [profissional.id for profissional in
+              Profissional.query.filter_by(barbearia_id=barbearia_id, ativo=True)]
+    if any(preferido is not None and preferido not in ativos for preferido in preferidos):
+        return jsonify({'success': False, 'message': 'profissional_ids deve ter apenas profissionais ativos da barbearia dos serviços'}), 400
+    candidatos = [ativos if preferido is None else [preferido] for preferido in preferidos]
+    
+    indices = _indices_ocupacao(ativos, dia, dia)
+    itinerario = planejar_itinerario(
+        [servico.duracao for servico in servicos],
+        candidatos,
+        indices,
+        janela,
+        timedelta(minutes=app.config['INTERVALO_AGENDA_MINUTOS']),
+        max(a_partir_de, datetime.now())
+    )
+    if itinerario is None:
+        return jsonify({'success': False, 'message': 'Não há horários em sequência disponíveis nesta data'})
+    
+    partes = [
+        {'servico_id': servico.id, 'profissional_id': profissional_id,
+         'inicio': inicio.isoformat(), 'fim': fim.isoformat()}
+        for servico, (profissional_id, inicio, fim) in zip(servicos, itinerario)
+    ]
+    if not reservar:
+        return jsonify({'success': True, 'itinerario': partes})
+    
+    agendamentos = [
+        Agendamento(
+            data_hora=inicio,
+            data_hora_fim=fim,
+            observacoes=data.get('observacoes'),
+            cliente_id=current_user.id,
+            profissional_id=profissional_id,
+            servico_id=servico.id
+        )
+        for servico, (profissional_id, inicio, fim) in zip(servicos, itinerario)
+    ]
+    db.session.add_all(agendamentos)
+    erro = _gravar_agendamentos()
+    if erro:
+        return jsonify({'success': False, 'message': erro})
+    
+    for parte, agendamento in zip(partes, agendamentos):
+        parte['id'] = agendamento.id
+    return jsonify({'success': True, 'message': 'Agendamentos realizados com sucesso!', 'itinerario': partes})
+
+@app.route('/agendamento/<int:agendamento_id>/cancelar', methods=['POST'])
+@login_required
+def cancelar_agendamento(agendamento_id):
+    """Cancela um agendamento e oferece a vaga para a lista de espera"""
+    agendamento = Agendamento.query.get_or_404(agendamento_id)
+    dono_id = agendamento.profissional.barbearia.user_id
+    if current_user.id not in (agendamento.cliente_id, dono_id):
+        return jsonify({'success': False, 'message': 'Acesso negado'})
+    if agendamento.status == 'cancelado':
+        return jsonify({'success': False, 'message': 'Agendamento já está cancelado'})
+    
+    # A oferta para a lista de espera sai pela outbox (evento agendamento-cancelado)
+    agendamento.status = 'cancelado'
+    db.session.commit()
+    return jsonify({'success': True, 'message': 'Agendamento cancelado com sucesso!'})
+
+@app.route('/barbearia/<int:barbearia_id>/fechar-dia', methods=['POST'])
+@login_required
+def fechar_dia_barbearia(barbearia_id):
+    """
+    Fechamento do dia: confirmados viram 'realizado' e os IDs em 'faltas' viram 'cancelado'
+    JSON: {"data": "AAAA-MM-DD", "faltas": [ids]}
+    """
+    barbearia = Barbearia.query.get_or_404(barbearia_id)
+    if barbearia.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        dia = date.fromisoformat(data.get('data') or date.today().isoformat())
+        faltas = [int(agendamento_id) for agendamento_id in data.get('faltas', [])]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Dados inválidos'}), 400
+    if dia > date.today():
+        return jsonify({'success': False, 'message': 'Não é possível fechar um dia futuro'}), 400
+    
+    realizados, ausentes = _fechar_dia(barbearia_id, dia, faltas)
+    return jsonify({
+        'success': True,
+        'message': f'{len(realizados)} realizados e {len(ausentes)} faltas registradas',
+        'realizados': realizados,
+        'faltas': ausentes
+    })
+
+@app.route('/lista-espera', methods=['POST'])
+@login_required
+def entrar_lista_espera():
+    """Coloca o cliente na lista de espera de um profissional em uma data"""
+    data = request.get_json() or {}
+    profissional = db.session.get(Profissional, data.get('profissional_id') or 0)
+    servico = db.session.get(Servico, data.get('servico_id') or 0)
+    if profissional is None or servico is None:
+        return jsonify({'success': False, 'message': 'Profissional e serviço são obrigatórios'})
+    
+    erro = _validar_profissional_servico(profissional, servico)
+    if erro:
+        return jsonify({'success': False, 'message': erro})
+    
+    try:
+        dia = date.fromisoformat(data.get('data', ''))
+        janela_inicio = datetime.strptime(data.get('janela_inicio', '00:00'), '%H:%M').time()
+        janela_fim = datetime.strptime(data.get('janela_fim', '23:59'), '%H:%M').time()
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Informe a data e a janela de horário no formato correto'})
+    
+    espera = ListaEspera(
+        data=dia,
+        janela_inicio=janela_inicio,
+        janela_fim=janela_fim,
+        cliente_id=current_user.id,
+        profissional_id=profissional.id,
+        servico_id=servico.id
+    )
+    db.session.add(espera)
+    db.session.commit()
+    
+    return jsonify({'success': True, 'message': 'Você entrou na lista de espera!', 'id': espera.id})
+
+@app.route('/lista-espera/<int:espera_id>/aceitar', methods=['POST'])
+@login_required
+def aceitar_vaga(espera_id):
+    """Confirma a vaga oferecida ao cliente da lista de espera"""
+    espera = ListaEspera.query.get_or_404(espera_id)
+    if espera.cliente_id != current_user.id or espera.status != 'oferecido':
+        return jsonify({'success': False, 'message': 'Não há vaga oferecida para este pedido'})
+    
+    if espera.oferta_expira_em < datetime.now():
+        # O retransmissor recebe o evento da expiração e oferece a vaga ao próximo da fila
+        espera.status = 'expirado'
+        db.session.commit()
+        return jsonify({'success': False, 'message': 'A oferta expirou'})
+    
+    erro = _validar_agendamento(espera.profissional, espera.servico, espera.oferta_inicio)
+    if erro:
+        espera.status = 'aguardando'
+        db.session.commit()
+        return jsonify({'success': False, 'message': erro})
+    
+    agendamento = Agendamento(
+        data_hora=espera.oferta_inicio,
+        data_hora_fim=espera.oferta_inicio + timedelta(minutes=espera.servico.duracao),
+        cliente_id=espera.cliente_id,
+        profissional_id=espera.profissional_id,
+        servico_id=espera.servico_id
+    )
+    espera.status = 'atendido'
+    db.session.add(agendamento)
+    erro = _gravar_agendamentos()
+    if erro:
+        return jsonify({'success': False, 'message': erro})
+    
+    return jsonify({'success': True, 'message': 'Agendamento realizado com sucesso!', 'id': agendamento.id})
 
 @app.route('/verificar-disponibilidade', methods=['POST'])
 def verificar_disponibilidade():
     """API para verificar disponibilidade de horário"""
-    data = request.get_json()
-    return jsonify({'disponivel': True})
+    data = request.get_json() or {}
+    profissional = db.session.get(Profissional, data.get('profissional_id') or 0)
+    servico = db.session.get(Servico, data.get('servico_id') or 0)
+    inicio = _ler_data_hora(data.get('data_hora'))
+    if profissional is None or servico is None or inicio is None:
+        return jsonify({'disponivel': False, 'motivo': 'Profissional, serviço e data/hora são obrigatórios'})
+    
+    erro = _validar_agendamento(profissional, servico, inicio)
+    return jsonify({'disponivel': erro is None, 'motivo': erro})
 
 @app.route('/init-db')
 def init_db():
     """Inicializa o banco de dados (apenas para desenvolvimento)"""
     db.create_all()
+    for engine in _engines_shards():
+        db.metadata.create_all(bind=engine)
     return 'Banco de dados inicializado com sucesso!'
 
 # ===== TRATAMENTO DE ERROS =====
@@ -417,34 +2435,56 @@ def internal_error(error):
 
 # ===== INICIALIZAÇÃO =====
 
-# Cria as tabelas quando o app é importado
-with app.app_context():
-    try:
-        print("🗄️ Inicializando banco de dados...")
-        # Força a recriação das tabelas
-        db.drop_all()  # Remove todas as tabelas existentes
-        print("✅ Tabelas antigas removidas")
-        db.create_all()  # Cria todas as tabelas novamente
-        print("✅ Tabelas criadas com sucesso!")
-        
-        # Verifica se as tabelas foram criadas
-        from sqlalchemy import inspect
-        inspector = inspect(db.engine)
-        tables = inspector.get_table_names()
-        print(f"📋 Tabelas criadas: {tables}")
-        
-        # Verifica a estrutura da tabela users
-        if 'users' in tables:
-            columns = inspector.get_columns('users')
-            print(f"🔍 Colunas da tabela users:")
-            for col in columns:
-                print(f"   - {col['name']}: {col['type']}")
-        
-        print("✅ Banco de dados inicializado com sucesso!")
-    except Exception as e:
-        print(f"❌ Erro ao inicializar banco: {e}")
-        import traceback
-        traceback.print_exc()
+# Deixa o banco principal e os shards na última revisão de migrations/ quando o app é importado
+# Com RECRIAR_BANCO=1 (padrão ao rodar python app.py) apaga e recria tudo; workers
+# e o comando flask importam este módulo e precisam manter os dados
+RECRIAR_BANCO = os.getenv('RECRIAR_BANCO', '1' if __name__ == '__main__' else '0') == '1'
+# CRIAR_TABELAS=0 não consulta o banco na importação (ex.: o deploy já rodou flask db upgrade)
+CRIAR_TABELAS = os.getenv('CRIAR_TABELAS', '1') == '1'
+# Bancos criados com db.create_all antes das migrações têm o esquema desta revisão
+REVISAO_INICIAL = '0001'
+
+def _inicializar_banco():
+    """
+    Banco vazio: create_all e marca a última revisão; banco de antes das migrações
+    (sem alembic_version): marca a revisão inicial e aplica as demais
+    Com os bancos em dia custa uma consulta por banco
+    """
+    from alembic import command
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    
+    configuracao = migrate.get_config()
+    scripts = ScriptDirectory.from_config(configuracao)
+    ultima = scripts.get_current_head()
+    desatualizado = False
+    for engine in [db.engine] + _engines_shards():
+        with engine.begin() as conexao:
+            if RECRIAR_BANCO:
+                db.metadata.drop_all(bind=conexao)
+                conexao.execute(text('DROP TABLE IF EXISTS alembic_version'))
+            contexto = MigrationContext.configure(conexao)
+            revisao = contexto.get_current_revision()
+            if revisao == ultima:
+                continue
+            if revisao is None and not set(db.metadata.tables) & set(inspecionar(conexao).get_table_names()):
+                db.metadata.create_all(bind=conexao)
+                contexto.stamp(scripts, ultima)
+                app.logger.info('Banco criado em %s (revisão %s)', engine.url.database, ultima)
+                continue
+            if revisao is None:
+                contexto.stamp(scripts, REVISAO_INICIAL)
+            desatualizado = True
+    if desatualizado:
+        # O env.py das migrações percorre o banco principal e todos os shards
+        command.upgrade(configuracao, 'head')
+
+if CRIAR_TABELAS or RECRIAR_BANCO:
+    with app.app_context():
+        try:
+            _inicializar_banco()
+        except Exception:
+            app.logger.exception('Erro ao inicializar o banco de dados')
 
 if __name__ == '__main__':
     # Executa a aplicação em modo de desenvolvimento
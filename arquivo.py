@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Arquivamento do histórico de agendamentos
+Agendamentos antigos já encerrados saem da tabela usada nas consultas de
+disponibilidade e vão, em lotes pequenos, para uma tabela de arquivo.
+Relatórios leem as duas pela visão agendamentos_historico
+"""
+
+import time
+
+from sqlalchemy import Column, DDL, MetaData, Table, delete, inspect, select
+
+NOME_VISAO = 'agendamentos_historico'
+
+
+def _colunas(origem, arquivo):
+    """Colunas presentes nas duas tabelas, na ordem da tabela de origem"""
+    return [coluna.name for coluna in origem.c if coluna.name in arquivo.c]
+
+
+def _visao_ausente(ddl, target, bind, **kw):
+    """Condição do CREATE VIEW: o banco ainda não tem a visão (reinício sobre um banco existente)"""
+    return NOME_VISAO not in inspect(bind).get_view_names()
+
+
+def ddl_visao(origem, arquivo):
+    """
+    Comandos (criar, remover) da visão que une a tabela quente ao arquivo
+    O create_all roda a cada inicialização; a visão só é criada se ainda não existir
+    """
+    colunas = ', '.join(_colunas(origem, arquivo))
+    criar = DDL(
+        f'CREATE VIEW {NOME_VISAO} AS '
+        f'SELECT {colunas} FROM {origem.name} UNION ALL SELECT {colunas} FROM {arquivo.name}'
+    ).execute_if(callable_=_visao_ausente)
+    return criar, DDL(f'DROP VIEW IF EXISTS {NOME_VISAO}')
+
+
+def tabela_visao(origem, arquivo):
+    """
+    Tabela somente leitura que representa a visão nas consultas
+    Fica em um MetaData separado para o create_all não tentar criá-la
+    """
+    return Table(NOME_VISAO, MetaData(),
+                 *[Column(nome, origem.c[nome].type) for nome in _colunas(origem, arquivo)])
+
+
+def arquivar_em_lotes(engine, origem, arquivo, filtro, lote=500, pausa=0.0, valores_extras=None):
+    """
+    Copia para 'arquivo' e apaga de 'origem' as linhas que atendem 'filtro'
+    Cada lote é uma transação curta, para não segurar bloqueios sobre a
+    tabela quente enquanto o sistema atende agendamentos
+    Retorna o total de linhas movidas
+    """
+    colunas = _colunas(origem, arquivo)
+    total = 0
+    while True:
+        with engine.begin() as conexao:
+            ids = conexao.execute(
+                select(origem.c.id).where(filtro).order_by(origem.c.id).limit(lote)
+            ).scalars().all()
+            if not ids:
+                return total
+
+            linhas = conexao.execute(
+                select(*[origem.c[nome] for nome in colunas]).where(origem.c.id.in_(ids))
+            ).mappings().all()
+            conexao.execute(arquivo.insert(), [dict(linha, **(valores_extras or {})) for linha in linhas])
+            conexao.execute(delete(origem).where(origem.c.id.in_(ids)))
+
+        total += len(ids)
+        if len(ids) < lote:
+            return total
+        if pausa:
+            time.sleep(pausa)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Arquivos estáticos versionados pelo conteúdo, sem etapa de build
+Na inicialização cada arquivo de static/ ganha um nome com o hash do conteúdo
+(css/style.css -> css/style.1a2b3c4d5e6f.css), que pode ficar em cache por um
+ano: um deploy que muda o arquivo muda também o nome. Os compressíveis ganham
+versões .br e .gz prontas, gravadas uma única vez por conteúdo
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from collections import namedtuple
+
+try:
+    # Opcional: sem o pacote brotli só a versão gzip é gerada
+    import brotli
+except ImportError:
+    brotli = None
+
+EXTENSOES_COMPRESSIVEIS = {'.css', '.js', '.json', '.svg', '.txt', '.xml', '.html', '.map'}
+MINIMO_COMPRESSAO = 256  # Bytes; abaixo disso os cabeçalhos custam mais que o ganho
+
+# variantes: {'br': caminho, 'gzip': caminho} na ordem de preferência
+Ativo = namedtuple('Ativo', 'nome caminho mimetype variantes')
+
+
+def _compressores():
+    if brotli is not None:
+        yield 'br', '.br', lambda dados: brotli.compress(dados, quality=11)
+    yield 'gzip', '.gz', lambda dados: gzip.compress(dados, compresslevel=9, mtime=0)
+
+
+class ManifestoAtivos:
+    """
+    Mapa nome original -> nome versionado de todos os arquivos da pasta
+
+    pasta_comprimidos -- onde ficam as versões .br/.gz (fora de static/)
+    ignorar           -- nomes que mantêm a URL fixa (ex.: o service worker)
+    """
+
+    def __init__(self, pasta, pasta_comprimidos, ignorar=()):
+        self.pasta = pasta
+        self.pasta_comprimidos = pasta_comprimidos
+        self.ignorar = set(ignorar)
+        self.versionados = {}
+        self.ativos = {}
+        self.versao = ''
+        self.carregar()
+
+    def carregar(self):
+        versionados, ativos = {}, {}
+        resumo = hashlib.sha256()
+        for raiz, _, arquivos in sorted(os.walk(self.pasta)):
+            for arquivo in sorted(arquivos):
+                caminho = os.path.join(raiz, arquivo)
+                nome = os.path.relpath(caminho, self.pasta).replace(os.sep, '/')
+                if nome in self.ignorar:
+                    continue
+                with open(caminho, 'rb') as origem:
+                    conteudo = origem.read()
+
+                base, extensao = os.path.splitext(nome)
+                versionado = f'{base}.{hashlib.sha256(conteudo).hexdigest()[:12]}{extensao}'
+                versionados[nome] = versionado
+                ativos[versionado] = Ativo(nome, caminho, mimetypes.guess_type(nome)[0] or 'application/octet-stream',
+                                           self._comprimir(versionado, extensao, conteudo))
+                resumo.update(versionado.encode())
+        self.versionados, self.ativos = versionados, ativos
+        # Muda sempre que algum arquivo muda: nome do cache do service worker
+        self.versao = resumo.hexdigest()[:12]
+
+    def _comprimir(self, versionado, extensao, conteudo):
+        if extensao not in EXTENSOES_COMPRESSIVEIS or len(conteudo) < MINIMO_COMPRESSAO:
+            return {}
+
+        variantes = {}
+        for codificacao, sufixo, comprimir in _compressores():
+            destino = os.path.join(self.pasta_comprimidos, versionado + sufixo)
+            if not os.path.exists(destino):
+                dados = comprimir(conteudo)
+                if len(dados) >= len(conteudo):
+                    continue
+                # Vários workers podem subir juntos: grava em um temporário e renomeia
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                temporario = f'{destino}.{os.getpid()}.tmp'
+                with open(temporario, 'wb') as saida:
+                    saida.write(dados)
+                os.replace(temporario, destino)
+            variantes[codificacao] = destino
+        return variantes
+
+    def url(self, nome):
+        """Nome versionado para url_for('static'); arquivos fora do manifesto ficam como estão"""
+        return self.versionados.get(nome, nome)
+
+    def escolher(self, versionado, aceitas):
+        """
+        (ativo, caminho, codificação) da melhor variante que o cliente aceita
+        codificação é None para o arquivo original; retorna None se o nome não é versionado
+        """
+        ativo = self.ativos.get(versionado)
+        if ativo is None:
+            return None
+        for codificacao, caminho in ativo.variantes.items():
+            if codificacao in aceitas:
+                return ativo, caminho, codificacao
+        return ativo, ativo.caminho, None
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de conexões longas (agenda ao vivo)
+Abre N streams SSE ao mesmo tempo, conta quantos recebem o primeiro byte dentro
+do prazo e, com os streams ainda abertos, mede a latência de uma rota comum.
+Compara o modo síncrono (python app.py / gunicorn) com o modo gevent
+
+Uso:
+    python benchmark_conexoes.py --url http://localhost:5000 \\
+        --stream /profissional/1/agenda/eventos --sonda /barbearia/1/horarios \\
+        --conexoes 50 200 1000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def abrir_stream(servidor, porta, caminho, prazo):
+    """Abre um stream e espera o cabeçalho e o primeiro evento; retorna o writer ou None"""
+    try:
+        leitor, escritor = await asyncio.wait_for(asyncio.open_connection(servidor, porta), prazo)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    escritor.write(f'GET {caminho} HTTP/1.1\r\nHost: {servidor}\r\nAccept: text/event-stream\r\n\r\n'.encode())
+    try:
+        await asyncio.wait_for(leitor.readuntil(b'\n\n'), prazo)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        escritor.close()
+        return None
+    return escritor
+
+
+async def requisitar(servidor, porta, caminho, prazo):
+    """GET simples; retorna o tempo até a resposta em segundos ou None se estourou o prazo"""
+    inicio = time.perf_counter()
+    try:
+        leitor, escritor = await asyncio.wait_for(asyncio.open_connection(servidor, porta), prazo)
+        escritor.write(f'GET {caminho} HTTP/1.1\r\nHost: {servidor}\r\nConnection: close\r\n\r\n'.encode())
+        await asyncio.wait_for(leitor.read(), prazo)
+        escritor.close()
+    except (OSError, asyncio.TimeoutError):
+        return None
+    return time.perf_counter() - inicio
+
+
+async def rodada(url, stream, sonda, conexoes, prazo, amostras):
+    partes = urlsplit(url)
+    servidor, porta = partes.hostname, partes.port or 80
+    inicio = time.perf_counter()
+    escritores = await asyncio.gather(*[abrir_stream(servidor, porta, stream, prazo) for _ in range(conexoes)])
+    abertos = [escritor for escritor in escritores if escritor is not None]
+    abertura = time.perf_counter() - inicio
+
+    latencias = [await requisitar(servidor, porta, sonda, prazo) for _ in range(amostras)]
+    respondidas = sorted(latencia for latencia in latencias if latencia is not None)
+
+    for escritor in abertos:
+        escritor.close()
+    await asyncio.sleep(0.5)
+    return {
+        'conexoes': conexoes,
+        'abertas': len(abertos),
+        'abertura_s': abertura,
+        'sonda_ok': len(respondidas),
+        'sonda_p50_ms': statistics.median(respondidas) * 1000 if respondidas else None,
+        'sonda_max_ms': respondidas[-1] * 1000 if respondidas else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--stream', default='/profissional/1/agenda/eventos')
+    parser.add_argument('--sonda', default='/login')
+    parser.add_argument('--conexoes', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--prazo', type=float, default=5.0, help='Segundos de espera por conexão/resposta')
+    parser.add_argument('--amostras', type=int, default=20, help='Requisições de sonda por rodada')
+    args = parser.parse_args()
+
+    print(f'{"conexões":>9} {"abertas":>8} {"abertura":>9} {"sonda ok":>9} {"p50 ms":>8} {"máx ms":>8}')
+    for conexoes in args.conexoes:
+        resultado = asyncio.run(rodada(args.url, args.stream, args.sonda, conexoes, args.prazo, args.amostras))
+        p50 = f'{resultado["sonda_p50_ms"]:.1f}' if resultado['sonda_p50_ms'] is not None else '-'
+        maximo = f'{resultado["sonda_max_ms"]:.1f}' if resultado['sonda_max_ms'] is not None else '-'
+        print(f'{conexoes:>9} {resultado["abertas"]:>8} {resultado["abertura_s"]:>8.2f}s '
+              f'{resultado["sonda_ok"]:>4}/{args.amostras:<4} {p50:>8} {maximo:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,20 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///barbearia.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Pool de conexões (dimensione pelo número de workers x threads)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # Segundos esperando uma conexão livre
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # Renova conexões antes do timeout do servidor
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'  # Testa a conexão antes de usar
+    
+    # Réplicas de leitura (URLs separadas por vírgula) usadas pelas páginas somente leitura
+    SQLALCHEMY_REPLICAS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    REPLICA_ADERENCIA_SEGUNDOS = 10  # Após uma escrita, o usuário lê do principal por este tempo
+    
+    # Shards com os dados de cada dono de barbearias (URLs separadas por vírgula; vazio = sem sharding)
+    SQLALCHEMY_SHARDS = [url for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url]
+    
     # Configurações de desenvolvimento
     DEBUG = True
     TESTING = False
@@ -28,17 +42,90 @@ class Config:
     # Configurações de upload (se necessário no futuro)
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = 'uploads'
+    
+    # Configurações da agenda
+    INTERVALO_AGENDA_MINUTOS = 15  # Passo entre os horários oferecidos
+    CACHE_HORARIOS_TTL = 300  # Segundos que o calendário de cada barbearia fica em cache
+    OFERTA_LISTA_ESPERA_MINUTOS = 30  # Validade da vaga oferecida a quem está na lista de espera
+    LISTA_ESPERA_INTERVALO_EXPIRACAO = 60  # Segundos entre buscas (flask outbox) por ofertas vencidas sem resposta
+    
+    # Arquivamento do histórico (agendamentos realizados/cancelados saem da tabela quente)
+    ARQUIVAR_APOS_DIAS = 90  # Idade mínima do agendamento para ir ao arquivo
+    ARQUIVO_LOTE = 500  # Linhas movidas por transação
+    EXCLUSAO_LOTE = 500  # Linhas apagadas por transação ao excluir uma conta
+    
+    # Fila de tarefas em segundo plano (tabela tarefas + flask worker)
+    TAREFAS_BACKOFF_SEGUNDOS = 10  # Espera antes da 2ª tentativa; dobra a cada falha
+    TAREFAS_BACKOFF_MAXIMO = 3600  # Espera máxima entre tentativas
+    TAREFAS_TEMPO_LIMITE = 900  # Tarefa 'executando' há mais tempo que isso volta para a fila
+    TAREFAS_INTERVALO = 1.0  # Segundos entre consultas quando a fila está vazia
+    TAREFAS_INTERVALO_RECUPERACAO = 60  # Segundos entre buscas por tarefas travadas em cada worker
+    
+    # Lembretes de agendamento (flask lembretes)
+    LEMBRETES_ANTECEDENCIAS = [1440, 60]  # Minutos antes do horário (24h e 1h)
+    LEMBRETES_JANELA_SEGUNDOS = 300  # Período carregado do banco de cada vez
+    LEMBRETES_LOTE = 500  # Mensagens por lote enviado
+    LEMBRETES_ENVIADOR = os.environ.get('LEMBRETES_ENVIADOR', 'arquivo')  # 'smtp' ou 'arquivo'
+    LEMBRETES_ARQUIVO = os.environ.get('LEMBRETES_ARQUIVO', 'lembretes.jsonl')  # Dentro da pasta instance
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'localhost')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 1025))
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '0') == '1'
+    MAIL_REMETENTE = os.environ.get('MAIL_REMETENTE', 'Barbearia App <nao-responda@localhost>')
+    
+    # Outbox de eventos de agendamento (flask outbox)
+    OUTBOX_LOTE = 100  # Eventos publicados por passada em cada banco
+    OUTBOX_INTERVALO = 0.5  # Segundos de espera quando não há eventos
+    OUTBOX_MAX_TENTATIVAS = 10  # Depois disso o evento é descartado (fica registrado com o erro)
+    
+    # Webhooks das barbearias (flask webhooks)
+    WEBHOOKS_CARGA = 500  # Entregas pendentes lidas por passada em cada banco
+    WEBHOOKS_LOTE_POR_ENDPOINT = 50  # Eventos enviados em um único POST
+    WEBHOOKS_LIMITE_POR_ENDPOINT = 2  # Requisições simultâneas para o mesmo endpoint
+    WEBHOOKS_TEMPO_LIMITE = 10  # Segundos de espera pela resposta do endpoint
+    WEBHOOKS_BACKOFF_SEGUNDOS = 30  # Espera antes da 2ª tentativa; dobra a cada falha
+    WEBHOOKS_BACKOFF_MAXIMO = 3600  # Espera máxima entre tentativas
+    WEBHOOKS_MAX_TENTATIVAS = 8  # Depois disso a entrega fica como 'falhou'
+    WEBHOOKS_INTERVALO = 1.0  # Segundos entre consultas quando não há entregas
+    
+    # Agenda ao vivo (Server-Sent Events)
+    AGENDA_AO_VIVO_INTERVALO = 1.0  # Segundos entre leituras da outbox (uma thread por processo)
+    AGENDA_AO_VIVO_BATIMENTO = 15  # Comentário enviado para manter a conexão aberta em proxies
+    AGENDA_AO_VIVO_DURACAO = 300  # Segundos de cada conexão; o navegador reconecta sozinho
+    AGENDA_AO_VIVO_HISTORICO = 500  # Eventos guardados para quem reconecta com Last-Event-ID
+    AGENDA_AO_VIVO_ESPERA_LACUNAS = 30  # Segundos procurando um id pulado (transação ainda sem commit)
+    GEVENT_CONEXOES = int(os.environ.get('GEVENT_CONEXOES', 5000))  # Conexões simultâneas por processo no modo gevent
+    
+    # Templates (Jinja)
+    TEMPLATES_AUTO_RELOAD = None  # None segue o DEBUG: confere a data dos arquivos a cada render
+    JINJA_CACHE_BYTECODE = os.environ.get('JINJA_CACHE_BYTECODE', '1') == '1'  # Guarda os templates compilados em disco
+    JINJA_CACHE_PASTA = os.environ.get('JINJA_CACHE_PASTA', 'jinja_cache')  # Dentro da pasta instance
+    CACHE_FRAGMENTOS_TAMANHO = int(os.environ.get('CACHE_FRAGMENTOS_TAMANHO', 2000))  # Blocos {% cache %} por processo; 0 desliga
+    CACHE_FRAGMENTOS_TTL = 3600  # Segundos; a chave já muda a cada escrita, isto cobre escritas fora do ORM
+    CACHE_ADMIN_TTL = 60  # Segundos que as contagens do painel admin (todos os shards) ficam em cache
+    
+    # Arquivos estáticos e compressão
+    ATIVOS_VERSIONADOS = os.environ.get('ATIVOS_VERSIONADOS', '1') == '1'  # URLs com hash do conteúdo e cache imutável
+    ATIVOS_PASTA = 'ativos'  # Versões .br/.gz dos arquivos estáticos, dentro da pasta instance
+    COMPRESSAO_DINAMICA = os.environ.get('COMPRESSAO_DINAMICA', '1') == '1'  # gzip das páginas e respostas JSON
+    COMPRESSAO_NIVEL = 6  # 1 (rápido) a 9 (menor)
+    COMPRESSAO_MINIMO = 500  # Bytes; respostas menores vão sem compressão
 
 class DevelopmentConfig(Config):
     """Configurações para ambiente de desenvolvimento"""
     DEBUG = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///barbearia.db'
+    ATIVOS_VERSIONADOS = os.environ.get('ATIVOS_VERSIONADOS', '0') == '1'  # Arquivos editados aparecem sem reiniciar
 
 class ProductionConfig(Config):
     """Configurações para ambiente de produção"""
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SECRET_KEY = os.environ.get('SECRET_KEY')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    TEMPLATES_AUTO_RELOAD = False  # Templates só mudam com um novo deploy
 
 class TestingConfig(Config):
     """Configurações para testes"""
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Exclusão de dados em lotes
+Apaga grandes volumes com DELETE ... WHERE id IN (...) em transações curtas,
+sem carregar os objetos na sessão
+"""
+
+import time
+
+from sqlalchemy import delete, select
+
+
+def apagar_em_lotes(engine, tabela, filtro, lote=500, pausa=0.0):
+    """
+    Apaga as linhas de 'tabela' que atendem 'filtro', 'lote' por transação
+    Retorna o total de linhas apagadas
+    """
+    total = 0
+    while True:
+        with engine.begin() as conexao:
+            ids = conexao.execute(select(tabela.c.id).where(filtro).limit(lote)).scalars().all()
+            if ids:
+                conexao.execute(delete(tabela).where(tabela.c.id.in_(ids)))
+
+        total += len(ids)
+        if len(ids) < lote:
+            return total
+        if pausa:
+            time.sleep(pausa)
+
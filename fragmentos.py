@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Cache de fragmentos de template
+A tag {% cache 'nome', dono_id, versao %}...{% endcache %} guarda o HTML do bloco
+em memória; a chave leva o dono e a versão dos dados dele (incrementada a cada
+escrita nas tabelas exibidas), então um bloco alterado nunca é servido velho e
+um bloco inalterado não roda nem as consultas nem a renderização
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+class CacheFragmentos:
+    """
+    LRU em memória com validade por entrada (tamanho 0 desliga o cache)
+    A validade é só uma rede de segurança para escritas que não passam pelo ORM
+    """
+
+    def __init__(self, tamanho=2000, ttl=3600):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            if item[1] <= time.monotonic():
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return item[0]
+
+    def guardar(self, chave, valor, ttl=None):
+        with self._lock:
+            self._itens[chave] = (valor, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+
+    def obter_ou_calcular(self, chave, calcular, ttl=None):
+        valor = self.obter(chave)
+        if valor is None:
+            valor = calcular()
+            self.guardar(chave, valor, ttl)
+        return valor
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+
+class ExtensaoFragmentos(Extension):
+    """
+    Tag {% cache chave, ... %}{% endcache %} (exemplo de extensão da documentação do Jinja)
+    O cache usado é environment.cache_fragmentos; sem ele o bloco é sempre renderizado
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(cache_fragmentos=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        partes = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            partes.append(parser.parse_expression())
+        corpo = parser.parse_statements(['name:endcache'], drop_needle=True)
+        # Template e linha identificam o bloco: o mesmo nome pode aparecer em templates diferentes
+        origem = nodes.Const(f'{parser.name}:{lineno}')
+        return nodes.CallBlock(self.call_method('_renderizar', [origem, nodes.List(partes)]),
+                               [], [], corpo).set_lineno(lineno)
+
+    def _renderizar(self, origem, partes, caller):
+        cache = self.environment.cache_fragmentos
+        if cache is None:
+            return caller()
+        return cache.obter_ou_calcular((origem, *partes), caller)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Configuração do gunicorn para produção
+Uso: gunicorn -c gunicorn.conf.py wsgi:app
+
+Variáveis de ambiente:
+    PORT                  porta (padrão 5000)
+    WEB_CONCURRENCY       processos workers (padrão 2 x CPUs + 1)
+    GUNICORN_THREADS      threads por worker no modo gthread (padrão 4)
+    GUNICORN_WORKER_CLASS gthread (padrão) ou gevent, para muitas agendas ao vivo
+    GEVENT_CONEXOES       conexões simultâneas por worker no modo gevent (padrão em config.py)
+"""
+
+import gc
+import multiprocessing
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    # Com preload o app é importado no mestre: o patch precisa vir antes dele
+    from gevent import monkey
+    monkey.patch_all()
+
+from config import Config
+
+bind = os.getenv('GUNICORN_BIND', f'0.0.0.0:{os.getenv("PORT", "5000")}')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = Config.GEVENT_CONEXOES
+
+# Carrega o app uma vez no mestre e cria os workers por fork (copy-on-write)
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# Recicla os workers aos poucos para conter vazamentos de memória
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+# Sem coletas durante a importação do app: menos páginas tocadas antes do fork
+gc.disable()
+
+
+def when_ready(server):
+    # Move os objetos do app para a geração permanente: a coleta dos workers não
+    # os percorre nem escreve nos cabeçalhos deles, então as páginas continuam compartilhadas
+    gc.freeze()
+    server.log.info('App carregado no mestre; %s objetos congelados', gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    from wsgi import reiniciar_conexoes
+    reiniciar_conexoes()
+    gc.enable()
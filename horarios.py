@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Calendário de funcionamento das barbearias
+Converte dias_funcionamento e os horários de abertura/fechamento em uma
+agenda semanal já interpretada, com exceções (feriados e horários especiais)
+"""
+
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+
+def interpretar_dias(dias_funcionamento):
+    """
+    Converte a string '1,2,3,4,5,6' em um conjunto de dias da semana
+    (1=Segunda, 7=Domingo, mesmo padrão de date.isoweekday())
+    """
+    dias = set()
+    for parte in (dias_funcionamento or '').split(','):
+        parte = parte.strip()
+        if parte.isdigit() and 1 <= int(parte) <= 7:
+            dias.add(int(parte))
+    return frozenset(dias)
+
+
+class ExcecaoDia:
+    """
+    Exceção de funcionamento para uma data específica
+    fechado=True indica feriado; caso contrário vale o horário especial
+    """
+
+    __slots__ = ('data', 'fechado', 'abertura', 'fechamento', 'descricao')
+
+    def __init__(self, data, fechado=True, abertura=None, fechamento=None, descricao=None):
+        self.data = data
+        self.fechado = fechado or abertura is None or fechamento is None
+        self.abertura = abertura
+        self.fechamento = fechamento
+        self.descricao = descricao
+
+    def para_dict(self):
+        return {
+            'data': self.data.isoformat(),
+            'fechado': self.fechado,
+            'abertura': None if self.fechado else self.abertura.strftime('%H:%M'),
+            'fechamento': None if self.fechado else self.fechamento.strftime('%H:%M'),
+            'descricao': self.descricao
+        }
+
+
+class HorarioSemanal:
+    """
+    Agenda semanal de uma barbearia, interpretada uma única vez
+    Responde se a loja está aberta em um dia/horário sem reprocessar strings
+    """
+
+    def __init__(self, dias, abertura, fechamento, excecoes=()):
+        self.dias = frozenset(dias)
+        self.abertura = abertura
+        self.fechamento = fechamento
+        self.excecoes = {excecao.data: excecao for excecao in excecoes}
+
+    @classmethod
+    def da_barbearia(cls, barbearia, excecoes=()):
+        """Monta a agenda a partir de uma Barbearia e de suas ExcecaoHorario"""
+        return cls(
+            interpretar_dias(barbearia.dias_funcionamento),
+            barbearia.horario_abertura,
+            barbearia.horario_fechamento,
+            [ExcecaoDia(e.data, e.fechado, e.horario_abertura, e.horario_fechamento, e.descricao)
+             for e in excecoes]
+        )
+
+    def expediente(self, dia):
+        """
+        Retorna (inicio, fim) do expediente na data informada
+        ou None se a barbearia não abre nesse dia
+        """
+        if isinstance(dia, datetime):
+            dia = dia.date()
+
+        excecao = self.excecoes.get(dia)
+        if excecao is not None:
+            if excecao.fechado:
+                return None
+            abertura, fechamento = excecao.abertura, excecao.fechamento
+        elif dia.isoweekday() in self.dias and self.abertura and self.fechamento:
+            abertura, fechamento = self.abertura, self.fechamento
+        else:
+            return None
+
+        if fechamento <= abertura:
+            return None
+        return datetime.combine(dia, abertura), datetime.combine(dia, fechamento)
+
+    def comporta(self, inicio, duracao):
+        """Verifica se um atendimento de 'duracao' minutos cabe no expediente"""
+        janela = self.expediente(inicio)
+        if janela is None:
+            return False
+        fim = inicio + timedelta(minutes=duracao)
+        return janela[0] <= inicio and fim <= janela[1]
+
+    def para_dict(self, inicio=None, dias=30):
+        """
+        Representação em JSON consumida pelo front-end
+        Inclui a semana padrão e o expediente já resolvido dos próximos dias
+        """
+        inicio = inicio or date.today()
+        calendario = {}
+        for deslocamento in range(dias):
+            dia = inicio + timedelta(days=deslocamento)
+            janela = self.expediente(dia)
+            calendario[dia.isoformat()] = None if janela is None else {
+                'abertura': janela[0].strftime('%H:%M'),
+                'fechamento': janela[1].strftime('%H:%M')
+            }
+
+        return {
+            'dias_funcionamento': sorted(self.dias),
+            'abertura': self.abertura.strftime('%H:%M') if self.abertura else None,
+            'fechamento': self.fechamento.strftime('%H:%M') if self.fechamento else None,
+            'excecoes': [excecao.para_dict() for data_excecao, excecao in sorted(self.excecoes.items())
+                         if data_excecao >= inicio],
+            'calendario': calendario
+        }
+
+
+class CacheHorarios:
+    """
+    Cache em memória das agendas semanais por barbearia
+    As entradas expiram após 'ttl' segundos para que outros processos
+    também enxerguem alterações feitas fora deste worker; quem informa a
+    versão dos dados da barbearia recarrega assim que ela muda
+    """
+
+    def __init__(self, carregar, ttl=300):
+        self._carregar = carregar
+        self._ttl = ttl
+        self._itens = {}
+        self._lock = threading.Lock()
+
+    def obter(self, barbearia_id, versao=None):
+        agora = time.monotonic()
+        item = self._itens.get(barbearia_id)
+        if item is not None and item[1] > agora and (versao is None or item[2] == versao):
+            return item[0]
+
+        horario = self._carregar(barbearia_id)
+        if horario is not None:
+            with self._lock:
+                self._itens[barbearia_id] = (horario, agora + self._ttl, versao)
+        return horario
+
+    def invalidar(self, barbearia_id=None):
+        with self._lock:
+            if barbearia_id is None:
+                self._itens.clear()
+            else:
+                self._itens.pop(barbearia_id, None)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Envio de lembretes de agendamento
+Os lembretes que vencem na próxima janela são carregados de uma vez (consulta
+por faixa no índice de enviar_em) para um heap ordenado pelo horário de envio;
+os vencidos saem do heap em lotes para o enviador configurado
+"""
+
+import heapq
+import itertools
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# chave identifica o lembrete para marcá-lo como enviado depois do lote
+Mensagem = namedtuple('Mensagem', 'chave destinatario assunto corpo')
+
+
+class EnviadorArquivo:
+    """Grava cada mensagem como uma linha JSON (desenvolvimento e testes)"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def enviar_lote(self, mensagens):
+        with open(self.caminho, 'a', encoding='utf-8') as arquivo:
+            for mensagem in mensagens:
+                arquivo.write(json.dumps({
+                    'para': mensagem.destinatario,
+                    'assunto': mensagem.assunto,
+                    'corpo': mensagem.corpo
+                }, ensure_ascii=False) + '\n')
+        return [mensagem.chave for mensagem in mensagens]
+
+
+class EnviadorSMTP:
+    """
+    Envia por SMTP usando uma única conexão por lote
+    Para depurar localmente: python -m aiosmtpd -n -l localhost:1025
+    """
+
+    def __init__(self, servidor, porta, remetente, usuario=None, senha=None, tls=False):
+        self.servidor = servidor
+        self.porta = porta
+        self.remetente = remetente
+        self.usuario = usuario
+        self.senha = senha
+        self.tls = tls
+
+    def enviar_lote(self, mensagens):
+        # Importados aqui: só o enviador SMTP precisa deles
+        import smtplib
+        from email.message import EmailMessage
+
+        enviadas = []
+        with smtplib.SMTP(self.servidor, self.porta, timeout=30) as smtp:
+            if self.tls:
+                smtp.starttls()
+            if self.usuario:
+                smtp.login(self.usuario, self.senha)
+            for mensagem in mensagens:
+                email = EmailMessage()
+                email['From'] = self.remetente
+                email['To'] = mensagem.destinatario
+                email['Subject'] = mensagem.assunto
+                email.set_content(mensagem.corpo)
+                try:
+                    smtp.send_message(email)
+                    enviadas.append(mensagem.chave)
+                except smtplib.SMTPRecipientsRefused:
+                    logger.warning('Destinatário recusado: %s', mensagem.destinatario)
+        return enviadas
+
+
+class AgendadorLembretes:
+    """
+    Heap de lembretes ordenado por horário de envio
+
+    carregar(ate)       -- lembretes não enviados com envio antes de 'ate':
+                           lista de (enviar_em, Mensagem)
+    marcar_enviados(ch) -- grava como enviados os lembretes com essas chaves
+    enviador            -- objeto com enviar_lote(mensagens) -> chaves enviadas
+    """
+
+    def __init__(self, carregar, marcar_enviados, enviador, janela=timedelta(minutes=5), lote=500):
+        self.carregar = carregar
+        self.marcar_enviados = marcar_enviados
+        self.enviador = enviador
+        self.janela = janela
+        self.lote = lote
+        self._heap = []
+        self._no_heap = set()
+        self._sequencia = itertools.count()
+        self._carregado_ate = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def ciclo(self, agora=None):
+        """
+        Recarrega a janela se necessário e envia tudo que já venceu
+        Retorna quantos segundos esperar até o próximo ciclo
+        """
+        agora = agora or datetime.now()
+        if self._carregado_ate is None or agora >= self._carregado_ate:
+            self._recarregar(agora)
+
+        while self._heap and self._heap[0][0] <= agora:
+            lote = []
+            while self._heap and self._heap[0][0] <= agora and len(lote) < self.lote:
+                enviar_em, indice, mensagem = heapq.heappop(self._heap)
+                self._no_heap.discard(mensagem.chave)
+                lote.append(mensagem)
+            self._despachar(lote)
+
+        proximo = min(self._carregado_ate, self._heap[0][0]) if self._heap else self._carregado_ate
+        return max((proximo - agora).total_seconds(), 0.1)
+
+    def executar(self, parar):
+        """Repete os ciclos até 'parar' (threading.Event) ser sinalizado"""
+        while not parar.is_set():
+            try:
+                espera = self.ciclo()
+            except Exception:
+                logger.exception('Falha no ciclo de lembretes')
+                espera = self.janela.total_seconds()
+            parar.wait(espera)
+
+    def _recarregar(self, agora):
+        # Sem limite inferior: lembretes atrasados (ex.: criados depois da última carga) também entram
+        self._carregado_ate = agora + self.janela
+        for enviar_em, mensagem in self.carregar(self._carregado_ate):
+            if mensagem.chave not in self._no_heap:
+                self._no_heap.add(mensagem.chave)
+                heapq.heappush(self._heap, (enviar_em, next(self._sequencia), mensagem))
+
+    def _despachar(self, mensagens):
+        try:
+            enviadas = self.enviador.enviar_lote(mensagens)
+        except Exception:
+            # Continuam pendentes no banco e voltam na próxima carga
+            logger.exception('Falha ao enviar lote de %s lembretes', len(mensagens))
+            return
+        if enviadas:
+            self.marcar_enviados(enviadas)
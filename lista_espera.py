@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Lista de espera por profissional/dia
+Escolhe qual cliente em espera deve receber uma vaga liberada por cancelamento.
+As filas ficam em memória no processo que publica os eventos (flask outbox):
+cada fila é lida do banco uma vez e depois acompanha os eventos da lista de espera
+"""
+
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+# janela_inicio/janela_fim são datetimes do período aceito pelo cliente
+PedidoEspera = namedtuple('PedidoEspera', 'id duracao janela_inicio janela_fim')
+
+MINUTOS_DIA = 24 * 60
+FOLHAS = 1 << (MINUTOS_DIA - 1).bit_length()  # Folhas da árvore: uma por minuto do dia
+
+
+def _minutos(momento):
+    """Minutos desde a meia-noite (uma fila só tem janelas do seu dia)"""
+    return momento.hour * 60 + momento.minute + momento.second / 60
+
+
+def _cabe_na_janela(pedido):
+    return pedido.janela_inicio + timedelta(minutes=pedido.duracao) <= pedido.janela_fim
+
+
+class _JanelasPorInicio:
+    """
+    Pedidos de uma mesma duração em uma árvore de segmentos sobre o minuto de
+    início da janela; cada nó guarda o maior fim de janela do seu intervalo
+    """
+
+    def __init__(self):
+        self._folhas = {}  # minuto de início -> {id: pedido}
+        self._fins = [-1] * (2 * FOLHAS)
+
+    def __bool__(self):
+        return bool(self._folhas)
+
+    def adicionar(self, pedido):
+        minuto = int(_minutos(pedido.janela_inicio))
+        self._folhas.setdefault(minuto, {})[pedido.id] = pedido
+        self._atualizar(minuto)
+
+    def remover(self, pedido):
+        minuto = int(_minutos(pedido.janela_inicio))
+        folha = self._folhas[minuto]
+        del folha[pedido.id]
+        if not folha:
+            del self._folhas[minuto]
+        self._atualizar(minuto)
+
+    def _atualizar(self, minuto):
+        no = FOLHAS + minuto
+        self._fins[no] = max((_minutos(pedido.janela_fim) for pedido in self._folhas.get(minuto, {}).values()),
+                             default=-1)
+        no //= 2
+        while no:
+            self._fins[no] = max(self._fins[2 * no], self._fins[2 * no + 1])
+            no //= 2
+
+    def primeiro(self, inicio_maximo, fim_minimo):
+        """
+        Pedido de janela mais cedo (no mesmo minuto, o mais antigo) que começa até
+        'inicio_maximo' e termina a partir de 'fim_minimo', em minutos; None se não houver
+        """
+        if inicio_maximo < 0:
+            return None
+        minuto = self._mais_a_esquerda(1, 0, FOLHAS, min(int(inicio_maximo), MINUTOS_DIA - 1), fim_minimo)
+        if minuto is None:
+            return None
+        return min((pedido for pedido in self._folhas[minuto].values() if _minutos(pedido.janela_fim) >= fim_minimo),
+                   key=lambda pedido: pedido.id)
+
+    def _mais_a_esquerda(self, no, esquerda, direita, limite, fim_minimo):
+        # Só os nós cortados por 'limite' descem pelos dois lados: O(log n)
+        if esquerda > limite or self._fins[no] < fim_minimo:
+            return None
+        if direita - esquerda == 1:
+            return esquerda
+        meio = (esquerda + direita) // 2
+        minuto = self._mais_a_esquerda(2 * no, esquerda, meio, limite, fim_minimo)
+        if minuto is None:
+            minuto = self._mais_a_esquerda(2 * no + 1, meio, direita, limite, fim_minimo)
+        return minuto
+
+
+class FilaEspera:
+    """
+    Pedidos em espera de um dia, separados pela duração do serviço
+    O melhor encaixe é o pedido de maior duração que cabe na vaga; entre os de
+    mesma duração, o de janela mais cedo e depois o mais antigo. Um pedido de
+    duração d cabe na vaga [inicio, fim) quando a janela começa até fim - d e
+    termina a partir de inicio + d: uma busca O(log n) na árvore de cada
+    duração, da maior para a menor (as durações são as dos serviços, poucas)
+    """
+
+    def __init__(self, pedidos=()):
+        self._pedidos = {}
+        self._por_duracao = {}
+        self._duracoes = []  # Durações com pedidos, em ordem
+        for pedido in pedidos:
+            self.adicionar(pedido)
+
+    def __len__(self):
+        return len(self._pedidos)
+
+    def __contains__(self, pedido_id):
+        return pedido_id in self._pedidos
+
+    def adicionar(self, pedido):
+        """Inclui o pedido (ou substitui o de mesmo id)"""
+        self.remover(pedido.id)
+        self._pedidos[pedido.id] = pedido
+        if not _cabe_na_janela(pedido):
+            # O serviço não cabe na janela escolhida: nenhuma vaga serve
+            return
+        if pedido.duracao not in self._por_duracao:
+            self._por_duracao[pedido.duracao] = _JanelasPorInicio()
+            insort(self._duracoes, pedido.duracao)
+        self._por_duracao[pedido.duracao].adicionar(pedido)
+
+    def remover(self, pedido_id):
+        """Retira o pedido se estiver na fila; retorna o pedido ou None"""
+        pedido = self._pedidos.pop(pedido_id, None)
+        if pedido is not None and _cabe_na_janela(pedido):
+            janelas = self._por_duracao[pedido.duracao]
+            janelas.remover(pedido)
+            if not janelas:
+                del self._por_duracao[pedido.duracao]
+                del self._duracoes[bisect_left(self._duracoes, pedido.duracao)]
+        return pedido
+
+    def encaixar(self, vaga_inicio, vaga_fim):
+        """
+        Retira da fila o pedido que melhor aproveita a vaga [vaga_inicio, vaga_fim)
+        Retorna (pedido, inicio_oferecido) ou None se ninguém couber
+        """
+        meia_noite = datetime.combine(vaga_inicio.date(), time())
+        inicio = (vaga_inicio - meia_noite).total_seconds() / 60
+        fim = (vaga_fim - meia_noite).total_seconds() / 60
+        for duracao in reversed(self._duracoes[:bisect_right(self._duracoes, fim - inicio)]):
+            pedido = self._por_duracao[duracao].primeiro(fim - duracao, inicio + duracao)
+            if pedido is not None:
+                self.remover(pedido.id)
+                return pedido, max(vaga_inicio, pedido.janela_inicio)
+        return None
+
+
+class FilasEspera:
+    """
+    Uma FilaEspera por (profissional, dia), criada na primeira vaga do par
+
+    carregar -- função (profissional_id, dia) -> (pedidos em espera, marca);
+                'marca' é o último evento já refletido na leitura, e eventos
+                até ela são ignorados para aquela fila
+    """
+
+    def __init__(self, carregar):
+        self._carregar = carregar
+        self._filas = {}
+        self._lock = threading.Lock()
+
+    def fila(self, profissional_id, dia):
+        with self._lock:
+            chave = (profissional_id, dia)
+            if chave not in self._filas:
+                # Dias que já passaram não recebem mais vagas; os futuros continuam em memória
+                hoje = date.today()
+                for antiga in [antiga for antiga in self._filas if antiga[1] < hoje]:
+                    del self._filas[antiga]
+                pedidos, marca = self._carregar(profissional_id, dia)
+                self._filas[chave] = (FilaEspera(pedidos), marca)
+            return self._filas[chave][0]
+
+    def aplicar(self, evento_id, profissional_id, dia, pedido_id, pedido=None):
+        """
+        Reflete um evento da lista de espera: 'pedido' entra (ou é atualizado)
+        na fila, ou sai dela se for None. Filas ainda não lidas são ignoradas
+        """
+        with self._lock:
+            fila, marca = self._filas.get((profissional_id, dia), (None, None))
+            if fila is None or evento_id <= marca:
+                return
+            if pedido is None:
+                fila.remover(pedido_id)
+            else:
+                fila.adicionar(pedido)
+
+    def limpar(self):
+        with self._lock:
+            self._filas.clear()
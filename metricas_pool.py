@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de conexões instrumentado
+Mede quanto tempo cada requisição espera por uma conexão e registra quando
+o pool se esgota, para dimensionar pool_size/max_overflow pelo número de workers.
+Abrir uma conexão nova (overflow ou reposição) é medido à parte: é latência do
+banco, não falta de conexões livres
+"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Limites (em segundos) das faixas do histograma de espera
+FAIXAS_ESPERA = (0.001, 0.01, 0.1, 1.0)
+
+# Esperas acima deste valor indicam que todas as conexões estavam em uso
+ESPERA_LENTA = 0.01
+
+
+class MetricasPool:
+    """Contadores de espera por conexão de um pool (por processo)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.esperas_lentas = 0
+        self.esgotamentos = 0
+        self.histograma = [0] * (len(FAIXAS_ESPERA) + 1)
+        self.conexoes_novas = 0
+        self.conexao_total = 0.0
+
+    def registrar_espera(self, segundos):
+        faixa = next((i for i, limite in enumerate(FAIXAS_ESPERA) if segundos < limite), len(FAIXAS_ESPERA))
+        with self._lock:
+            self.checkouts += 1
+            self.espera_total += segundos
+            self.espera_maxima = max(self.espera_maxima, segundos)
+            self.histograma[faixa] += 1
+            if segundos >= ESPERA_LENTA:
+                self.esperas_lentas += 1
+
+    def registrar_conexao(self, segundos):
+        with self._lock:
+            self.conexoes_novas += 1
+            self.conexao_total += segundos
+
+    def registrar_esgotamento(self):
+        with self._lock:
+            self.esgotamentos += 1
+
+    def para_dict(self):
+        with self._lock:
+            rotulos = [f'<{int(limite * 1000)}ms' for limite in FAIXAS_ESPERA] + [f'>={int(FAIXAS_ESPERA[-1] * 1000)}ms']
+            return {
+                'checkouts': self.checkouts,
+                'espera_media_ms': round(self.espera_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'espera_maxima_ms': round(self.espera_maxima * 1000, 3),
+                'esperas_lentas': self.esperas_lentas,
+                'esgotamentos': self.esgotamentos,
+                'histograma': dict(zip(rotulos, self.histograma)),
+                'conexoes_novas': self.conexoes_novas,
+                'conexao_media_ms': round(self.conexao_total / self.conexoes_novas * 1000, 3) if self.conexoes_novas else 0.0
+            }
+
+
+class PoolInstrumentado(QueuePool):
+    """
+    QueuePool que mede o tempo de checkout e conta os timeouts por falta de conexão
+    A espera registrada exclui o tempo de abrir conexões novas dentro do checkout
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metricas = MetricasPool()
+        # Por thread: o QueuePool chama _do_get de novo em algumas disputas, e só a chamada externa mede
+        self._checkout_local = threading.local()
+
+    def recreate(self):
+        novo = super().recreate()
+        novo.metricas = self.metricas
+        return novo
+
+    def _do_get(self):
+        local = self._checkout_local
+        if getattr(local, 'medindo', False):
+            return super()._do_get()
+
+        local.medindo, local.conectando = True, 0.0
+        inicio = time.perf_counter()
+        try:
+            conexao = super()._do_get()
+        except PoolTimeoutError:
+            self.metricas.registrar_esgotamento()
+            logger.warning('Pool de conexões esgotado: %s', self.status())
+            raise
+        finally:
+            local.medindo = False
+        self.metricas.registrar_espera(time.perf_counter() - inicio - local.conectando)
+        return conexao
+
+    def _create_connection(self):
+        inicio = time.perf_counter()
+        conexao = super()._create_connection()
+        segundos = time.perf_counter() - inicio
+        self.metricas.registrar_conexao(segundos)
+        if getattr(self._checkout_local, 'medindo', False):
+            self._checkout_local.conectando += segundos
+        return conexao
+
+    def situacao(self):
+        """Estado atual do pool junto com as métricas acumuladas"""
+        return dict(
+            self.metricas.para_dict(),
+            tamanho=self.size(),
+            em_uso=self.checkedout(),
+            livres=self.checkedin(),
+            overflow=self.overflow()
+        )
+
+
+def opcoes_engine(config, uri=None):
+    """
+    Monta as opções de engine a partir das chaves DB_POOL_* da configuração
+    O SQLite em memória usa um pool estático e fica com as opções padrão
+    """
+    uri = uri or config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri):
+        return {}
+
+    return {
+        'poolclass': PoolInstrumentado,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING']
+    }
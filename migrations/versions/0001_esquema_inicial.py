@@ -0,0 +1,96 @@
+"""esquema inicial: usuários, barbearias, profissionais, serviços e agendamentos
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-19 09:00:00.000000
+
+Bancos criados antes das migrações (db.create_all) já têm estas tabelas:
+o app marca esta revisão neles (stamp) antes de aplicar as seguintes.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nome', sa.String(length=100), nullable=False),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('password', sa.String(length=255), nullable=False),
+    sa.Column('telefone', sa.String(length=20), nullable=True),
+    sa.Column('tipo', sa.String(length=20), nullable=True),
+    sa.Column('ativo', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email')
+    )
+    op.create_table('barbearias',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nome', sa.String(length=100), nullable=False),
+    sa.Column('endereco', sa.Text(), nullable=True),
+    sa.Column('telefone', sa.String(length=20), nullable=True),
+    sa.Column('email', sa.String(length=120), nullable=True),
+    sa.Column('horario_abertura', sa.Time(), nullable=True),
+    sa.Column('horario_fechamento', sa.Time(), nullable=True),
+    sa.Column('dias_funcionamento', sa.String(length=50), nullable=True),
+    sa.Column('ativo', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('profissionais',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nome', sa.String(length=100), nullable=False),
+    sa.Column('especialidade', sa.String(length=100), nullable=True),
+    sa.Column('telefone', sa.String(length=20), nullable=True),
+    sa.Column('email', sa.String(length=120), nullable=True),
+    sa.Column('ativo', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('barbearia_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['barbearia_id'], ['barbearias.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('servicos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nome', sa.String(length=100), nullable=False),
+    sa.Column('descricao', sa.Text(), nullable=True),
+    sa.Column('preco', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('duracao', sa.Integer(), nullable=False),
+    sa.Column('ativo', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('barbearia_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['barbearia_id'], ['barbearias.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('agendamentos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('data_hora', sa.DateTime(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('observacoes', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('cliente_id', sa.Integer(), nullable=False),
+    sa.Column('profissional_id', sa.Integer(), nullable=False),
+    sa.Column('servico_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['cliente_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['profissional_id'], ['profissionais.id'], ),
+    sa.ForeignKeyConstraint(['servico_id'], ['servicos.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('agendamentos')
+    op.drop_table('servicos')
+    op.drop_table('profissionais')
+    op.drop_table('barbearias')
+    op.drop_table('users')
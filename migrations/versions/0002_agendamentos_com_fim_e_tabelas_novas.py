@@ -0,0 +1,282 @@
+"""agendamentos com fim, exclusão de contas e tabelas novas
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:30:00.000000
+
+Antes das migrações o app criava as tabelas que faltavam com db.create_all ao
+iniciar, mas nunca as colunas novas: um banco pode já ter parte das tabelas
+abaixo sem ter agendamentos.data_hora_fim ou users.excluido_em. Por isso cada
+passo confere o que já existe.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# IDs das tabelas de tenant (carregam o dono nos bits altos, ver shards.py)
+IdTenant = sa.BigInteger().with_variant(sa.Integer(), 'sqlite')
+
+RESTRICAO_SOBREPOSICAO = 'agendamentos_sem_sobreposicao'
+COLUNAS_HISTORICO = ('id, data_hora, data_hora_fim, status, observacoes, created_at, '
+                     'cliente_id, profissional_id, servico_id, serie_id')
+
+
+def _existentes():
+    inspetor = sa.inspect(op.get_bind())
+    return inspetor, set(inspetor.get_table_names())
+
+
+def _colunas(inspetor, tabela):
+    return {coluna['name'] for coluna in inspetor.get_columns(tabela)}
+
+
+def _criar_tabelas(existentes):
+    if 'series_agendamento' not in existentes:
+        op.create_table('series_agendamento',
+        sa.Column('id', IdTenant, nullable=False),
+        sa.Column('regra', sa.String(length=255), nullable=False),
+        sa.Column('data_inicio', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('cliente_id', sa.Integer(), nullable=False),
+        sa.Column('profissional_id', IdTenant, nullable=False),
+        sa.Column('servico_id', IdTenant, nullable=False),
+        sa.ForeignKeyConstraint(['cliente_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['profissional_id'], ['profissionais.id'], ),
+        sa.ForeignKeyConstraint(['servico_id'], ['servicos.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'excecoes_horario' not in existentes:
+        op.create_table('excecoes_horario',
+        sa.Column('id', IdTenant, nullable=False),
+        sa.Column('data', sa.Date(), nullable=False),
+        sa.Column('fechado', sa.Boolean(), nullable=True),
+        sa.Column('horario_abertura', sa.Time(), nullable=True),
+        sa.Column('horario_fechamento', sa.Time(), nullable=True),
+        sa.Column('descricao', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('barbearia_id', IdTenant, nullable=False),
+        sa.ForeignKeyConstraint(['barbearia_id'], ['barbearias.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('barbearia_id', 'data', name='uq_excecao_barbearia_data')
+        )
+    if 'lista_espera' not in existentes:
+        op.create_table('lista_espera',
+        sa.Column('id', IdTenant, nullable=False),
+        sa.Column('data', sa.Date(), nullable=False),
+        sa.Column('janela_inicio', sa.Time(), nullable=False),
+        sa.Column('janela_fim', sa.Time(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('oferta_inicio', sa.DateTime(), nullable=True),
+        sa.Column('oferta_expira_em', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('cliente_id', sa.Integer(), nullable=False),
+        sa.Column('profissional_id', IdTenant, nullable=False),
+        sa.Column('servico_id', IdTenant, nullable=False),
+        sa.ForeignKeyConstraint(['cliente_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['profissional_id'], ['profissionais.id'], ),
+        sa.ForeignKeyConstraint(['servico_id'], ['servicos.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_lista_espera_profissional_data', 'lista_espera', ['profissional_id', 'data', 'status'])
+    if 'agendamentos_arquivo' not in existentes:
+        op.create_table('agendamentos_arquivo',
+        sa.Column('id', IdTenant, nullable=False),
+        sa.Column('data_hora', sa.DateTime(), nullable=False),
+        sa.Column('data_hora_fim', sa.DateTime(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('observacoes', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('arquivado_em', sa.DateTime(), nullable=True),
+        sa.Column('cliente_id', sa.Integer(), nullable=False),
+        sa.Column('profissional_id', IdTenant, nullable=False),
+        sa.Column('servico_id', IdTenant, nullable=False),
+        sa.Column('serie_id', IdTenant, nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_agendamentos_arquivo_profissional_data', 'agendamentos_arquivo', ['profissional_id', 'data_hora'])
+    if 'tarefas' not in existentes:
+        op.create_table('tarefas',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tipo', sa.String(length=50), nullable=False),
+        sa.Column('argumentos', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('tentativas', sa.Integer(), nullable=True),
+        sa.Column('executar_em', sa.DateTime(), nullable=True),
+        sa.Column('trabalhador', sa.String(length=100), nullable=True),
+        sa.Column('iniciada_em', sa.DateTime(), nullable=True),
+        sa.Column('concluida_em', sa.DateTime(), nullable=True),
+        sa.Column('erro', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_tarefas_status_executar_em', 'tarefas', ['status', 'executar_em'])
+    if 'lembretes' not in existentes:
+        op.create_table('lembretes',
+        sa.Column('agendamento_id', IdTenant, nullable=False),
+        sa.Column('antecedencia', sa.Integer(), nullable=False),
+        sa.Column('enviar_em', sa.DateTime(), nullable=False),
+        sa.Column('enviado_em', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['agendamento_id'], ['agendamentos.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('agendamento_id', 'antecedencia')
+        )
+        op.create_index('ix_lembretes_pendentes', 'lembretes', ['enviado_em', 'enviar_em'])
+    if 'eventos_saida' not in existentes:
+        op.create_table('eventos_saida',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tipo', sa.String(length=50), nullable=False),
+        sa.Column('agregado_id', sa.BigInteger(), nullable=True),
+        sa.Column('dados', sa.Text(), nullable=False),
+        sa.Column('tentativas', sa.Integer(), nullable=True),
+        sa.Column('erro', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('publicado_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_eventos_saida_pendentes', 'eventos_saida', ['publicado_em', 'id'])
+    if 'webhooks' not in existentes:
+        op.create_table('webhooks',
+        sa.Column('id', IdTenant, nullable=False),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('segredo', sa.String(length=64), nullable=False),
+        sa.Column('eventos', sa.String(length=200), nullable=False),
+        sa.Column('ativo', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('barbearia_id', IdTenant, nullable=False),
+        sa.ForeignKeyConstraint(['barbearia_id'], ['barbearias.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'entregas_webhook' not in existentes:
+        op.create_table('entregas_webhook',
+        sa.Column('id', IdTenant, nullable=False),
+        sa.Column('evento_id', sa.Integer(), nullable=False),
+        sa.Column('tipo', sa.String(length=50), nullable=False),
+        sa.Column('dados', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('tentativas', sa.Integer(), nullable=True),
+        sa.Column('proxima_tentativa_em', sa.DateTime(), nullable=True),
+        sa.Column('erro', sa.Text(), nullable=True),
+        sa.Column('entregue_em', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('webhook_id', IdTenant, nullable=False),
+        sa.ForeignKeyConstraint(['webhook_id'], ['webhooks.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('webhook_id', 'evento_id', name='uq_entregas_webhook_evento')
+        )
+        op.create_index('ix_entregas_webhook_pendentes', 'entregas_webhook', ['status', 'proxima_tentativa_em'])
+    if 'tenant_shards' not in existentes:
+        op.create_table('tenant_shards',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('shard', sa.String(length=50), nullable=False),
+        sa.Column('fixo', sa.Boolean(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id')
+        )
+    if 'contadores_ids' not in existentes:
+        op.create_table('contadores_ids',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('tabela', sa.String(length=50), nullable=False),
+        sa.Column('ultimo', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'tabela')
+        )
+    if 'versoes_dados' not in existentes:
+        op.create_table('versoes_dados',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('escopo', sa.String(length=50), nullable=False),
+        sa.Column('versao', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'escopo')
+        )
+
+
+def _fim_pela_duracao(dialeto):
+    """Expressão SQL de data_hora + duração do serviço"""
+    duracao = '(SELECT duracao FROM servicos WHERE servicos.id = agendamentos.servico_id)'
+    if dialeto == 'postgresql':
+        return f"data_hora + {duracao} * interval '1 minute'"
+    return f"datetime(data_hora, '+' || {duracao} || ' minutes')"
+
+
+def upgrade():
+    dialeto = op.get_bind().dialect.name
+    inspetor, existentes = _existentes()
+    # A visão depende das colunas de agendamentos (e o SQLite recria a tabela para alterá-la)
+    op.execute('DROP VIEW IF EXISTS agendamentos_historico')
+
+    if dialeto == 'postgresql':
+        # Com sharding os IDs de tenant levam o dono nos bits altos e não cabem em INTEGER
+        for tabela, colunas in (('barbearias', ['id']),
+                                ('profissionais', ['id', 'barbearia_id']),
+                                ('servicos', ['id', 'barbearia_id']),
+                                ('agendamentos', ['id', 'profissional_id', 'servico_id'])):
+            for coluna in colunas:
+                op.alter_column(tabela, coluna, type_=sa.BigInteger(), existing_type=sa.Integer())
+
+    _criar_tabelas(existentes)
+
+    if 'excluido_em' not in _colunas(inspetor, 'users'):
+        with op.batch_alter_table('users', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('excluido_em', sa.DateTime(), nullable=True))
+
+    colunas = _colunas(inspetor, 'agendamentos')
+    if 'data_hora_fim' not in colunas:
+        # Entra sem NOT NULL, é preenchida pela duração do serviço e só então fica obrigatória
+        with op.batch_alter_table('agendamentos', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('data_hora_fim', sa.DateTime(), nullable=True))
+        op.execute(f'UPDATE agendamentos SET data_hora_fim = {_fim_pela_duracao(dialeto)} WHERE data_hora_fim IS NULL')
+        with op.batch_alter_table('agendamentos', schema=None) as batch_op:
+            batch_op.alter_column('data_hora_fim', existing_type=sa.DateTime(), nullable=False)
+            batch_op.create_index('ix_agendamentos_profissional_periodo', ['profissional_id', 'data_hora', 'data_hora_fim'])
+    if 'serie_id' not in colunas:
+        with op.batch_alter_table('agendamentos', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('serie_id', IdTenant, nullable=True))
+            batch_op.create_foreign_key('agendamentos_serie_id_fkey', 'series_agendamento', ['serie_id'], ['id'])
+
+    if dialeto == 'postgresql' and 'periodo' not in colunas:
+        # Restrição de exclusão: o banco recusa agendamentos ativos sobrepostos do mesmo profissional
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.execute("ALTER TABLE agendamentos ADD COLUMN periodo tstzrange GENERATED ALWAYS AS "
+                   "(tstzrange(data_hora AT TIME ZONE 'UTC', data_hora_fim AT TIME ZONE 'UTC', '[)')) STORED")
+        op.execute(f"ALTER TABLE agendamentos ADD CONSTRAINT {RESTRICAO_SOBREPOSICAO} "
+                   "EXCLUDE USING gist (profissional_id WITH =, periodo WITH &&) WHERE (status <> 'cancelado')")
+
+    op.execute(f'CREATE VIEW agendamentos_historico AS '
+               f'SELECT {COLUNAS_HISTORICO} FROM agendamentos '
+               f'UNION ALL SELECT {COLUNAS_HISTORICO} FROM agendamentos_arquivo')
+
+
+def downgrade():
+    dialeto = op.get_bind().dialect.name
+    op.execute('DROP VIEW IF EXISTS agendamentos_historico')
+
+    if dialeto == 'postgresql':
+        op.execute(f'ALTER TABLE agendamentos DROP CONSTRAINT IF EXISTS {RESTRICAO_SOBREPOSICAO}')
+        op.execute('ALTER TABLE agendamentos DROP COLUMN IF EXISTS periodo')
+
+    # A chave estrangeira de serie_id sai junto com a coluna
+    with op.batch_alter_table('agendamentos', schema=None) as batch_op:
+        batch_op.drop_index('ix_agendamentos_profissional_periodo')
+        batch_op.drop_column('serie_id')
+        batch_op.drop_column('data_hora_fim')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('excluido_em')
+
+    for tabela in ('versoes_dados', 'contadores_ids', 'tenant_shards', 'entregas_webhook', 'webhooks',
+                   'eventos_saida', 'lembretes', 'tarefas', 'agendamentos_arquivo', 'lista_espera',
+                   'excecoes_horario', 'series_agendamento'):
+        op.drop_table(tabela)
+
+    if dialeto == 'postgresql':
+        for tabela, colunas in (('agendamentos', ['id', 'profissional_id', 'servico_id']),
+                                ('servicos', ['id', 'barbearia_id']),
+                                ('profissionais', ['id', 'barbearia_id']),
+                                ('barbearias', ['id'])):
+            for coluna in colunas:
+                op.alter_column(tabela, coluna, type_=sa.Integer(), existing_type=sa.BigInteger())
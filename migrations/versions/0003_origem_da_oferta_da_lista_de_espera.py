@@ -0,0 +1,31 @@
+"""origem da oferta da lista de espera
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 11:00:00.000000
+
+lista_espera.oferta_origem_id guarda o agendamento cancelado que liberou a
+vaga, para um evento de cancelamento entregue de novo não gerar outra oferta.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('lista_espera', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('oferta_origem_id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=True))
+        batch_op.create_index(batch_op.f('ix_lista_espera_oferta_origem_id'), ['oferta_origem_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('lista_espera', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_lista_espera_oferta_origem_id'))
+        batch_op.drop_column('oferta_origem_id')
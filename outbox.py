@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Outbox transacional dos eventos de agendamento
+Os eventos são gravados na tabela eventos_saida na mesma transação que altera
+o agendamento; o retransmissor (flask outbox) lê em lotes, chama os assinantes
+e só então marca como publicados. A entrega é "pelo menos uma vez": um
+assinante pode receber o mesmo evento de novo e deve tolerar isso
+"""
+
+import json
+import logging
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+logger = logging.getLogger(__name__)
+
+# banco é o nome da bind onde o evento foi gravado (None = banco principal)
+Evento = namedtuple('Evento', 'id banco tipo agregado_id dados criado_em')
+
+
+def gravar_evento(conexao, tabela, tipo, agregado_id, **dados):
+    """Insere o evento usando a conexão (e a transação) de quem alterou os dados"""
+    conexao.execute(insert(tabela).values(
+        tipo=tipo,
+        agregado_id=agregado_id,
+        dados=json.dumps(dados, default=str),
+        tentativas=0,
+        created_at=datetime.utcnow()
+    ))
+
+
+class Retransmissor:
+    """
+    Drena a tabela de eventos chamando os assinantes de cada tipo
+
+    bancos   -- função que devolve [(nome, engine), ...] a drenar
+    contexto -- função nome -> context manager em volta dos assinantes
+
+    Funções registradas com @periodica rodam no mesmo laço, no máximo uma vez
+    a cada intervalo (ex.: gerar eventos que dependem só da passagem do tempo)
+    """
+
+    def __init__(self, tabela, bancos, contexto=lambda nome: nullcontext(), lote=100, max_tentativas=10):
+        self.tabela = tabela
+        self.bancos = bancos
+        self.contexto = contexto
+        self.lote = lote
+        self.max_tentativas = max_tentativas
+        self.assinantes = {}
+        self.periodicas = []  # [função, intervalo, próxima execução]
+
+    def assinar(self, tipo):
+        """Decorador que registra uma função chamada com cada Evento do tipo"""
+        def registrar(funcao):
+            self.assinantes.setdefault(tipo, []).append(funcao)
+            return funcao
+        return registrar
+
+    def periodica(self, intervalo):
+        """Decorador que registra uma função chamada a cada 'intervalo' segundos"""
+        def registrar(funcao):
+            self.periodicas.append([funcao, intervalo, 0])
+            return funcao
+        return registrar
+
+    def rodar_periodicas(self, todas=False):
+        """Chama as funções periódicas que já venceram (ou todas); retorna quantas rodaram"""
+        agora = time.monotonic()
+        rodadas = 0
+        for periodica in self.periodicas:
+            funcao, intervalo, proxima = periodica
+            if agora < proxima and not todas:
+                continue
+            periodica[2] = agora + intervalo
+            try:
+                funcao()
+            except Exception:
+                logger.exception('Falha na função periódica %s', funcao.__name__)
+            rodadas += 1
+        return rodadas
+
+    def drenar(self):
+        """Uma passada por todos os bancos; retorna quantos eventos foram publicados"""
+        return sum(self.drenar_lote(nome, engine) for nome, engine in self.bancos())
+
+    def drenar_lote(self, nome, engine):
+        """
+        Publica até 'lote' eventos do banco, em ordem
+        A leitura e a marcação são transações curtas separadas: os assinantes
+        rodam sem segurar bloqueios na tabela de eventos
+        """
+        tabela = self.tabela
+        with engine.connect() as conexao:
+            linhas = conexao.execute(
+                select(tabela).where(tabela.c.publicado_em.is_(None)).order_by(tabela.c.id).limit(self.lote)
+            ).mappings().all()
+
+        publicados = []
+        for linha in linhas:
+            evento = Evento(linha['id'], nome, linha['tipo'], linha['agregado_id'],
+                            json.loads(linha['dados']), linha['created_at'])
+            try:
+                with self.contexto(nome):
+                    for assinante in self.assinantes.get(evento.tipo, []):
+                        assinante(evento)
+            except Exception as erro:
+                logger.exception('Falha ao publicar o evento %s (%s)', evento.id, evento.tipo)
+                self._registrar_falha(engine, linha, erro)
+                # Para aqui para manter a ordem; o evento é repetido na próxima passada
+                break
+            publicados.append(evento.id)
+
+        if publicados:
+            with engine.begin() as conexao:
+                conexao.execute(update(tabela).where(tabela.c.id.in_(publicados)).values(publicado_em=datetime.utcnow()))
+        return len(publicados)
+
+    def executar(self, parar, intervalo=0.5):
+        """Drena continuamente; espera 'intervalo' segundos quando não há eventos"""
+        while not parar.is_set():
+            self.rodar_periodicas()
+            try:
+                publicados = self.drenar()
+            except Exception:
+                logger.exception('Falha ao drenar eventos')
+                publicados = 0
+            if not publicados:
+                parar.wait(intervalo)
+
+    def _registrar_falha(self, engine, linha, erro):
+        valores = {'tentativas': linha['tentativas'] + 1, 'erro': str(erro)[:500]}
+        if valores['tentativas'] >= self.max_tentativas:
+            # Desiste do evento para não travar os seguintes; fica registrado com o erro
+            logger.error('Evento %s descartado após %s tentativas', linha['id'], valores['tentativas'])
+            valores['publicado_em'] = datetime.utcnow()
+        with engine.begin() as conexao:
+            conexao.execute(update(self.tabela).where(self.tabela.c.id == linha['id']).values(**valores))
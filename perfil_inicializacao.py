@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Perfil da inicialização (cold start) da aplicação
+Importa o app em processos novos com python -X importtime e mostra quanto cada
+pacote e módulo custa, o tempo total de importação e o da primeira requisição
+
+Uso:
+    python perfil_inicializacao.py
+    python perfil_inicializacao.py --repeticoes 10 --top 30 --rota /login
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Executado em cada processo filho: mede a importação e a primeira requisição
+MEDICAO = '''
+import io, contextlib, json, sys, time
+inicio = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    modulo = __import__(sys.argv[1])
+importado = time.perf_counter()
+modulo.app.test_client().get(sys.argv[2])
+fim = time.perf_counter()
+print(json.dumps({'importacao': importado - inicio, 'primeira_requisicao': fim - importado}))
+'''
+
+
+def medir(alvo, rota):
+    """Uma importação em processo novo: (tempos, {modulo: (proprio_us, acumulado_us)})"""
+    processo = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', MEDICAO, alvo, rota],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if processo.returncode != 0:
+        raise SystemExit(processo.stderr[-2000:])
+
+    modulos = {}
+    for linha in processo.stderr.splitlines():
+        if not linha.startswith('import time:') or 'self [us]' in linha:
+            continue
+        _, proprio, acumulado, nome = (parte.strip() for parte in linha.replace('import time:', '|', 1).split('|'))
+        modulos[nome] = (int(proprio), int(acumulado))
+    return json.loads(processo.stdout.strip().splitlines()[-1]), modulos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--alvo', default='app', help='Módulo com o objeto app (padrão: app)')
+    parser.add_argument('--rota', default='/login', help='Rota da primeira requisição')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    medicoes = [medir(args.alvo, args.rota) for _ in range(args.repeticoes)]
+    importacao = statistics.median(tempos['importacao'] for tempos, _ in medicoes) * 1000
+    primeira = statistics.median(tempos['primeira_requisicao'] for tempos, _ in medicoes) * 1000
+
+    # Mediana por módulo entre as repetições
+    nomes = set().union(*(modulos for _, modulos in medicoes))
+    proprio = {nome: statistics.median(m.get(nome, (0, 0))[0] for _, m in medicoes) for nome in nomes}
+    acumulado = {nome: statistics.median(m.get(nome, (0, 0))[1] for _, m in medicoes) for nome in nomes}
+    por_pacote = {}
+    for nome, micros in proprio.items():
+        pacote = nome.split('.')[0]
+        por_pacote[pacote] = por_pacote.get(pacote, 0) + micros
+
+    print(f'Importação de {args.alvo}: {importacao:.1f} ms (mediana de {args.repeticoes})')
+    print(f'Primeira requisição a {args.rota}: {primeira:.1f} ms')
+    print(f'\nPacotes por tempo próprio (ms)')
+    for pacote, micros in sorted(por_pacote.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{micros / 1000:>9.1f}  {pacote}')
+    print(f'\nMódulos por tempo acumulado (ms)')
+    for nome, micros in sorted(acumulado.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{micros / 1000:>9.1f}  {proprio[nome] / 1000:>7.1f}  {nome}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Roteamento de leituras para réplicas do banco de dados
+Páginas marcadas com @somente_leitura consultam uma réplica; escritas e
+qualquer página logo após o usuário alterar dados continuam no banco principal
+Com sharding ativo, as tabelas de tenant vão para o shard definido em g.shard
+"""
+
+import random
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, session as sessao_flask
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+
+# Prefixo das binds que representam réplicas em SQLALCHEMY_BINDS
+PREFIXO_REPLICA = 'replica_'
+
+
+def binds_replicas(urls, opcoes=lambda url: {}):
+    """
+    Converte a lista de URLs de réplicas em entradas para SQLALCHEMY_BINDS
+    'opcoes' devolve as opções de engine (pool) de cada URL
+    """
+    return {f'{PREFIXO_REPLICA}{indice}': dict(opcoes(url), url=url) for indice, url in enumerate(urls)}
+
+
+def somente_leitura(view):
+    """Marca a rota como somente leitura, permitindo atendê-la por uma réplica"""
+    @wraps(view)
+    def decorada(*args, **kwargs):
+        g.leitura_em_replica = True
+        return view(*args, **kwargs)
+    return decorada
+
+
+class SessaoRoteada(Session):
+    """
+    Sessão que envia SELECTs de rotas somente leitura para uma réplica
+    Depois que o usuário grava algo, as leituras dele ficam no principal por
+    REPLICA_ADERENCIA_SEGUNDOS (read-your-writes)
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and mapper is not None and has_app_context() and g.get('shard'):
+            # Tabelas de tenant vão para o shard do dono em uso (ver shards.py)
+            if inspect(mapper).local_table.info.get('tenant'):
+                return self._db.engines[g.shard]
+
+        if bind is None and self._pode_usar_replica(clause):
+            replicas = [engine for chave, engine in self._db.engines.items()
+                        if chave and chave.startswith(PREFIXO_REPLICA)]
+            if replicas:
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _pode_usar_replica(self, clause):
+        if not has_request_context() or not g.get('leitura_em_replica'):
+            return False
+        if self._flushing or self.info.get('escreveu') or not getattr(clause, 'is_select', False):
+            return False
+
+        ultima_escrita = sessao_flask.get('_ultima_escrita', 0)
+        return time.time() - ultima_escrita > current_app.config['REPLICA_ADERENCIA_SEGUNDOS']
+
+
+@event.listens_for(SessaoRoteada, 'after_flush')
+def _marcar_escrita(sessao, contexto_flush):
+    sessao.info['escreveu'] = True
+
+
+@event.listens_for(SessaoRoteada, 'do_orm_execute')
+def _marcar_escrita_direta(estado):
+    # UPDATE/DELETE/INSERT via session.execute() não passam pelo flush
+    if not estado.is_select:
+        estado.session.info['escreveu'] = True
+
+
+@event.listens_for(SessaoRoteada, 'after_commit')
+def _registrar_escrita(sessao):
+    if sessao.info.pop('escreveu', False) and has_request_context():
+        # Guarda no cookie de sessão para as próximas leituras irem ao principal
+        sessao_flask['_ultima_escrita'] = time.time()
+
+
+@event.listens_for(SessaoRoteada, 'after_rollback')
+def _descartar_escrita(sessao):
+    sessao.info.pop('escreveu', None)
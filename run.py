@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Executa a aplicação em modo de desenvolvimento
+Uso: python run.py
+
+Para produção use o gunicorn (gunicorn -c gunicorn.conf.py wsgi:app)
+"""
+
+import os
+
+from app import app
+
+if __name__ == '__main__':
+    app.run(
+        debug=os.getenv('FLASK_DEBUG', '1') == '1',
+        host=os.getenv('HOST', '0.0.0.0'),
+        port=int(os.getenv('PORT', 5000))
+    )
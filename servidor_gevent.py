@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor em modo gevent para conexões longas
+Cada requisição roda em um greenlet em vez de uma thread, então streams da
+agenda ao vivo e clientes lentos ficam ociosos sem ocupar um worker. As rotas
+são as mesmas do app.py; o monkey patch torna sockets, threads, filas e sleep
+cooperativos (inclusive a thread que segue a outbox)
+
+Uso: python servidor_gevent.py
+"""
+
+from gevent import monkey
+
+# Precisa vir antes de qualquer outro import (socket, threading, ssl...)
+monkey.patch_all()
+
+try:
+    # Com PostgreSQL, o psycopg2 também precisa ceder a vez enquanto espera o banco
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+except ImportError:
+    pass
+
+import os
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from app import app, precompilar_templates
+
+
+def main():
+    porta = int(os.getenv('PORT', 5000))
+    # Limite de conexões simultâneas por processo; as excedentes esperam no backlog do socket
+    conexoes = app.config['GEVENT_CONEXOES']
+    servidor = WSGIServer(('0.0.0.0', porta), app, spawn=Pool(conexoes),
+                          log=None if os.getenv('GEVENT_LOG_ACESSOS', '0') != '1' else 'default')
+    # A primeira requisição de cada página não paga a compilação do template
+    precompilar_templates()
+    print(f'Servidor gevent em http://0.0.0.0:{porta} (até {conexoes} conexões)')
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.stop(timeout=5)
+
+
+if __name__ == '__main__':
+    main()
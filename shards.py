@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Particionamento (sharding) dos dados por proprietário
+Cada usuário dono de barbearias tem seus dados (barbearias, profissionais,
+serviços, agendamentos...) em um único shard. Os IDs dessas tabelas carregam
+o ID do dono nos bits altos, então qualquer ID já indica a qual tenant pertence
+"""
+
+import hashlib
+from bisect import bisect_right
+from contextlib import contextmanager
+
+from flask import g
+from sqlalchemy import delete, select
+
+# Prefixo das binds que representam shards em SQLALCHEMY_BINDS
+PREFIXO_SHARD = 'shard_'
+
+# Bits reservados para a sequência local de cada tenant
+BITS_LOCAIS = 32
+
+
+def binds_shards(urls, opcoes=lambda url: {}):
+    """Converte a lista de URLs dos shards em entradas para SQLALCHEMY_BINDS"""
+    return {f'{PREFIXO_SHARD}{indice}': dict(opcoes(url), url=url) for indice, url in enumerate(urls)}
+
+
+def id_global(dono_id, local):
+    """Monta o ID de um registro a partir do dono e da sequência local"""
+    return (dono_id << BITS_LOCAIS) | local
+
+
+def dono_do_id(registro_id):
+    """Extrai o ID do usuário dono a partir do ID de qualquer registro de tenant"""
+    return int(registro_id) >> BITS_LOCAIS
+
+
+def faixa_do_dono(dono_id):
+    """Intervalo (inclusive) de IDs que pertencem ao dono"""
+    return id_global(dono_id, 0), id_global(dono_id, (1 << BITS_LOCAIS) - 1)
+
+
+class AnelShards:
+    """
+    Hash consistente: cada shard ocupa vários pontos de um anel e o dono vai
+    para o primeiro ponto depois do hash do seu ID. Ao incluir um shard,
+    só os donos que caem nos novos pontos mudam de lugar
+    """
+
+    def __init__(self, nomes, pontos_por_shard=64):
+        pontos = sorted(
+            (self._hash(f'{nome}#{ponto}'), nome)
+            for nome in nomes
+            for ponto in range(pontos_por_shard)
+        )
+        self._hashes = [hash_ponto for hash_ponto, nome in pontos]
+        self._nomes = [nome for hash_ponto, nome in pontos]
+
+    @staticmethod
+    def _hash(valor):
+        return int.from_bytes(hashlib.md5(str(valor).encode()).digest()[:8], 'big')
+
+    def shard_de(self, dono_id):
+        posicao = bisect_right(self._hashes, self._hash(dono_id)) % len(self._hashes)
+        return self._nomes[posicao]
+
+
+@contextmanager
+def em_shard(nome):
+    """Executa o bloco com as tabelas de tenant apontando para o shard informado"""
+    anterior = g.get('shard')
+    g.shard = nome
+    try:
+        yield
+    finally:
+        g.shard = anterior
+
+
+def _filtro_dono(tabela, dono_id):
+    """
+    Linhas do dono em uma tabela de tenant, pela primeira coluna da chave primária:
+    user_id direto ou um ID de tenant (que carrega o dono nos bits altos)
+    """
+    coluna = list(tabela.primary_key.columns)[0]
+    if coluna.name == 'user_id':
+        return coluna == dono_id
+    return coluna.between(*faixa_do_dono(dono_id))
+
+
+def copiar_tenant(origem, destino, tabelas, dono_id):
+    """
+    Copia todos os registros do dono de um shard para outro em uma transação
+    'tabelas' deve estar em ordem de dependência (pais antes dos filhos)
+    """
+    with origem.connect() as leitura, destino.begin() as escrita:
+        for tabela in tabelas:
+            linhas = [dict(linha._mapping) for linha in leitura.execute(select(tabela).where(_filtro_dono(tabela, dono_id)))]
+            if linhas:
+                escrita.execute(tabela.insert(), linhas)
+
+
+def remover_tenant(engine, tabelas, dono_id):
+    """Apaga os registros do dono em um shard (filhos antes dos pais)"""
+    with engine.begin() as conexao:
+        for tabela in reversed(tabelas):
+            conexao.execute(delete(tabela).where(_filtro_dono(tabela, dono_id)))
+
+
+def inserir_ou_atualizar(conexao, tabela, linhas):
+    """
+    INSERT ... ON CONFLICT (chave primária) DO UPDATE (PostgreSQL e SQLite)
+    A linha existente é atualizada no lugar: as chaves estrangeiras que apontam
+    para ela continuam válidas
+    """
+    if not linhas:
+        return
+    if conexao.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    chave = [coluna.name for coluna in tabela.primary_key.columns]
+    comando = insert(tabela)
+    conexao.execute(comando.on_conflict_do_update(
+        index_elements=chave,
+        set_={coluna.name: comando.excluded[coluna.name] for coluna in tabela.c if coluna.name not in chave},
+    ), linhas)
+
+
+def espelhar_linhas(origem, destinos, tabela, ids=None):
+    """
+    Replica nos shards as linhas de uma tabela global (ex.: users); sem 'ids', a tabela toda
+    Só grava as linhas que faltam ou mudaram no destino
+    """
+    filtro = tabela.c.id.in_(ids) if ids is not None else True
+    with origem.connect() as leitura:
+        linhas = {linha['id']: dict(linha) for linha in leitura.execute(select(tabela).where(filtro)).mappings()}
+
+    for destino in destinos:
+        with destino.begin() as escrita:
+            atuais = {linha['id']: dict(linha) for linha in escrita.execute(select(tabela).where(filtro)).mappings()}
+            inserir_ou_atualizar(escrita, tabela, [linha for id_, linha in linhas.items() if atuais.get(id_) != linha])
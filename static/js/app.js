@@ -27,6 +27,9 @@ function initApp() {
     // Inicializa funcionalidades de agenda
     initAgendaFeatures();
     
+    // Inicializa atualização da agenda ao vivo
+    initAgendaAoVivo();
+    
     // Inicializa notificações
     initNotifications();
 }
@@ -113,21 +116,83 @@ function initAgendaFeatures() {
         input.min = hoje;
     });
     
-    // Define horários de funcionamento padrão
+    // Valida o horário contra o calendário da barbearia (data-barbearia-id no formulário)
     horaInputs.forEach(input => {
-        input.addEventListener('change', function(e) {
-            const hora = e.target.value;
-            const [horas, minutos] = hora.split(':');
+        input.addEventListener('change', async function(e) {
+            const container = e.target.closest('[data-barbearia-id]');
+            if (!container || !e.target.value) {
+                return;
+            }
+            
+            const dataInput = container.querySelector('input[type="date"]');
+            const dia = dataInput && dataInput.value ? dataInput.value : hoje;
+            const horarios = await obterHorariosBarbearia(container.dataset.barbeariaId);
+            if (!horarios) {
+                return;
+            }
             
-            // Verifica se está dentro do horário comercial (8h às 18h)
-            if (parseInt(horas) < 8 || parseInt(horas) >= 18) {
-                showNotification('Horário deve estar entre 8h e 18h', 'warning');
+            const expediente = horarios.calendario[dia];
+            if (!expediente) {
+                showNotification('A barbearia não abre nesta data', 'warning');
+                e.target.value = '';
+            } else if (e.target.value < expediente.abertura || e.target.value >= expediente.fechamento) {
+                showNotification(`Horário deve estar entre ${expediente.abertura} e ${expediente.fechamento}`, 'warning');
                 e.target.value = '';
             }
         });
     });
 }
 
+/**
+ * Mantém a agenda atualizada pelo stream de eventos do servidor (SSE)
+ * Elementos com data-agenda-eventos="<url do stream>" recebem o evento
+ * 'agenda:atualizada' com os dados de cada agendamento criado ou cancelado
+ */
+function initAgendaAoVivo() {
+    if (!window.EventSource) {
+        return;
+    }
+    
+    document.querySelectorAll('[data-agenda-eventos]').forEach(elemento => {
+        // O navegador reconecta sozinho e reenvia o último id recebido (Last-Event-ID)
+        const fonte = new EventSource(elemento.dataset.agendaEventos);
+        const repassar = function(e) {
+            const dados = JSON.parse(e.data);
+            elemento.dispatchEvent(new CustomEvent('agenda:atualizada', { detail: dados, bubbles: true }));
+            
+            if (dados.tipo === 'agendamento-criado') {
+                showNotification(`Novo agendamento: ${formatarDataHora(dados.data_hora)}`, 'info');
+            } else if (dados.tipo === 'agendamento-cancelado') {
+                showNotification(`Agendamento cancelado: ${formatarDataHora(dados.data_hora)}`, 'warning');
+            }
+        };
+        ['agendamento-criado', 'agendamento-cancelado', 'agendamentos-encerrados'].forEach(tipo => {
+            fonte.addEventListener(tipo, repassar);
+        });
+        window.addEventListener('pagehide', () => fonte.close());
+    });
+}
+
+// Calendários já carregados, por barbearia
+const horariosBarbearias = new Map();
+
+/**
+ * Busca (uma única vez por página) o calendário de funcionamento da barbearia
+ * @param {string|number} barbeariaId - ID da barbearia
+ * @returns {Promise<Object|null>} Calendário com os expedientes por data
+ */
+function obterHorariosBarbearia(barbeariaId) {
+    if (!horariosBarbearias.has(barbeariaId)) {
+        const promessa = makeRequest(`/barbearia/${barbeariaId}/horarios?dias=90`)
+            .catch(() => {
+                horariosBarbearias.delete(barbeariaId);
+                return null;
+            });
+        horariosBarbearias.set(barbeariaId, promessa);
+    }
+    return horariosBarbearias.get(barbeariaId);
+}
+
 /**
  * Inicializa sistema de notificações
  */
@@ -363,6 +428,7 @@ window.BarbeariaApp = {
     showNotification,
     makeRequest,
     verificarDisponibilidade,
+    obterHorariosBarbearia,
     fazerAgendamento,
     formatarDataHora,
     formatarPreco,
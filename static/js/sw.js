@@ -3,16 +3,14 @@
  * Este arquivo permite que o app funcione offline e seja instalável
  */
 
-const CACHE_NAME = 'barbearia-app-v1';
-const urlsToCache = [
-    '/',
-    '/static/css/style.css',
-    '/static/js/app.js',
-    '/static/manifest.json',
+// Preenchido pelo servidor em /sw.js: versão e URLs (com hash) dos arquivos estáticos
+const ATIVOS = self.ATIVOS || { versao: 'v1', arquivos: ['/static/css/style.css', '/static/js/app.js'] };
+const CACHE_NAME = 'barbearia-app-' + ATIVOS.versao;
+const urlsToCache = ['/'].concat(ATIVOS.arquivos, [
     'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
     'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css'
-];
+]);
 
 // Instalação do Service Worker
 self.addEventListener('install', function(event) {
@@ -59,6 +57,11 @@ self.addEventListener('fetch', function(event) {
         return;
     }
     
+    // Streams da agenda ao vivo (SSE) não podem passar pelo cache
+    if (event.request.headers.get('Accept') === 'text/event-stream') {
+        return;
+    }
+    
     event.respondWith(
         caches.match(event.request)
             .then(function(response) {
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Fila de tarefas em segundo plano guardada no próprio banco de dados
+Workers (flask worker) reivindicam tarefas com um UPDATE atômico, sem broker
+externo. Falhas são repetidas com espera exponencial e cada tipo de tarefa
+pode ter um limite de execuções simultâneas
+"""
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+logger = logging.getLogger(__name__)
+
+# limite=None deixa o tipo sem limite de execuções simultâneas
+TipoTarefa = namedtuple('TipoTarefa', 'nome funcao limite max_tentativas')
+
+# Quantas tarefas prontas são consideradas a cada tentativa de reivindicação
+CANDIDATOS_POR_BUSCA = 10
+
+
+class FilaTarefas:
+    """Tipos de tarefa registrados e operações sobre a tabela de tarefas"""
+
+    def __init__(self, tabela, backoff_base=10, backoff_maximo=3600, tempo_limite=900):
+        self.tabela = tabela
+        self.backoff_base = backoff_base
+        self.backoff_maximo = backoff_maximo
+        self.tempo_limite = tempo_limite
+        self.tipos = {}
+
+    def tarefa(self, nome, limite=None, max_tentativas=5):
+        """Decorador que registra a função como um tipo de tarefa"""
+        def registrar(funcao):
+            self.tipos[nome] = TipoTarefa(nome, funcao, limite, max_tentativas)
+            return funcao
+        return registrar
+
+    def valores(self, tipo, argumentos, atraso=0):
+        """Colunas de uma nova tarefa; os argumentos precisam ser serializáveis em JSON"""
+        if tipo not in self.tipos:
+            raise ValueError(f'Tipo de tarefa desconhecido: {tipo}')
+        return {
+            'tipo': tipo,
+            'argumentos': json.dumps(argumentos),
+            'status': 'pendente',
+            'tentativas': 0,
+            'executar_em': datetime.utcnow() + timedelta(seconds=atraso)
+        }
+
+    def reivindicar(self, conexao, trabalhador):
+        """
+        Marca uma tarefa pronta como 'executando' para este trabalhador
+        O UPDATE só vale se a tarefa ainda estiver pendente e o tipo abaixo do
+        limite, então dois workers nunca pegam a mesma tarefa
+        Retorna a linha da tarefa ou None
+
+        No PostgreSQL os candidatos são lidos com FOR UPDATE SKIP LOCKED (cada
+        worker fica com linhas diferentes) e a contagem do limite roda sob um
+        advisory lock do tipo, liberado no fim da transação: em READ COMMITTED
+        duas contagens simultâneas veriam a mesma vaga. No SQLite a escrita já
+        é serializada e o UPDATE com a subconsulta é atômico
+        """
+        tabela = self.tabela
+        agora = datetime.utcnow()
+        postgresql = conexao.dialect.name == 'postgresql'
+        candidatos = conexao.execute(
+            select(tabela.c.id, tabela.c.tipo).where(
+                tabela.c.status == 'pendente',
+                tabela.c.executar_em <= agora,
+                tabela.c.tipo.in_(list(self.tipos))
+            ).order_by(tabela.c.executar_em, tabela.c.id).limit(CANDIDATOS_POR_BUSCA)
+            .with_for_update(skip_locked=True)
+        ).all()
+
+        for tarefa_id, tipo in candidatos:
+            condicoes = [tabela.c.id == tarefa_id, tabela.c.status == 'pendente']
+            limite = self.tipos[tipo].limite
+            if limite:
+                if postgresql:
+                    conexao.execute(select(func.pg_advisory_xact_lock(func.hashtext(f'tarefas:{tipo}'))))
+                em_execucao = select(func.count()).select_from(tabela).where(
+                    tabela.c.tipo == tipo, tabela.c.status == 'executando'
+                ).scalar_subquery()
+                condicoes.append(em_execucao < limite)
+
+            resultado = conexao.execute(update(tabela).where(*condicoes).values(
+                status='executando',
+                trabalhador=trabalhador,
+                iniciada_em=agora,
+                tentativas=tabela.c.tentativas + 1
+            ))
+            if resultado.rowcount == 1:
+                return conexao.execute(select(tabela).where(tabela.c.id == tarefa_id)).mappings().one()
+        return None
+
+    def concluir(self, conexao, tarefa):
+        conexao.execute(update(self.tabela).where(self.tabela.c.id == tarefa['id']).values(
+            status='concluida', concluida_em=datetime.utcnow(), erro=None
+        ))
+
+    def falhar(self, conexao, tarefa, erro):
+        """Agenda nova tentativa com espera exponencial ou desiste após max_tentativas"""
+        tipo = self.tipos.get(tarefa['tipo'])
+        valores = {'erro': erro, 'trabalhador': None}
+        if tipo is None or tarefa['tentativas'] >= tipo.max_tentativas:
+            valores.update(status='falhou', concluida_em=datetime.utcnow())
+        else:
+            valores.update(status='pendente',
+                           executar_em=datetime.utcnow() + timedelta(seconds=self.espera(tarefa['tentativas'])))
+        conexao.execute(update(self.tabela).where(self.tabela.c.id == tarefa['id']).values(**valores))
+
+    def espera(self, tentativas):
+        """Segundos até a próxima tentativa: dobra a cada falha, com variação aleatória"""
+        atraso = min(self.backoff_base * 2 ** (tentativas - 1), self.backoff_maximo)
+        return random.uniform(atraso / 2, atraso)
+
+    def recuperar_travadas(self, conexao):
+        """Devolve à fila tarefas de workers que morreram no meio da execução"""
+        limite = datetime.utcnow() - timedelta(seconds=self.tempo_limite)
+        return conexao.execute(update(self.tabela).where(
+            self.tabela.c.status == 'executando', self.tabela.c.iniciada_em < limite
+        ).values(status='pendente', trabalhador=None)).rowcount
+
+
+class Trabalhador:
+    """
+    Executa tarefas da fila em uma ou mais threads
+    'contexto' é chamado em volta de cada tarefa (ex.: app.app_context)
+    """
+
+    def __init__(self, fila, engine, contexto, threads=1, intervalo=1.0, intervalo_recuperacao=60):
+        self.fila = fila
+        self.engine = engine
+        self.contexto = contexto
+        self.threads = threads
+        self.intervalo = intervalo
+        self.intervalo_recuperacao = intervalo_recuperacao
+        self.nome = f'{socket.gethostname()}:{os.getpid()}'
+        self._proxima_recuperacao = 0
+        self._lock = threading.Lock()
+
+    def executar(self, parar):
+        """Processa tarefas até 'parar' (threading.Event) ser sinalizado"""
+        threads = [threading.Thread(target=self._laco, args=(parar,), name=f'worker-{indice}', daemon=True)
+                   for indice in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def processar_pendentes(self):
+        """Executa as tarefas prontas até a fila esvaziar; retorna quantas rodaram"""
+        self.recuperar_travadas()
+        total = 0
+        while self.executar_uma():
+            total += 1
+        return total
+
+    def executar_uma(self):
+        """Reivindica e executa uma tarefa; retorna False se não havia nenhuma pronta"""
+        with self.engine.begin() as conexao:
+            tarefa = self.fila.reivindicar(conexao, self.nome)
+        if tarefa is None:
+            return False
+
+        try:
+            with self.contexto():
+                self.fila.tipos[tarefa['tipo']].funcao(**json.loads(tarefa['argumentos']))
+        except Exception:
+            logger.exception('Tarefa %s (%s) falhou', tarefa['id'], tarefa['tipo'])
+            with self.engine.begin() as conexao:
+                self.fila.falhar(conexao, tarefa, traceback.format_exc(limit=5))
+        else:
+            with self.engine.begin() as conexao:
+                self.fila.concluir(conexao, tarefa)
+        return True
+
+    def recuperar_travadas(self):
+        """
+        Devolve à fila as tarefas travadas no máximo a cada 'intervalo_recuperacao'
+        segundos (entre todas as threads); um worker que caiu não espera o próximo início
+        """
+        agora = time.monotonic()
+        with self._lock:
+            if agora < self._proxima_recuperacao:
+                return 0
+            self._proxima_recuperacao = agora + self.intervalo_recuperacao
+        with self.engine.begin() as conexao:
+            recuperadas = self.fila.recuperar_travadas(conexao)
+        if recuperadas:
+            logger.warning('%s tarefas travadas voltaram para a fila', recuperadas)
+        return recuperadas
+
+    def _laco(self, parar):
+        while not parar.is_set():
+            try:
+                self.recuperar_travadas()
+                executou = self.executar_uma()
+            except Exception:
+                logger.exception('Erro ao buscar tarefas')
+                executou = False
+            if not executou:
+                parar.wait(self.intervalo)
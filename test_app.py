@@ -6,7 +6,17 @@ Execute este arquivo para testar as funcionalidades básicas
 
 import requests
 import json
-from datetime import datetime, timedelta
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from ao_vivo import CanalAoVivo, EventoAgenda, PosicaoOutbox
+from lista_espera import FilaEspera, FilasEspera, PedidoEspera
 
 def test_app():
     """Testa as funcionalidades básicas da aplicação"""
@@ -74,7 +84,19 @@ def test_app():
     except Exception as e:
         print(f"❌ API de verificação - Erro: {e}")
     
-    # Teste 4: Verificar banco de dados
+    # Teste 4: Verificar API do calendário de funcionamento
+    print("\n🔍 Testando API de horários da barbearia...")
+    try:
+        response = requests.get(base_url + "/barbearia/1/horarios", timeout=5)
+        if response.status_code in [200, 404]:  # 404 se ainda não houver barbearia cadastrada
+            print("✅ API de horários da barbearia - OK")
+            print(f"   Resposta: {response.json()}")
+        else:
+            print(f"❌ API de horários - Status: {response.status_code}")
+    except Exception as e:
+        print(f"❌ API de horários - Erro: {e}")
+    
+    # Teste 5: Verificar banco de dados
     print("\n🔍 Testando inicialização do banco...")
     try:
         response = requests.get(base_url + "/init-db", timeout=5)
@@ -94,8 +116,571 @@ def test_app():
     print("4. Configure profissionais e serviços")
     print("5. Comece a receber agendamentos!")
 
+# Início comum dos scripts executados por _rodar_script: importa o app (que lê
+# DATABASE_URL na importação) e oferece criar_barbearia para montar os dados
+PREPARO = """
+import json
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+import app as barbearia
+
+app, db = barbearia.app, barbearia.db
+
+def criar_barbearia(email='dono@teste.com', profissionais=('Barbeiro',), servicos=(('Corte', 30),)):
+    \"\"\"Dono (senha 'teste'), barbearia aberta todos os dias, profissionais e serviços; devolve os ids\"\"\"
+    with app.app_context():
+        dono = barbearia.User(nome='Dono', email=email)
+        dono.set_password('teste')
+        db.session.add(dono)
+        db.session.flush()
+        loja = barbearia.Barbearia(nome='Loja', user_id=dono.id, dias_funcionamento='1,2,3,4,5,6,7')
+        db.session.add(loja)
+        db.session.flush()
+        equipe = [barbearia.Profissional(nome=nome, barbearia_id=loja.id) for nome in profissionais]
+        catalogo = [barbearia.Servico(nome=nome, preco=30, duracao=duracao, barbearia_id=loja.id)
+                    for nome, duracao in servicos]
+        db.session.add_all(equipe + catalogo)
+        db.session.commit()
+        ids = SimpleNamespace(dono=dono.id, loja=loja.id, profissionais=[profissional.id for profissional in equipe],
+                              servicos=[servico.id for servico in catalogo])
+        ids.profissional, ids.servico = ids.profissionais[0], ids.servicos[0]
+        return ids
+
+def agendar(ids, inicio, profissional=None, servico=None, **campos):
+    with app.app_context():
+        agendamento = barbearia.Agendamento(data_hora=inicio, cliente_id=ids.dono,
+                                            profissional_id=profissional or ids.profissional,
+                                            servico_id=servico or ids.servico, **campos)
+        db.session.add(agendamento)
+        db.session.commit()
+        return agendamento.id
+
+def cliente_logado(email='dono@teste.com'):
+    cliente = app.test_client()
+    cliente.post('/login', data={'email': email, 'password': 'teste'})
+    return cliente
+"""
+
+def _rodar_script(script, **ambiente):
+    """
+    Roda PREPARO + script em um processo Python separado, com um banco SQLite em
+    uma pasta temporária (valores do ambiente podem usar {pasta}), e devolve o
+    JSON impresso na última linha da saída
+    """
+    with tempfile.TemporaryDirectory() as pasta:
+        ambiente = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(pasta, "barbearia.db")}',
+                        **{nome: valor.format(pasta=pasta) for nome, valor in ambiente.items()})
+        resultado = subprocess.run([sys.executable, '-c', PREPARO + script], env=ambiente,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   capture_output=True, text=True, timeout=120)
+    saida = resultado.stdout.strip().splitlines()
+    assert resultado.returncode == 0 and saida, resultado.stderr[-2000:]
+    return json.loads(saida[-1])
+
+# Executado com DATABASE_URL apontando para o PostgreSQL de teste
+SCRIPT_SOBREPOSICAO = """
+from sqlalchemy.exc import IntegrityError
+
+ids = criar_barbearia()
+inicio = datetime.now().replace(microsecond=0) + timedelta(days=1)
+resultado = 'ACEITO'
+for minutos in (0, 15):
+    try:
+        agendar(ids, inicio + timedelta(minutes=minutos))
+    except IntegrityError as erro:
+        resultado = 'RECUSADO' if barbearia._violou_sobreposicao(erro) else 'OUTRO ERRO'
+        break
+print(json.dumps(resultado))
+"""
+
+def test_postgresql():
+    """
+    Sobe um PostgreSQL temporário (se initdb/pg_ctl estiverem no PATH) e confere
+    se a restrição de exclusão recusa agendamentos sobrepostos
+    """
+    print("\n🐘 Testando restrição de sobreposição no PostgreSQL...")
+    if not shutil.which('initdb') or not shutil.which('pg_ctl'):
+        pytest.skip("initdb/pg_ctl não encontrados - teste do PostgreSQL ignorado")
+    
+    pasta = tempfile.mkdtemp(prefix='barbearia-pg-')
+    dados = os.path.join(pasta, 'dados')
+    porta = os.getenv('PG_TESTE_PORTA', '54329')
+    try:
+        subprocess.run(['initdb', '-D', dados, '-U', 'postgres', '-A', 'trust'], check=True, capture_output=True)
+        subprocess.run(['pg_ctl', '-D', dados, '-o', f'-p {porta} -k {pasta}', '-w', 'start'],
+                       check=True, capture_output=True)
+        
+        resultado = _rodar_script(SCRIPT_SOBREPOSICAO, DATABASE_URL=f'postgresql://postgres@localhost:{porta}/postgres')
+        if resultado == 'RECUSADO':
+            print("✅ PostgreSQL recusou o agendamento sobreposto")
+        else:
+            print(f"❌ Sobreposição não foi recusada: {resultado}")
+        assert resultado == 'RECUSADO'
+    finally:
+        subprocess.run(['pg_ctl', '-D', dados, '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(pasta, ignore_errors=True)
+
+# Webhook apontando para um http.server local que primeiro responde 500 e depois 200;
+# roda flask outbox/webhooks --uma-vez e informa o que chegou
+SCRIPT_WEBHOOKS = """
+import hashlib, hmac, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+recebidos = []
+status_resposta = [500]
+
+class Receptor(BaseHTTPRequestHandler):
+    def do_POST(self):
+        corpo = self.rfile.read(int(self.headers['Content-Length']))
+        esperada = 'sha256=' + hmac.new(b'segredo', corpo, hashlib.sha256).hexdigest()
+        recebidos.append({'eventos': json.loads(corpo)['eventos'],
+                          'assinatura_ok': self.headers['X-Barbearia-Assinatura'] == esperada,
+                          'status': status_resposta[0]})
+        self.send_response(status_resposta[0])
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+servidor = ThreadingHTTPServer(('127.0.0.1', 0), Receptor)
+threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+ids = criar_barbearia()
+with app.app_context():
+    db.session.add(barbearia.Webhook(url=f'http://127.0.0.1:{servidor.server_port}/ganchos', segredo='segredo',
+                                     eventos='agendamento-criado', barbearia_id=ids.loja))
+    db.session.commit()
+inicio = datetime.now().replace(microsecond=0) + timedelta(days=1)
+for horas in (0, 1):
+    agendar(ids, inicio + timedelta(hours=horas))
+
+def entregas():
+    with app.app_context():
+        return [{'status': entrega.status, 'tentativas': entrega.tentativas, 'erro': entrega.erro,
+                 'aguardando': entrega.proxima_tentativa_em > datetime.utcnow()}
+                for entrega in barbearia.EntregaWebhook.query.order_by(barbearia.EntregaWebhook.id)]
+
+cli = app.test_cli_runner()
+cli.invoke(args=['outbox', '--uma-vez'])
+cli.invoke(args=['webhooks', '--uma-vez'])
+apos_falha = entregas()
+
+# A nova tentativa fica para depois; antecipa e deixa o receptor aceitar
+status_resposta[0] = 200
+with app.app_context():
+    barbearia.EntregaWebhook.query.update({'proxima_tentativa_em': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+cli.invoke(args=['webhooks', '--uma-vez'])
+servidor.shutdown()
+print(json.dumps({'recebidos': recebidos, 'apos_falha': apos_falha, 'apos_sucesso': entregas()}))
+"""
+
+def test_webhooks():
+    """Entrega em lote para um servidor HTTP local, com nova tentativa depois de um 500"""
+    print("\n🔗 Testando entrega de webhooks...")
+    resultado = _rodar_script(SCRIPT_WEBHOOKS)
+    
+    recebidos = resultado['recebidos']
+    # Os dois eventos vão juntos em um único POST, nas duas tentativas
+    assert [len(requisicao['eventos']) for requisicao in recebidos] == [2, 2]
+    assert all(requisicao['assinatura_ok'] for requisicao in recebidos)
+    assert {evento['tipo'] for evento in recebidos[0]['eventos']} == {'agendamento-criado'}
+    
+    assert [(entrega['status'], entrega['tentativas']) for entrega in resultado['apos_falha']] == [('pendente', 1)] * 2
+    assert all(entrega['aguardando'] and entrega['erro'] == 'HTTP 500' for entrega in resultado['apos_falha'])
+    assert [(entrega['status'], entrega['tentativas']) for entrega in resultado['apos_sucesso']] == [('entregue', 2)] * 2
+    print("✅ Webhooks entregues em lote e repetidos após falha")
+
+SCRIPT_LEMBRETES = """
+import os
+
+agora = datetime.now().replace(microsecond=0)
+ids = criar_barbearia(email='cliente@teste.com')
+# Em 1h30 (lembrete de 1h vence no ciclo), em 2h cancelado e em 3 dias (nada vence)
+for horas, status in ((1.5, 'confirmado'), (2, 'cancelado'), (72, 'confirmado')):
+    agendar(ids, agora + timedelta(hours=horas), status=status)
+
+def novo_agendador():
+    # Montado como no flask lembretes, com o enviador de arquivo
+    return barbearia.AgendadorLembretes(barbearia._carregar_lembretes, barbearia._marcar_lembretes_enviados,
+                                        barbearia._enviador_lembretes(),
+                                        janela=timedelta(seconds=app.config['LEMBRETES_JANELA_SEGUNDOS']))
+
+def enviados():
+    with open(os.environ['LEMBRETES_ARQUIVO'], encoding='utf-8') as arquivo:
+        return [json.loads(linha) for linha in arquivo]
+
+# O ciclo roda uma hora à frente: só o lembrete de 1h dos agendamentos em até 2h já venceu
+ciclo = agora + timedelta(hours=1, minutes=5)
+with app.app_context():
+    agendador = novo_agendador()
+    agendador.ciclo(agora=ciclo)
+    primeiro = enviados()
+    agendador.ciclo(agora=ciclo)
+    novo_agendador().ciclo(agora=ciclo)
+    Lembrete, Agendamento = barbearia.Lembrete, barbearia.Agendamento
+    lembretes = [{'horas': (data_hora - agora).total_seconds() / 3600,
+                  'antecedencia': lembrete.antecedencia, 'enviado': lembrete.enviado_em is not None}
+                 for lembrete, data_hora in db.session.execute(db.select(Lembrete, Agendamento.data_hora).join(
+                     Agendamento, Agendamento.id == Lembrete.agendamento_id
+                 ).order_by(Agendamento.data_hora, Lembrete.antecedencia))]
+print(json.dumps({'primeiro': primeiro, 'depois': enviados(), 'lembretes': lembretes}))
+"""
+
+def test_lembretes():
+    """Um ciclo do agendador grava no arquivo só os lembretes vencidos, e eles não são reenviados"""
+    print("\n⏰ Testando envio de lembretes...")
+    resultado = _rodar_script(SCRIPT_LEMBRETES, LEMBRETES_ENVIADOR='arquivo',
+                              LEMBRETES_ARQUIVO=os.path.join('{pasta}', 'lembretes.jsonl'))
+    
+    primeiro = resultado['primeiro']
+    assert [mensagem['para'] for mensagem in primeiro] == ['cliente@teste.com']
+    assert primeiro[0]['assunto'].startswith('Lembrete: Corte em ')
+    # Novos ciclos (no mesmo agendador ou em outro processo) não repetem a mensagem
+    assert resultado['depois'] == primeiro
+    
+    # O cancelado é descartado sem envio; os de 24h antes e o do agendamento em 3 dias seguem pendentes
+    assert [(lembrete['horas'], lembrete['antecedencia'], lembrete['enviado']) for lembrete in resultado['lembretes']] == [
+        (1.5, 60, True), (2, 60, True), (72, 60, False), (72, 1440, False)]
+    print("✅ Lembretes vencidos enviados uma única vez")
+
+SCRIPT_REPLICAS = """
+from sqlalchemy import insert, select, update
+from roteamento import somente_leitura
+
+User = barbearia.User
+
+@app.get('/teste/emails')
+@somente_leitura
+def emails():
+    return {'emails': db.session.scalars(select(User.email).order_by(User.id)).all()}
+
+@app.post('/teste/gravar')
+@somente_leitura
+def gravar():
+    # Leitura logo depois de uma escrita na mesma requisição, antes e depois do commit
+    usuario = User(nome='Novo', email='novo@teste.com', password='x')
+    db.session.add(usuario)
+    db.session.flush()
+    antes_commit = db.session.scalars(select(User.email).order_by(User.id)).all()
+    db.session.commit()
+    return {'antes_commit': antes_commit, 'depois_commit': emails()['emails']}
+
+@app.post('/teste/renomear')
+def renomear():
+    # UPDATE direto, sem flush da sessão (como em _fechar_dia)
+    db.session.execute(update(User.__table__).where(User.email == 'principal@teste.com').values(nome='Renomeado'))
+    db.session.commit()
+    return {}
+
+# Mesmo esquema nos dois arquivos, com um usuário diferente em cada um para saber quem respondeu
+with app.app_context():
+    replica = db.engines['replica_0']
+    db.metadata.create_all(bind=replica)
+    for engine, email in ((db.engine, 'principal@teste.com'), (replica, 'replica@teste.com')):
+        with engine.begin() as conexao:
+            conexao.execute(insert(User.__table__).values(nome='Teste', email=email, password='x'))
+
+cliente = app.test_client()
+resultado = {
+    'leitura': cliente.get('/teste/emails').json['emails'],
+    'gravacao': cliente.post('/teste/gravar').json,
+    'apos_gravar': cliente.get('/teste/emails').json['emails'],
+    'outro_cliente': app.test_client().get('/teste/emails').json['emails']
+}
+cliente = app.test_client()
+cliente.post('/teste/renomear')
+resultado['apos_update'] = cliente.get('/teste/emails').json['emails']
+print(json.dumps(resultado))
+"""
+
+def test_replicas():
+    """SessaoRoteada com dois arquivos SQLite: leituras na réplica, read-your-writes no principal"""
+    print("\n🪞 Testando roteamento para réplica...")
+    resultado = _rodar_script(SCRIPT_REPLICAS, DATABASE_REPLICA_URLS='sqlite:///' + os.path.join('{pasta}', 'replica.db'))
+    
+    principal = ['principal@teste.com', 'novo@teste.com']
+    assert resultado['leitura'] == ['replica@teste.com']
+    assert resultado['gravacao'] == {'antes_commit': principal, 'depois_commit': principal}
+    # O cookie de sessão mantém o mesmo usuário no principal; outros continuam na réplica
+    assert resultado['apos_gravar'] == principal
+    assert resultado['outro_cliente'] == ['replica@teste.com']
+    # UPDATE feito com session.execute() também prende o usuário ao principal
+    assert resultado['apos_update'] == principal
+    print("✅ Leituras na réplica e leituras após escrita no principal")
+
+# GETs condicionais do painel: 304 com a mesma ETag, 200 depois de mudar dados, templates ou estáticos
+SCRIPT_ETAG = """
+ids = criar_barbearia()
+cliente = cliente_logado()
+etags = {}
+
+def pedir(rota, nome):
+    resposta = cliente.get(rota, headers={'If-None-Match': etags.get(rota, '')})
+    etags[rota] = resposta.headers.get('ETag', etags.get(rota))
+    return [nome, resposta.status_code]
+
+rotas = ['/dashboard', f'/barbearia/{ids.loja}/horarios']
+passos = [pedir(rota, 'primeira') for rota in rotas] + [pedir(rota, 'repetida') for rota in rotas]
+
+# Dados do dono mudam: as duas rotas dependem do cadastro
+with app.app_context():
+    db.session.add(barbearia.Profissional(nome='Outro', barbearia_id=ids.loja))
+    db.session.commit()
+passos += [pedir(rota, 'cadastro') for rota in rotas] + [pedir(rota, 'repetida') for rota in rotas]
+
+# Deploy: novos nomes com hash dos estáticos e, depois, templates alterados
+barbearia.ativos.versao = 'deploy-novo'
+passos.append(pedir('/dashboard', 'estaticos'))
+app.jinja_env.auto_reload = False
+barbearia.versao_templates = 'templates-novos'
+passos += [pedir('/dashboard', 'templates'), pedir('/dashboard', 'repetida')]
+print(json.dumps(passos))
+"""
+
+def test_etag():
+    """ETag do painel e da API de horários: 304 só enquanto dados e deploy não mudam"""
+    print("\n🏷️ Testando GET condicional (ETag/304)...")
+    passos = _rodar_script(SCRIPT_ETAG)
+    
+    assert [tuple(passo) for passo in passos] == [
+        ('primeira', 200), ('primeira', 200), ('repetida', 304), ('repetida', 304),
+        ('cadastro', 200), ('cadastro', 200), ('repetida', 304), ('repetida', 304),
+        ('estaticos', 200), ('templates', 200), ('repetida', 304)]
+    print("✅ 304 para versões iguais e página nova após mudança de dados ou deploy")
+
+# Cancelamento oferece a vaga ao 1º da lista; sem resposta no prazo, flask outbox a passa ao 2º
+SCRIPT_OFERTA_EXPIRADA = """
+ids = criar_barbearia()
+amanha = date.today() + timedelta(days=1)
+cancelado = agendar(ids, datetime.combine(amanha, time(10)))
+with app.app_context():
+    for _ in range(2):
+        db.session.add(barbearia.ListaEspera(data=amanha, janela_inicio=time(9), janela_fim=time(12), cliente_id=ids.dono,
+                                             profissional_id=ids.profissional, servico_id=ids.servico))
+    db.session.get(barbearia.Agendamento, cancelado).status = 'cancelado'
+    db.session.commit()
+
+def lista():
+    with app.app_context():
+        return [[espera.status, espera.oferta_inicio and espera.oferta_inicio.isoformat()]
+                for espera in barbearia.ListaEspera.query.order_by(barbearia.ListaEspera.id)]
+
+cli = app.test_cli_runner()
+cli.invoke(args=['outbox', '--uma-vez'])
+oferecida = lista()
+with app.app_context():
+    # O cliente não respondeu: o prazo da oferta passou
+    barbearia.ListaEspera.query.filter_by(status='oferecido').update(
+        {'oferta_expira_em': datetime.now() - timedelta(minutes=1)})
+    db.session.commit()
+cli.invoke(args=['outbox', '--uma-vez'])
+# O dia ficou livre: a oferta é no início da janela dos clientes
+print(json.dumps({'vaga': datetime.combine(amanha, time(9)).isoformat(), 'oferecida': oferecida, 'expirada': lista()}))
+"""
+
+def test_oferta_expirada():
+    """Oferta da lista de espera sem resposta expira sozinha e a vaga vai para o próximo"""
+    print("\n⌛ Testando expiração de ofertas da lista de espera...")
+    resultado = _rodar_script(SCRIPT_OFERTA_EXPIRADA)
+    
+    vaga = resultado['vaga']
+    assert resultado['oferecida'] == [['oferecido', vaga], ['aguardando', None]]
+    assert resultado['expirada'] == [['expirado', vaga], ['oferecido', vaga]]
+    print("✅ Vaga repassada ao próximo da lista após a oferta expirar")
+
+# /agendar-servicos: corte + barba em sequência, com o 1º profissional ocupado às 9h
+SCRIPT_ITINERARIO = """
+ids = criar_barbearia(profissionais=('Ana', 'Bruno'), servicos=(('Corte', 30), ('Barba', 20)))
+amanha = date.today() + timedelta(days=1)
+agendar(ids, datetime.combine(amanha, time(9)))
+ana, bruno = ids.profissionais
+outra = criar_barbearia(email='outra@teste.com')
+cliente = cliente_logado()
+
+def pedir(**campos):
+    resposta = cliente.post('/agendar-servicos', json=dict(
+        servico_ids=ids.servicos, data=amanha.isoformat(), a_partir_de='09:00', **campos))
+    corpo = resposta.get_json()
+    partes = [[parte['profissional_id'], parte['inicio'][11:16], parte['fim'][11:16]] for parte in corpo.get('itinerario', [])]
+    return [resposta.status_code, corpo['success'], partes]
+
+resultado = {
+    'nomes': {str(ana): 'ana', str(bruno): 'bruno'},
+    'qualquer': pedir(reservar=False),
+    'mesmo': pedir(reservar=False, profissional_ids=[ana, ana]),
+    'misto': pedir(reservar=False, profissional_ids=[bruno, None]),
+    'outra_barbearia': pedir(reservar=False, profissional_ids=[outra.profissional, None]),
+    'inexistente': pedir(reservar=False, profissional_ids=[None, 9999]),
+    'reservar_texto': pedir(reservar='false'),
+    'reservado': pedir(),
+}
+with app.app_context():
+    resultado['gravados'] = barbearia.Agendamento.query.count()
+print(json.dumps(resultado))
+"""
+
+def test_itinerario():
+    """Vários serviços em sequência: encaixe nos profissionais livres e validação da escolha do cliente"""
+    print("\n✂️ Testando itinerário de vários serviços...")
+    resultado = _rodar_script(SCRIPT_ITINERARIO)
+    nomes = resultado['nomes']
+    
+    def partes(chave):
+        status, sucesso, itinerario = resultado[chave]
+        assert (status, sucesso) == (200, True), resultado[chave]
+        return [(nomes[str(profissional)], inicio, fim) for profissional, inicio, fim in itinerario]
+    
+    # Ana está ocupada às 9h: Bruno faz os dois em sequência, sem intervalo
+    assert partes('qualquer') == [('bruno', '09:00', '09:30'), ('bruno', '09:30', '09:50')]
+    # Só com a Ana, a visita começa quando ela fica livre
+    assert partes('mesmo') == [('ana', '09:30', '10:00'), ('ana', '10:00', '10:20')]
+    assert partes('misto') == [('bruno', '09:00', '09:30'), ('bruno', '09:30', '09:50')]
+    # Profissional de outra barbearia ou inexistente, e reservar que não é booleano: erro, nada é gravado
+    for chave in ('outra_barbearia', 'inexistente', 'reservar_texto'):
+        assert resultado[chave][:2] == [400, False], (chave, resultado[chave])
+    assert partes('reservado') == partes('qualquer')
+    assert resultado['gravados'] == 3
+    print("✅ Itinerário montado e escolhas inválidas recusadas")
+
+# /agendar-serie com 52 semanas, contando os comandos SQL da gravação
+SCRIPT_SERIE = """
+from collections import Counter
+from sqlalchemy import event
+
+ids = criar_barbearia()
+inicio = datetime.combine(date.today() + timedelta(days=1), time(10))
+agendar(ids, inicio + timedelta(weeks=3))
+cliente = cliente_logado()
+
+comandos = Counter()
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def contar(conexao, cursor, sql, parametros, contexto, varios):
+        comandos[' '.join(sql.split()[:4])] += 1
+
+resposta = cliente.post('/agendar-serie', json={'profissional_id': ids.profissional, 'servico_id': ids.servico,
+                                                'data_hora': inicio.isoformat(), 'regra': 'FREQ=WEEKLY;COUNT=52',
+                                                'ignorar_conflitos': True}).get_json()
+with app.app_context():
+    erradas = sum(agendamento.data_hora_fim != agendamento.data_hora + timedelta(minutes=30)
+                  for agendamento in barbearia.Agendamento.query)
+print(json.dumps({'resposta': resposta, 'comandos': comandos, 'fim_errado': erradas}))
+"""
+
+def test_serie():
+    """Série de 52 semanas: conflito informado e gravação sem uma consulta de duração por ocorrência"""
+    print("\n🔁 Testando agendamento em série...")
+    resultado = _rodar_script(SCRIPT_SERIE)
+    resposta, comandos = resultado['resposta'], resultado['comandos']
+    
+    assert resposta['success'] and len(resposta['agendados']) == 51
+    assert [conflito['data_hora'][:10] for conflito in resposta['conflitos']] == [
+        (date.today() + timedelta(days=1, weeks=3)).isoformat()]
+    # data_hora_fim vem do serviço já carregado; agendamento novo não tem lembretes a apagar
+    assert not [sql for sql in comandos if sql.startswith('SELECT servicos.duracao')], comandos
+    assert not [sql for sql in comandos if sql.startswith('DELETE FROM lembretes')], comandos
+    assert resultado['fim_errado'] == 0
+    print("✅ Série gravada em lote, com o fim de cada ocorrência correto")
+
+def test_lista_espera():
+    """Encaixe da lista de espera: maior serviço que cabe, janela do cliente respeitada"""
+    print("\n🪑 Testando encaixe da lista de espera...")
+    dia = datetime(2030, 1, 7)
+    
+    def as_(hora, minuto=0):
+        return dia.replace(hour=hora, minute=minuto)
+    
+    fila = FilaEspera([
+        PedidoEspera(1, 30, as_(9), as_(12)),
+        PedidoEspera(2, 60, as_(13), as_(18)),    # Janela começa depois da vaga das 10h
+        PedidoEspera(3, 45, as_(9), as_(10, 30)),  # Só cabe se começar até 9h45
+        PedidoEspera(4, 45, as_(10), as_(12)),
+        PedidoEspera(5, 90, as_(8), as_(9)),       # Serviço maior que a própria janela
+        PedidoEspera(6, 30, as_(9), as_(12)),
+    ])
+    
+    # Vaga das 10h às 11h: o de 45 min cuja janela ainda cobre a vaga, antes dos de 30 min
+    assert fila.encaixar(as_(10), as_(11)) == (PedidoEspera(4, 45, as_(10), as_(12)), as_(10))
+    assert 4 not in fila and len(fila) == 5
+    # Mesma duração e mesma janela: o pedido mais antigo
+    assert fila.encaixar(as_(10), as_(11))[0].id == 1
+    # A janela do pedido 3 termina às 10h30: numa vaga às 10h ele não cabe
+    assert fila.encaixar(as_(10), as_(11))[0].id == 6
+    assert fila.encaixar(as_(10), as_(11)) is None
+    # Vaga que começa antes da janela: a oferta é no início da janela
+    assert fila.encaixar(as_(12, 30), as_(14, 30)) == (PedidoEspera(2, 60, as_(13), as_(18)), as_(13))
+    assert fila.encaixar(as_(9, 30), as_(10, 30))[0].id == 3
+    assert fila.remover(5) is not None and len(fila) == 0
+    
+    # Filas de dias futuros continuam em memória quando outro dia é carregado
+    lidas = []
+    filas = FilasEspera(lambda profissional_id, dia: (lidas.append(dia) or [], 0))
+    hoje = date.today()
+    for dias in (2, 3, 2, -1, 3):
+        filas.fila(1, hoje + timedelta(days=dias))
+    assert lidas == [hoje + timedelta(days=dias) for dias in (2, 3, -1)]
+    print("✅ Vagas oferecidas ao pedido que melhor se encaixa")
+
+# Outbox lida pela agenda ao vivo com o id 2 reservado mas gravado depois do 3
+SCRIPT_AGENDA_AO_VIVO = """
+from app import _ler_eventos_agenda, EventoSaida
+ids = criar_barbearia()
+ultimos = {}
+_ler_eventos_agenda(ultimos)
+agendar(ids, datetime.combine(date.today() + timedelta(days=1), time(9)))
+
+def evento(id_):
+    with app.app_context():
+        db.session.add(EventoSaida(id=id_, tipo='agendamento-criado', agregado_id=1,
+                                   dados=json.dumps({'profissional_id': ids.profissional, 'data_hora': None})))
+        db.session.commit()
+
+def lidos():
+    return [evento.id for evento in _ler_eventos_agenda(ultimos)]
+
+evento(3)
+resultado = {'antes': lidos()}
+evento(2)
+resultado['atrasado'] = lidos()
+resultado['depois'] = lidos()
+print(json.dumps(resultado))
+"""
+
+def test_agenda_ao_vivo():
+    """Id com commit atrasado ainda chega ao canal, e quem reconecta recebe o que perdeu"""
+    print("\n📡 Testando leitura da outbox da agenda ao vivo...")
+    posicao = PosicaoOutbox(10, espera=60)
+    # O 12 foi lido antes do 11 ficar visível: o 11 vira lacuna e continua sendo procurado
+    posicao.avancar([12, 14])
+    assert posicao.ultimo == 14 and posicao.lacunas() == [11, 13]
+    posicao.preencher([11])
+    assert posicao.lacunas() == [13]
+    # Transação desfeita: a lacuna é esquecida depois da espera
+    posicao.espera = 0
+    assert posicao.lacunas() == []
+    
+    canal = CanalAoVivo()
+    for id_ in (12, 14, 11):
+        canal.publicar(EventoAgenda(id_, 'agendamento.criado', ('barbearia:1',), {}))
+    # Recebeu o 14 e caiu antes do 11: o 11 é reenviado mesmo sendo menor
+    assinatura = canal.assinar('barbearia:1', ultimo_id=14)
+    assert assinatura.fila.get_nowait().id == 11 and assinatura.fila.empty()
+    # Id fora do histórico: reenvia pelo número
+    assert canal.assinar('barbearia:1', ultimo_id=13).fila.qsize() == 1
+    
+    resultado = _rodar_script(SCRIPT_AGENDA_AO_VIVO)
+    assert resultado == {'antes': [1, 3], 'atrasado': [2], 'depois': []}
+    print("✅ Eventos atrasados publicados e reenviados")
+
 if __name__ == "__main__":
-    test_app()
+    for teste in (test_app, test_postgresql, test_webhooks, test_lembretes, test_replicas, test_etag, test_lista_espera,
+                  test_oferta_expirada, test_itinerario, test_serie, test_agenda_ao_vivo):
+        try:
+            teste()
+        except pytest.skip.Exception as motivo:
+            print(f"⚠️ {motivo}")
 
 
 
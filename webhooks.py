@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Entrega dos webhooks das barbearias
+As entregas pendentes são agrupadas por endpoint e cada grupo vai em um único
+POST ({"eventos": [...]}) assinado com HMAC-SHA256. Os envios rodam em paralelo
+com asyncio, reaproveitando conexões keep-alive e respeitando um limite de
+requisições simultâneas por endpoint
+"""
+
+import asyncio
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import random
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+CABECALHO_ASSINATURA = 'X-Barbearia-Assinatura'
+
+# banco é o nome da bind onde a entrega foi gravada (None = banco principal)
+Entrega = namedtuple('Entrega', 'id banco webhook_id url segredo evento_id tipo dados tentativas')
+
+
+def assinar(segredo, corpo):
+    """Valor do cabeçalho de assinatura; o receptor recalcula com o mesmo segredo"""
+    return 'sha256=' + hmac.new(segredo.encode(), corpo, hashlib.sha256).hexdigest()
+
+
+class ConexoesEndpoint:
+    """Conexões HTTP keep-alive de um endpoint, reaproveitadas entre os envios"""
+
+    def __init__(self, url, tempo_limite=10):
+        partes = urlsplit(url)
+        self.classe = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self.servidor = partes.hostname
+        self.porta = partes.port
+        self.caminho = (partes.path or '/') + (f'?{partes.query}' if partes.query else '')
+        self.tempo_limite = tempo_limite
+        self._livres = []
+
+    def enviar(self, corpo, cabecalhos):
+        """POST bloqueante (roda em uma thread); retorna o status HTTP"""
+        if self._livres:
+            conexao = self._livres.pop()
+            try:
+                return self._requisitar(conexao, corpo, cabecalhos)
+            except (OSError, http.client.HTTPException):
+                # O servidor pode ter fechado a conexão ociosa; tenta uma vez com outra
+                pass
+        return self._requisitar(self.classe(self.servidor, self.porta, timeout=self.tempo_limite), corpo, cabecalhos)
+
+    def fechar(self):
+        while self._livres:
+            self._livres.pop().close()
+
+    def _requisitar(self, conexao, corpo, cabecalhos):
+        try:
+            conexao.request('POST', self.caminho, body=corpo, headers=cabecalhos)
+            resposta = conexao.getresponse()
+            resposta.read()
+        except (OSError, http.client.HTTPException):
+            conexao.close()
+            raise
+        if resposta.will_close:
+            conexao.close()
+        else:
+            self._livres.append(conexao)
+        return resposta.status
+
+
+class EntregadorWebhooks:
+    """
+    Envia as entregas pendentes em lotes por endpoint
+
+    carregar()             -- entregas prontas para envio: lista de Entrega
+    registrar(resultados)  -- grava o resultado: lista de (Entrega, erro ou None)
+    """
+
+    def __init__(self, carregar, registrar, limite_por_endpoint=2, lote_por_endpoint=50, tempo_limite=10):
+        self.carregar = carregar
+        self.registrar = registrar
+        self.limite_por_endpoint = limite_por_endpoint
+        self.lote_por_endpoint = lote_por_endpoint
+        self.tempo_limite = tempo_limite
+        self._conexoes = {}
+
+    def processar(self):
+        """Uma passada: carrega, envia e registra; retorna quantas entregas foram tentadas"""
+        entregas = self.carregar()
+        if not entregas:
+            return 0
+        self.registrar(asyncio.run(self.entregar(entregas)))
+        return len(entregas)
+
+    def executar(self, parar, intervalo=1.0):
+        """Processa continuamente; espera 'intervalo' segundos quando não há entregas"""
+        try:
+            while not parar.is_set():
+                try:
+                    tentadas = self.processar()
+                except Exception:
+                    logger.exception('Falha ao entregar webhooks')
+                    tentadas = 0
+                if not tentadas:
+                    parar.wait(intervalo)
+        finally:
+            self.fechar()
+
+    def fechar(self):
+        for conexoes in self._conexoes.values():
+            conexoes.fechar()
+        self._conexoes.clear()
+
+    async def entregar(self, entregas):
+        """Envia todos os grupos em paralelo; retorna [(Entrega, erro ou None), ...]"""
+        por_webhook = {}
+        for entrega in entregas:
+            por_webhook.setdefault(entrega.webhook_id, []).append(entrega)
+
+        # Semáforos criados a cada passada: pertencem ao laço de eventos do asyncio.run atual
+        semaforos = {}
+        grupos = []
+        for itens in por_webhook.values():
+            semaforo = semaforos.setdefault(itens[0].url, asyncio.Semaphore(self.limite_por_endpoint))
+            for inicio in range(0, len(itens), self.lote_por_endpoint):
+                grupos.append(self._enviar_grupo(itens[inicio:inicio + self.lote_por_endpoint], semaforo))
+        return [resultado for grupo in await asyncio.gather(*grupos) for resultado in grupo]
+
+    async def _enviar_grupo(self, itens, semaforo):
+        primeiro = itens[0]
+        conexoes = self._conexoes.get(primeiro.url)
+        if conexoes is None:
+            conexoes = self._conexoes[primeiro.url] = ConexoesEndpoint(primeiro.url, self.tempo_limite)
+
+        corpo = json.dumps({'eventos': [
+            {'id': entrega.evento_id, 'tipo': entrega.tipo, 'dados': entrega.dados} for entrega in itens
+        ]}).encode()
+        cabecalhos = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'BarbeariaApp-Webhooks',
+            CABECALHO_ASSINATURA: assinar(primeiro.segredo, corpo),
+        }
+        async with semaforo:
+            try:
+                status = await asyncio.to_thread(conexoes.enviar, corpo, cabecalhos)
+                erro = None if 200 <= status < 300 else f'HTTP {status}'
+            except Exception as excecao:
+                erro = f'{type(excecao).__name__}: {excecao}'
+        if erro:
+            logger.warning('Webhook %s (%s): %s', primeiro.webhook_id, primeiro.url, erro)
+        return [(entrega, erro) for entrega in itens]
+
+
+def espera(tentativas, base=30, maximo=3600):
+    """Segundos até a próxima tentativa: dobra a cada falha, com variação aleatória"""
+    atraso = min(base * 2 ** (tentativas - 1), maximo)
+    return random.uniform(atraso / 2, atraso)
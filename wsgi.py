@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Ponto de entrada WSGI para produção
+Uso: gunicorn -c gunicorn.conf.py wsgi:app
+
+Com preload_app (gunicorn.conf.py) este módulo é importado uma única vez no
+processo mestre: modelos, mapeamentos e templates ficam prontos antes do fork
+e os workers compartilham essas páginas de memória
+"""
+
+import os
+
+os.environ.setdefault('FLASK_CONFIG', 'production')
+
+from sqlalchemy.orm import configure_mappers
+
+from app import app, db, precompilar_templates
+
+
+def preaquecer():
+    """Faz no mestre o trabalho que cada worker faria na primeira requisição"""
+    # Relacionamentos e backrefs de todos os modelos
+    configure_mappers()
+    # Templates compilados ficam no cache do ambiente Jinja; o bytecode em disco
+    # (instance/jinja_cache) evita recompilar o HTML a cada deploy ou reinício
+    precompilar_templates()
+
+
+def reiniciar_conexoes():
+    """
+    Chamado em cada worker logo após o fork
+    Conexões abertas no mestre (criação das tabelas) não podem ser usadas por
+    vários processos; close=False descarta o pool sem fechar o socket do mestre
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+preaquecer()